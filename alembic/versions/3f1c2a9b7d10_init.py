@@ -0,0 +1,66 @@
+"""init
+
+Revision ID: 3f1c2a9b7d10
+Revises: 
+Create Date: 2026-10-17 09:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '3f1c2a9b7d10'
+down_revision = None
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.create_table('project',
+    sa.Column('project_id', sa.String(), nullable=False),
+    sa.Column('fastq_symlinks_directory', sa.String(), nullable=True),
+    sa.Column('timestamp_updated', sa.DateTime(), nullable=True),
+    sa.PrimaryKeyConstraint('project_id')
+    )
+    op.create_table('sequencing_run',
+    sa.Column('sequencing_run_id', sa.String(), nullable=False),
+    sa.Column('instrument_type', sa.String(), nullable=True),
+    sa.Column('instrument_id', sa.String(), nullable=True),
+    sa.Column('run_date', sa.Date(), nullable=True),
+    sa.Column('run_directory', sa.String(), nullable=True),
+    sa.Column('fastq_directory', sa.String(), nullable=True),
+    sa.Column('samplesheet', sa.String(), nullable=True),
+    sa.Column('timestamp_updated', sa.DateTime(), nullable=True),
+    sa.PrimaryKeyConstraint('sequencing_run_id')
+    )
+    op.create_table('library',
+    sa.Column('library_id', sa.String(), nullable=False),
+    sa.Column('sequencing_run_id', sa.String(), nullable=False),
+    sa.Column('project_id', sa.String(), nullable=True),
+    sa.Column('fastq_path_r1', sa.String(), nullable=True),
+    sa.Column('fastq_path_r2', sa.String(), nullable=True),
+    sa.Column('timestamp_updated', sa.DateTime(), nullable=True),
+    sa.ForeignKeyConstraint(['project_id'], ['project.project_id'], ),
+    sa.ForeignKeyConstraint(['sequencing_run_id'], ['sequencing_run.sequencing_run_id'], ),
+    sa.PrimaryKeyConstraint('library_id', 'sequencing_run_id')
+    )
+    op.create_table('symlink',
+    sa.Column('project_id', sa.String(), nullable=True),
+    sa.Column('sequencing_run_id', sa.String(), nullable=True),
+    sa.Column('library_id', sa.String(), nullable=True),
+    sa.Column('path', sa.String(), nullable=False),
+    sa.Column('target', sa.String(), nullable=False),
+    sa.Column('timestamp_updated', sa.DateTime(), nullable=True),
+    # No foreign key on library_id: it isn't unique in the library table, and PostgreSQL won't create one.
+    sa.ForeignKeyConstraint(['project_id'], ['project.project_id'], ),
+    sa.ForeignKeyConstraint(['sequencing_run_id'], ['sequencing_run.sequencing_run_id'], ),
+    sa.PrimaryKeyConstraint('path', 'target')
+    )
+
+
+def downgrade() -> None:
+    op.drop_table('symlink')
+    op.drop_table('library')
+    op.drop_table('sequencing_run')
+    op.drop_table('project')
@@ -0,0 +1,45 @@
+"""add run fingerprint and symlink directory
+
+Revision ID: 8b4e6d2c5a31
+Revises: 3f1c2a9b7d10
+Create Date: 2026-10-17 09:05:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '8b4e6d2c5a31'
+down_revision = '3f1c2a9b7d10'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.create_table('sequencing_run_fingerprint',
+    sa.Column('sequencing_run_id', sa.String(), nullable=False),
+    sa.Column('run_directory_mtime', sa.Float(), nullable=True),
+    sa.Column('samplesheet_mtime', sa.Float(), nullable=True),
+    sa.Column('samplesheet_size', sa.Integer(), nullable=True),
+    sa.Column('fastq_directory_mtime', sa.Float(), nullable=True),
+    sa.Column('layout', sa.String(), nullable=True),
+    sa.Column('layout_directory_mtimes', sa.JSON(), nullable=True),
+    sa.Column('timestamp_updated', sa.DateTime(), nullable=True),
+    sa.ForeignKeyConstraint(['sequencing_run_id'], ['sequencing_run.sequencing_run_id'], ),
+    sa.PrimaryKeyConstraint('sequencing_run_id')
+    )
+    op.create_table('symlink_directory',
+    sa.Column('path', sa.String(), nullable=False),
+    sa.Column('project_id', sa.String(), nullable=True),
+    sa.Column('sequencing_run_id', sa.String(), nullable=True),
+    sa.Column('directory_mtime', sa.Float(), nullable=True),
+    sa.Column('timestamp_updated', sa.DateTime(), nullable=True),
+    sa.ForeignKeyConstraint(['project_id'], ['project.project_id'], ),
+    sa.PrimaryKeyConstraint('path')
+    )
+
+
+def downgrade() -> None:
+    op.drop_table('symlink_directory')
+    op.drop_table('sequencing_run_fingerprint')
@@ -0,0 +1,30 @@
+"""add indexes for per-run queries
+
+Revision ID: c7a9e1f04b62
+Revises: 8b4e6d2c5a31
+Create Date: 2026-10-17 09:10:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c7a9e1f04b62'
+down_revision = '8b4e6d2c5a31'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.create_index('ix_library_sequencing_run_id', 'library', ['sequencing_run_id'], unique=False)
+    op.create_index('ix_library_project_id_sequencing_run_id', 'library', ['project_id', 'sequencing_run_id'], unique=False)
+    op.create_index('ix_symlink_sequencing_run_id', 'symlink', ['sequencing_run_id'], unique=False)
+    op.create_index('ix_symlink_project_id_target', 'symlink', ['project_id', 'target'], unique=False)
+
+
+def downgrade() -> None:
+    op.drop_index('ix_symlink_project_id_target', table_name='symlink')
+    op.drop_index('ix_symlink_sequencing_run_id', table_name='symlink')
+    op.drop_index('ix_library_project_id_sequencing_run_id', table_name='library')
+    op.drop_index('ix_library_sequencing_run_id', table_name='library')
@@ -0,0 +1,47 @@
+"""drop unenforceable foreign keys
+
+Revision ID: d2f5b8a3c914
+Revises: c7a9e1f04b62
+Create Date: 2026-10-17 10:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'd2f5b8a3c914'
+down_revision = 'c7a9e1f04b62'
+branch_labels = None
+depends_on = None
+
+# SQLite doesn't name foreign keys, so batch mode needs a naming convention to find them.
+naming_convention = {
+    "fk": "fk_%(table_name)s_%(column_0_name)s_%(referred_table_name)s",
+}
+
+
+def _drop_foreign_keys(table_name, column_names):
+    foreign_key_names = []
+    for foreign_key in sa.inspect(op.get_bind()).get_foreign_keys(table_name):
+        column_name = foreign_key['constrained_columns'][0]
+        if foreign_key['constrained_columns'] == [column_name] and column_name in column_names:
+            default_name = "fk_" + table_name + "_" + column_name + "_" + foreign_key['referred_table']
+            foreign_key_names.append(foreign_key['name'] or default_name)
+    if not foreign_key_names:
+        return
+    with op.batch_alter_table(table_name, naming_convention=naming_convention) as batch_op:
+        for foreign_key_name in foreign_key_names:
+            batch_op.drop_constraint(foreign_key_name, type_='foreignkey')
+
+
+def upgrade() -> None:
+    _drop_foreign_keys('library', ['project_id'])
+    _drop_foreign_keys('symlink', ['sequencing_run_id', 'library_id'])
+
+
+def downgrade() -> None:
+    with op.batch_alter_table('library', naming_convention=naming_convention) as batch_op:
+        batch_op.create_foreign_key('fk_library_project_id_project', 'project', ['project_id'], ['project_id'])
+    with op.batch_alter_table('symlink', naming_convention=naming_convention) as batch_op:
+        batch_op.create_foreign_key('fk_symlink_sequencing_run_id_sequencing_run', 'sequencing_run', ['sequencing_run_id'], ['sequencing_run_id'])
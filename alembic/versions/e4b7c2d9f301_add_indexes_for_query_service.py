@@ -0,0 +1,29 @@
+"""add indexes for query service
+
+Revision ID: e4b7c2d9f301
+Revises: d2f5b8a3c914
+Create Date: 2026-10-17 15:20:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e4b7c2d9f301'
+down_revision = 'd2f5b8a3c914'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.create_index('ix_sequencing_run_timestamp_updated', 'sequencing_run', ['timestamp_updated', 'sequencing_run_id'], unique=False)
+    # Replaced by an index that also covers library_id, so it can serve the same lookups.
+    op.drop_index('ix_library_project_id_sequencing_run_id', table_name='library')
+    op.create_index('ix_library_project_id_sequencing_run_id_library_id', 'library', ['project_id', 'sequencing_run_id', 'library_id'], unique=False)
+
+
+def downgrade() -> None:
+    op.drop_index('ix_library_project_id_sequencing_run_id_library_id', table_name='library')
+    op.create_index('ix_library_project_id_sequencing_run_id', 'library', ['project_id', 'sequencing_run_id'], unique=False)
+    op.drop_index('ix_sequencing_run_timestamp_updated', table_name='sequencing_run')
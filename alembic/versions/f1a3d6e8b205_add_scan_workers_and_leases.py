@@ -0,0 +1,40 @@
+"""add scan workers and leases
+
+Revision ID: f1a3d6e8b205
+Revises: e4b7c2d9f301
+Create Date: 2026-10-17 18:40:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'f1a3d6e8b205'
+down_revision = 'e4b7c2d9f301'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.create_table('scan_worker',
+    sa.Column('worker_id', sa.String(), nullable=False),
+    sa.Column('hostname', sa.String(), nullable=True),
+    sa.Column('heartbeat_at', sa.DateTime(), nullable=True),
+    sa.Column('timestamp_updated', sa.DateTime(), nullable=True),
+    sa.PrimaryKeyConstraint('worker_id')
+    )
+    op.create_table('scan_lease',
+    sa.Column('lease_key', sa.String(), nullable=False),
+    sa.Column('worker_id', sa.String(), nullable=True),
+    sa.Column('lease_expires_at', sa.DateTime(), nullable=True),
+    sa.Column('timestamp_updated', sa.DateTime(), nullable=True),
+    sa.PrimaryKeyConstraint('lease_key')
+    )
+    op.create_index('ix_scan_lease_worker_id', 'scan_lease', ['worker_id'], unique=False)
+
+
+def downgrade() -> None:
+    op.drop_index('ix_scan_lease_worker_id', table_name='scan_lease')
+    op.drop_table('scan_lease')
+    op.drop_table('scan_worker')
@@ -7,16 +7,42 @@ import time
 import logging
 import os
 
+import auto_fastq_symlink.async_core as async_core
 import auto_fastq_symlink.config
 import auto_fastq_symlink.core as core
+import auto_fastq_symlink.metrics as metrics
+import auto_fastq_symlink.watch as watch
 
 DEFAULT_SCAN_INTERVAL_SECONDS = 3600.0
 
+def _quit(config):
+    """
+    Exit, after giving up this worker's scan leases (if `scan_leases` is enabled), so that other
+    workers can take over its runs straight away rather than waiting for the leases to expire.
+    """
+    core.release_scan_leases(config)
+    exit(0)
+
+def _sleep_with_heartbeats(config, seconds):
+    """
+    Sleep, waking up to send scan worker heartbeats (if `scan_leases` is enabled),
+    so that this worker's leases don't expire in between scans.
+    """
+    sleep_until = time.monotonic() + seconds
+    while True:
+        remaining_seconds = sleep_until - time.monotonic()
+        if remaining_seconds <= 0:
+            return
+        time.sleep(min(remaining_seconds, core.get_scan_lease_heartbeat_interval_seconds(config)))
+        core.heartbeat_scan_worker(config)
+
 def main():
     parser = argparse.ArgumentParser()
     parser.add_argument('-c', '--config')
     parser.add_argument('-i', '--scan-interval', default=10)
     parser.add_argument('--log-level', default="info")
+    parser.add_argument('-w', '--watch', action='store_true', help="Watch for new runs in between full scans, instead of sleeping.")
+    parser.add_argument('--engine', choices=['sync', 'async'], default='sync', help="Scan runs one at a time (sync), or several at once with asyncio (async).")
     args = parser.parse_args()
     config = {}
 
@@ -39,29 +65,75 @@ def main():
     # then exit at a safe time (in between runs or at the end of a scan of all runs)
     quit_when_safe = False
 
+    watcher = None
+    watched_run_parent_dirs = None
+
+    # The config is only re-loaded when the config file, or one of the files that it refers to, has changed.
+    config_file_stats = None
+    # Projects whose config has changed since the last full scan. None means that everything
+    # should be re-planned (eg. on the first scan, before there is anything to compare against).
+    changed_project_ids = None
+    # Set when a config change affects how SampleSheets are interpreted, so unchanged runs need to be re-parsed.
+    reparse_all_runs = False
+
     while(True):
         if quit_when_safe:
-            exit(0)
+            _quit(config)
 
         try:
             if args.config:
-                logging.info(json.dumps({"event_type": "load_config_start", "config_file": os.path.abspath(args.config)}))
-                try:
-                    config = auto_fastq_symlink.config.load_config(args.config)
-                    # Uncomment below to see the config on stdout each time it's reloaded
-                    # print(json.dumps(auto_fastq_symlink.config.make_config_json_serializable(config), indent=2))
-                except json.decoder.JSONDecodeError as e:
-                    # If we fail to load the config file, we continue on with the
-                    # last valid config that was loaded.
-                    logging.error(json.dumps({"event_type": "load_config_failed", "config_file": os.path.abspath(args.config)}))
+                current_config_file_stats = auto_fastq_symlink.config.get_config_file_stats(args.config, config)
+                if current_config_file_stats == config_file_stats:
+                    logging.debug(json.dumps({"event_type": "load_config_skipped", "config_file": os.path.abspath(args.config), "reason": "config_files_unchanged"}))
+                else:
+                    logging.info(json.dumps({"event_type": "load_config_start", "config_file": os.path.abspath(args.config)}))
+                    try:
+                        new_config = auto_fastq_symlink.config.load_config(args.config)
+                        # Keep the stats that were taken before loading, so that a file that changes
+                        # while it's being loaded is loaded again next time.
+                        config_file_stats = auto_fastq_symlink.config.get_config_file_stats(args.config, new_config)
+                        config_file_stats.update({path: stats for path, stats in current_config_file_stats.items() if path in config_file_stats})
+                        if config:
+                            config_diff = auto_fastq_symlink.config.diff_configs(config, new_config)
+                            logging.info(json.dumps(dict({"event_type": "config_changed"}, **config_diff)))
+                            if changed_project_ids is not None:
+                                changed_project_ids |= auto_fastq_symlink.config.get_changed_project_ids(config_diff)
+                            if config_diff['project_id_translation_changed'] or 'fastq_extensions' in config_diff['settings_changed']:
+                                reparse_all_runs = True
+                        config = new_config
+                        # Uncomment below to see the config on stdout each time it's reloaded
+                        # print(json.dumps(auto_fastq_symlink.config.make_config_json_serializable(config), indent=2))
+                    except json.decoder.JSONDecodeError as e:
+                        # If we fail to load the config file, we continue on with the
+                        # last valid config that was loaded.
+                        logging.error(json.dumps({"event_type": "load_config_failed", "config_file": os.path.abspath(args.config)}))
+
+            # The watcher is started before the full scan, so that runs that become
+            # ready during the scan will be picked up afterward.
+            if args.watch and config.get('run_parent_dirs', None) != watched_run_parent_dirs:
+                if watcher is not None:
+                    watcher.close()
+                watcher = watch.make_run_watcher(config)
+                watched_run_parent_dirs = config.get('run_parent_dirs', None)
 
             # All of the action happens here.
+            metrics.reset()
             scan_start_timestamp = datetime.datetime.now()
-            for run in core.scan(config):
-                if run is not None:
-                    core.symlink_run(config, run)
-                if quit_when_safe:
-                    exit(0)
+            if reparse_all_runs:
+                logging.info(json.dumps({"event_type": "reparse_all_runs", "reason": "samplesheet_interpretation_changed"}))
+                scan_config, scan_changed_project_ids = dict(config, incremental_scan=False), None
+            else:
+                scan_config, scan_changed_project_ids = config, changed_project_ids
+            if args.engine == 'async':
+                async_core.scan(scan_config, scan_changed_project_ids)
+            else:
+                for run in core.scan(scan_config, scan_changed_project_ids):
+                    if run is not None:
+                        core.symlink_run(scan_config, run)
+                    if quit_when_safe:
+                        _quit(config)
+            changed_project_ids = set()
+            reparse_all_runs = False
             scan_complete_timestamp = datetime.datetime.now()
             scan_duration_delta = scan_complete_timestamp - scan_start_timestamp
             scan_duration_seconds = scan_duration_delta.total_seconds()
@@ -72,16 +144,49 @@ def main():
                 next_scan_timestamp = datetime.datetime.now() + datetime.timedelta(seconds=DEFAULT_SCAN_INTERVAL_SECONDS)
 
             logging.info(json.dumps({"event_type": "scan_complete", "scan_duration_seconds": scan_duration_seconds, "timestamp_next_scan": str(next_scan_timestamp.isoformat())}))
+            logging.info(json.dumps(dict({"event_type": "scan_summary", "scan_duration_seconds": scan_duration_seconds}, **metrics.get_summary())))
+            prometheus_textfile_path = config.get('prometheus_textfile_path', None)
+            if prometheus_textfile_path:
+                try:
+                    metrics.write_prometheus_textfile(prometheus_textfile_path, {
+                        "scan_duration_seconds": scan_duration_seconds,
+                        "last_scan_complete_timestamp_seconds": scan_complete_timestamp.timestamp(),
+                    })
+                except OSError as e:
+                    logging.error(json.dumps({"event_type": "write_prometheus_textfile_failed", "prometheus_textfile_path": prometheus_textfile_path, "error": str(e)}))
             
             if quit_when_safe:
-                exit(0)
+                _quit(config)
 
             if "scan_interval_seconds" in config:
                 try:
                     scan_interval = float(str(config['scan_interval_seconds']))
                 except ValueError as e:
                     scan_interval = DEFAULT_SCAN_INTERVAL_SECONDS
-            time.sleep(scan_interval)
+            if watcher is None:
+                _sleep_with_heartbeats(config, scan_interval)
+                continue
+
+            # In watch mode, the full scan is a periodic reconciliation pass. Between full scans,
+            # only runs that the watcher reports as ready are scanned and symlinked.
+            next_full_scan_monotonic = time.monotonic() + scan_interval
+            while not quit_when_safe:
+                remaining_seconds = next_full_scan_monotonic - time.monotonic()
+                if remaining_seconds <= 0:
+                    break
+                ready_run_dirs = watcher.wait_for_runs(min(remaining_seconds, core.get_scan_lease_heartbeat_interval_seconds(config)))
+                core.heartbeat_scan_worker(config)
+                if not ready_run_dirs:
+                    continue
+                logging.info(json.dumps({"event_type": "watched_runs_ready", "run_directories": ready_run_dirs}))
+                if args.engine == 'async':
+                    async_core.scan(config, run_dir_paths=ready_run_dirs)
+                    continue
+                for run in core.scan_runs(config, ready_run_dirs):
+                    if run is not None:
+                        core.symlink_run(config, run)
+                    if quit_when_safe:
+                        _quit(config)
         except KeyboardInterrupt as e:
             logging.info(json.dumps({"event_type": "quit_when_safe_enabled"}))
             quit_when_safe = True
@@ -0,0 +1,266 @@
+#!/usr/bin/env python
+
+import argparse
+import base64
+import binascii
+import collections
+import datetime
+import hashlib
+import json
+import logging
+import threading
+from typing import Optional
+
+import uvicorn
+from fastapi import FastAPI, HTTPException, Query, Request, Response
+
+import auto_fastq_symlink.config
+import auto_fastq_symlink.db as db
+from auto_fastq_symlink.model import Library, SequencingRun, Symlink
+
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 1000
+DEFAULT_RESPONSE_CACHE_SIZE = 1024
+
+# The columns that rows are ordered (and paged) by, for each endpoint. Together with the
+# columns that each endpoint filters on, these match the primary key or an index of the table.
+LIBRARIES_BY_PROJECT_ORDER_COLUMNS = ['sequencing_run_id', 'library_id']
+LIBRARIES_BY_RUN_ORDER_COLUMNS = ['library_id']
+LIBRARIES_BY_LIBRARY_ID_ORDER_COLUMNS = ['sequencing_run_id']
+SYMLINKS_BY_RUN_ORDER_COLUMNS = ['path', 'target']
+RUNS_ORDER_COLUMNS = ['timestamp_updated', 'sequencing_run_id']
+
+
+class ResponseCache:
+    """
+    Least-recently-used cache of response bodies, along with the ETag that each body was served with.
+    Shared by all of the threads that handle requests.
+    """
+    def __init__(self, max_size: int):
+        self.max_size = max_size
+        self._responses = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str, etag: str) -> Optional[bytes]:
+        """
+        :param key: Cache key (eg. the request's path and query string)
+        :type key: str
+        :param etag: ETag for the current version of the response
+        :type etag: str
+        :return: The cached response body, if it was cached with the same ETag. Otherwise, None.
+        :rtype: bytes | None
+        """
+        with self._lock:
+            cached_response = self._responses.get(key, None)
+            if cached_response is None or cached_response[0] != etag:
+                return None
+            self._responses.move_to_end(key)
+
+            return cached_response[1]
+
+    def put(self, key: str, etag: str, body: bytes):
+        """
+        :param key: Cache key (eg. the request's path and query string)
+        :type key: str
+        :param etag: ETag that the response was served with
+        :type etag: str
+        :param body: Response body
+        :type body: bytes
+        :return: None
+        :rtype: NoneType
+        """
+        if self.max_size <= 0:
+            return
+        with self._lock:
+            self._responses[key] = (etag, body)
+            self._responses.move_to_end(key)
+            while len(self._responses) > self.max_size:
+                self._responses.popitem(last=False)
+
+
+def _json_default(value: object) -> str:
+    """
+    Serialize dates and timestamps (as ISO 8601 strings).
+    """
+    if isinstance(value, (datetime.date, datetime.datetime)):
+        return value.isoformat()
+    raise TypeError("Object of type " + type(value).__name__ + " is not JSON serializable")
+
+
+def encode_cursor(row: dict[str, object], order_columns: list[str]) -> str:
+    """
+    :param row: The last row of a page
+    :type row: dict[str, object]
+    :param order_columns: The columns that the rows are ordered by
+    :type order_columns: list[str]
+    :return: Opaque cursor, that refers to the position just after `row`.
+    :rtype: str
+    """
+    cursor_json = json.dumps([row[column] for column in order_columns], default=_json_default)
+
+    return base64.urlsafe_b64encode(cursor_json.encode('utf-8')).decode('ascii')
+
+
+def decode_cursor(cursor: str, order_columns: list[str]) -> list[object]:
+    """
+    :param cursor: Cursor made by `encode_cursor`
+    :type cursor: str
+    :param order_columns: The columns that the rows are ordered by
+    :type order_columns: list[str]
+    :return: Values of the `order_columns` for the last row of the previous page.
+    :rtype: list[object]
+    :raises ValueError: If the cursor is malformed.
+    """
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')))
+    except (binascii.Error, UnicodeError, json.JSONDecodeError) as e:
+        raise ValueError("Invalid cursor: " + str(e))
+    if not isinstance(values, list) or len(values) != len(order_columns):
+        raise ValueError("Invalid cursor: expected " + str(len(order_columns)) + " values")
+    for idx, column in enumerate(order_columns):
+        if column == 'timestamp_updated':
+            if not isinstance(values[idx], str):
+                raise ValueError("Invalid cursor: expected an ISO 8601 timestamp for " + column)
+            try:
+                values[idx] = datetime.datetime.fromisoformat(values[idx])
+            except ValueError as e:
+                raise ValueError("Invalid cursor: " + str(e))
+
+    return values
+
+
+def make_etag(path: str, query_string: str, version: dict[str, object]) -> str:
+    """
+    :param path: Request path
+    :type path: str
+    :param query_string: Request query string
+    :type query_string: str
+    :param version: Version of the rows that the response is made from (see `db.get_version`)
+    :type version: dict[str, object]
+    :return: Strong ETag (quoted), which changes whenever the rows that the response is made from change.
+    :rtype: str
+    """
+    etag_source = json.dumps([path, query_string, version['num_rows'], version['max_timestamp_updated']], default=_json_default)
+
+    return '"' + hashlib.sha1(etag_source.encode('utf-8')).hexdigest() + '"'
+
+
+def _etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """
+    :param if_none_match: Value of the request's `If-None-Match` header
+    :type if_none_match: str | None
+    :param etag: ETag for the current version of the response
+    :type etag: str
+    :return: Whether the client already has the current version of the response.
+    :rtype: bool
+    """
+    if if_none_match is None:
+        return False
+    for client_etag in if_none_match.split(','):
+        client_etag = client_etag.strip()
+        if client_etag.startswith('W/'):
+            client_etag = client_etag[2:]
+        if client_etag == '*' or client_etag == etag:
+            return True
+
+    return False
+
+
+def _to_local_time(timestamp: datetime.datetime) -> datetime.datetime:
+    """
+    Stored timestamps are in the local time of the host that stored them, without a timezone.
+    """
+    if timestamp.tzinfo is not None:
+        timestamp = timestamp.astimezone().replace(tzinfo=None)
+
+    return timestamp
+
+
+def create_app(config: dict[str, object]) -> FastAPI:
+    """
+    Create a read-only HTTP service for querying the database, so that the libraries and symlinks
+    for a project or run can be found without walking the `fastq_symlinks_dir` of each project.
+
+    Every endpoint is paginated: up to `limit` rows are returned, along with a `next_cursor`, which can be
+    passed as the `cursor` for the next page (or null, on the last page). Each response has an ETag, which
+    is based on the number of rows that match the query, and the `timestamp_updated` of the most recently
+    updated one. If a request's `If-None-Match` header has the current ETag, a `304 Not Modified` response
+    is returned without fetching any rows. Response bodies are cached (up to `api_response_cache_size`
+    responses), and a cached body is re-used for as long as its ETag is current.
+
+    :param config: Application config.
+    :type config: dict[str, object]
+    :return: The application.
+    :rtype: fastapi.FastAPI
+    """
+    app = FastAPI(title="auto-fastq-symlink")
+    response_cache = ResponseCache(int(config.get('api_response_cache_size', DEFAULT_RESPONSE_CACHE_SIZE)))
+
+    def query(request: Request, model, filters: dict[str, object], order_columns: list[str], cursor: Optional[str], limit: int, since: Optional[datetime.datetime] = None) -> Response:
+        version = db.get_version(config, model, filters, since)
+        etag = make_etag(request.url.path, request.url.query, version)
+        headers = {"ETag": etag, "Cache-Control": "no-cache"}
+        if _etag_matches(request.headers.get('if-none-match', None), etag):
+            return Response(status_code=304, headers=headers)
+
+        cache_key = request.url.path + "?" + request.url.query
+        body = response_cache.get(cache_key, etag)
+        if body is None:
+            try:
+                after = decode_cursor(cursor, order_columns) if cursor is not None else None
+            except ValueError as e:
+                raise HTTPException(status_code=400, detail=str(e))
+            # One extra row is fetched, to find out whether there is another page.
+            rows = db.get_page(config, model, filters, order_columns, after, limit + 1, since)
+            next_cursor = None
+            if len(rows) > limit:
+                rows = rows[:limit]
+                next_cursor = encode_cursor(rows[-1], order_columns)
+            body = json.dumps({"items": rows, "next_cursor": next_cursor}, default=_json_default).encode('utf-8')
+            # If the rows changed after the version was read, the body is newer than the ETag, and
+            # it will be replaced on the next request (when the ETag no longer matches).
+            response_cache.put(cache_key, etag, body)
+
+        return Response(content=body, media_type="application/json", headers=headers)
+
+    @app.get("/projects/{project_id}/libraries")
+    def get_libraries_by_project(request: Request, project_id: str, cursor: Optional[str] = None, limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE)):
+        return query(request, Library, {"project_id": project_id}, LIBRARIES_BY_PROJECT_ORDER_COLUMNS, cursor, limit)
+
+    @app.get("/runs/{run_id}/libraries")
+    def get_libraries_by_run(request: Request, run_id: str, cursor: Optional[str] = None, limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE)):
+        return query(request, Library, {"sequencing_run_id": run_id}, LIBRARIES_BY_RUN_ORDER_COLUMNS, cursor, limit)
+
+    @app.get("/libraries/{library_id}")
+    def get_libraries_by_library_id(request: Request, library_id: str, cursor: Optional[str] = None, limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE)):
+        return query(request, Library, {"library_id": library_id}, LIBRARIES_BY_LIBRARY_ID_ORDER_COLUMNS, cursor, limit)
+
+    @app.get("/runs/{run_id}/symlinks")
+    def get_symlinks_by_run(request: Request, run_id: str, cursor: Optional[str] = None, limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE)):
+        return query(request, Symlink, {"sequencing_run_id": run_id}, SYMLINKS_BY_RUN_ORDER_COLUMNS, cursor, limit)
+
+    @app.get("/runs")
+    def get_runs(request: Request, since: Optional[datetime.datetime] = None, cursor: Optional[str] = None, limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE)):
+        if since is not None:
+            since = _to_local_time(since)
+        return query(request, SequencingRun, {}, RUNS_ORDER_COLUMNS, cursor, limit, since)
+
+    return app
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Read-only HTTP service for querying the auto-fastq-symlink database.")
+    parser.add_argument('-c', '--config', required=True)
+    parser.add_argument('--host', default="127.0.0.1")
+    parser.add_argument('--port', default=8000, type=int)
+    parser.add_argument('--log-level', default="info")
+    args = parser.parse_args()
+
+    config = auto_fastq_symlink.config.load_config(args.config)
+    logging.basicConfig(level=getattr(logging, args.log_level.upper(), logging.INFO))
+    logging.info(json.dumps({"event_type": "api_start", "host": args.host, "port": args.port}))
+    uvicorn.run(create_app(config), host=args.host, port=args.port, log_level=args.log_level)
+
+
+if __name__ == '__main__':
+    main()
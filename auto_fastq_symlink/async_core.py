@@ -0,0 +1,443 @@
+import asyncio
+import concurrent.futures
+import functools
+import itertools
+import json
+import logging
+import os
+import time
+from typing import Iterator, Optional
+
+import auto_fastq_symlink.core as core
+import auto_fastq_symlink.db as db
+import auto_fastq_symlink.manifest as manifest
+import auto_fastq_symlink.metrics as metrics
+
+# Number of runs that are scanned and symlinked at the same time, unless `async_scan_concurrency` is set in the config.
+DEFAULT_ASYNC_SCAN_CONCURRENCY = 8
+
+
+class AsyncScanner:
+    """
+    Holds what is shared by all of the runs in one scan: the (bounded) pool of threads that filesystem calls
+    are made from, and the lock that database calls are made under (SQLite only allows one writer at a time).
+    """
+    def __init__(self, config: dict[str, object]):
+        self.config = config
+        self.concurrency = max(1, int(config.get('async_scan_concurrency', DEFAULT_ASYNC_SCAN_CONCURRENCY)))
+        num_executor_workers = max(1, int(config.get('async_scan_executor_workers', self.concurrency)))
+        self._executor = concurrent.futures.ThreadPoolExecutor(max_workers=num_executor_workers, thread_name_prefix='async_scan')
+        self._db_lock = None
+        if db.get_async_connection_uri(config).startswith('sqlite'):
+            self._db_lock = asyncio.Lock()
+
+    async def run_in_executor(self, fn, *args) -> object:
+        """
+        Call a function that touches the filesystem (but not the database) in the executor, so that
+        other runs can make progress while it waits for the filesystem.
+
+        :param fn: Function to call
+        :type fn: Callable
+        :param args: Arguments to pass to `fn`
+        :type args: tuple
+        :return: The return value of `fn`.
+        :rtype: object
+        """
+        loop = asyncio.get_running_loop()
+
+        return await loop.run_in_executor(self._executor, functools.partial(fn, *args))
+
+    async def run_in_db(self, fn, *args) -> object:
+        """
+        Call a function that uses the database (through `auto_fastq_symlink.db`) on the asyncio engine (see `db.run_in_async_session`).
+
+        :param fn: Function to call
+        :type fn: Callable
+        :param args: Arguments to pass to `fn`
+        :type args: tuple
+        :return: The return value of `fn`.
+        :rtype: object
+        """
+        if self._db_lock is None:
+            return await db.run_in_async_session(self.config, fn, *args)
+        async with self._db_lock:
+            return await db.run_in_async_session(self.config, fn, *args)
+
+    async def lock_manifests(self, project_ids: list[str]):
+        """
+        Lock the manifests of several projects (see `manifest.lock_manifests`). Waiting for another process's
+        locks blocks, so they're taken in the executor. If the task is cancelled while it waits, the locks are
+        released as soon as they've been taken.
+
+        :param project_ids: IDs of the projects whose manifests should be locked.
+        :type project_ids: list[str]
+        :return: None
+        :rtype: NoneType
+        """
+        locked = self._executor.submit(manifest.lock_manifests, self.config, project_ids)
+        try:
+            await asyncio.wrap_future(locked)
+        except asyncio.CancelledError:
+            locked.add_done_callback(functools.partial(_unlock_manifests_if_locked, self.config, project_ids))
+            raise
+
+    def close(self):
+        """
+        Wait for the filesystem calls that have already started, and cancel the rest.
+        """
+        self._executor.shutdown(wait=True, cancel_futures=True)
+
+
+def _unlock_manifests_if_locked(config: dict[str, object], project_ids: list[str], locked: concurrent.futures.Future):
+    """
+    Release the manifest locks taken by `locked` (see `AsyncScanner.lock_manifests`), unless it was cancelled before it started, or failed.
+    """
+    if not locked.cancelled() and locked.exception() is None:
+        manifest.unlock_manifests(config, project_ids)
+
+
+async def symlink_run(scanner: AsyncScanner, run: dict[str, object]):
+    """
+    Same as `core.symlink_run`, with filesystem calls made in the scanner's executor and database calls on the asyncio engine.
+
+    :param scanner: Resources shared by all of the runs in the scan.
+    :type scanner: AsyncScanner
+    :param run: Sequencing run info.
+    :type run: dict[str, object]
+    :return: None
+    :rtype: NoneType
+    """
+    config = scanner.config
+    run_id = run['run_id']
+    replan_project_ids = run.get('replan_project_ids', None)
+    if not core._start_symlink_run(run):
+        return
+
+    with metrics.timer("determine_symlinks_to_create"):
+        symlinks_to_create = await scanner.run_in_db(core.determine_symlinks_to_create_for_run, config, run_id, replan_project_ids)
+    previous_symlink_dir_mtimes = None
+    if config.get('incremental_scan', False):
+        previous_symlink_dir_mtimes = await scanner.run_in_executor(core._get_symlink_dir_mtimes, config, [project_id for project_id, symlinks in symlinks_to_create.items() if symlinks], run_id)
+    with metrics.timer("create_symlinks"):
+        symlinks_complete_by_project_id = await scanner.run_in_executor(core.create_symlinks, config, symlinks_to_create, run_id)
+    manifest_project_ids = []
+    if config.get('write_manifests', False):
+        manifest_project_ids = [project_id for project_id, symlinks_complete in symlinks_complete_by_project_id.items() if symlinks_complete]
+    # See `core.symlink_run`.
+    await scanner.lock_manifests(manifest_project_ids)
+    try:
+        with metrics.timer("register_symlinks"):
+            symlinks_to_register_by_project_id, symlink_dirs = await scanner.run_in_executor(core._prepare_created_symlinks, config, symlinks_complete_by_project_id, run_id, previous_symlink_dir_mtimes)
+            num_symlinks_registered = await scanner.run_in_db(db.register_symlinks, config, symlinks_to_register_by_project_id, symlink_dirs)
+        metrics.increment("symlinks_registered", num_symlinks_registered)
+        if config.get('write_manifests', False):
+            with metrics.timer("append_to_manifests"):
+                for project_id, symlinks_registered in symlinks_to_register_by_project_id.items():
+                    await scanner.run_in_executor(manifest.append_to_manifest, config, project_id, symlinks_registered)
+    finally:
+        manifest.unlock_manifests(config, manifest_project_ids)
+    core._finish_symlink_run(run_id, symlinks_complete_by_project_id)
+
+
+async def _scan_and_symlink_run(scanner: AsyncScanner, run_dir_path: str, stored_run: Optional[dict[str, object]], changed_project_ids: Optional[set[str]], changed_project_ids_by_run_id: dict[str, set[str]]) -> Optional[dict[str, object]]:
+    """
+    Check one run directory, store the run (if it has changed), then symlink it.
+
+    :return: Sequencing run info, or None if the directory isn't a run that is ready to be symlinked.
+    :rtype: dict[str, object] | None
+    """
+    config = scanner.config
+    if config.get('scan_leases', False):
+        await scanner.run_in_db(core.heartbeat_scan_worker, config)
+    with metrics.timer("find_run"):
+        run = await scanner.run_in_executor(core._find_run, config, run_dir_path, stored_run)
+    if run is None:
+        return None
+
+    if run.get('unchanged', False):
+        metrics.increment("runs_unchanged")
+    else:
+        with metrics.timer("store_run"):
+            await scanner.run_in_db(db.store_run, config, run)
+    metrics.increment("runs_found")
+    core._set_replan_project_ids(run, changed_project_ids, changed_project_ids_by_run_id)
+    await symlink_run(scanner, run)
+
+    return run
+
+
+async def _reconcile_symlinks(scanner: AsyncScanner, changed_project_ids_by_run_id: dict[str, set[str]]) -> dict[str, int]:
+    """
+    Same as `core.reconcile_symlinks`, with the symlink directories walked in the scanner's executor.
+
+    :return: Counts (see `core.reconcile_symlinks`).
+    :rtype: dict[str, int]
+    """
+    config = scanner.config
+    stored_symlink_dirs = await scanner.run_in_db(db.get_symlink_directories, config)
+    changed_symlink_dirs, removed_symlink_dirs, num_symlink_dirs_checked = await scanner.run_in_executor(core._find_changed_symlink_dirs, config, stored_symlink_dirs)
+
+    return await scanner.run_in_db(core._store_changed_symlink_dirs, config, changed_symlink_dirs, removed_symlink_dirs, num_symlink_dirs_checked, changed_project_ids_by_run_id)
+
+
+def _next_chunk(items: Iterator, chunk_size: int) -> list:
+    """
+    :return: Up to `chunk_size` of the next items from `items`.
+    :rtype: list
+    """
+    return list(itertools.islice(items, chunk_size))
+
+
+async def _find_and_store_symlinks(scanner: AsyncScanner) -> dict[str, int]:
+    """
+    Same as `db.store_symlinks_in_chunks(config, core.iter_symlinks(config['projects']))`, with each chunk
+    of symlinks found in the scanner's executor, then stored on the asyncio engine.
+
+    :return: Counts, with keys: `num_symlinks_found`, `num_symlinks_stored`
+    :rtype: dict[str, int]
+    """
+    config = scanner.config
+    chunk_size = int(config.get('symlink_chunk_size', db.DEFAULT_SYMLINK_CHUNK_SIZE))
+    symlinks = core.iter_symlinks(config['projects'])
+    counts = {"num_symlinks_found": 0, "num_symlinks_stored": 0}
+    while True:
+        symlinks_chunk = await scanner.run_in_executor(_next_chunk, symlinks, chunk_size)
+        if not symlinks_chunk:
+            break
+        chunk_counts = await scanner.run_in_db(db.store_symlinks_in_chunks, config, symlinks_chunk)
+        for key in counts:
+            counts[key] += chunk_counts[key]
+
+    return counts
+
+
+async def _delete_nonexistent_symlinks(scanner: AsyncScanner) -> dict[str, object]:
+    """
+    Same as `db.delete_nonexistent_symlinks`, with the directories listed in the scanner's executor.
+
+    :return: Counts and timings (see `db.delete_nonexistent_symlinks`).
+    :rtype: dict[str, object]
+    """
+    config = scanner.config
+    chunk_size = int(config.get('symlink_chunk_size', db.DEFAULT_SYMLINK_CHUNK_SIZE))
+    num_workers = int(config.get('scan_num_workers', 1))
+    num_symlinks_checked = 0
+    num_dirs_listed = 0
+    num_symlinks_deleted = 0
+    list_dirs_seconds = 0.0
+    delete_seconds = 0.0
+    last_path_target_tuple = None
+    while True:
+        path_target_tuples = await scanner.run_in_db(db._get_path_target_tuples_chunk, config, last_path_target_tuple, chunk_size)
+        if not path_target_tuples:
+            break
+        last_path_target_tuple = path_target_tuples[-1]
+        num_symlinks_checked += len(path_target_tuples)
+
+        list_dirs_start = time.perf_counter()
+        nonexistent_symlinks, num_chunk_dirs_listed = await scanner.run_in_executor(db._find_nonexistent_symlinks, path_target_tuples, num_workers)
+        list_dirs_seconds += time.perf_counter() - list_dirs_start
+        num_dirs_listed += num_chunk_dirs_listed
+
+        delete_start = time.perf_counter()
+        num_symlinks_deleted += await scanner.run_in_db(db._delete_symlinks, config, nonexistent_symlinks)
+        delete_seconds += time.perf_counter() - delete_start
+
+    return {
+        "num_symlinks_checked": num_symlinks_checked,
+        "num_dirs_listed": num_dirs_listed,
+        "num_symlinks_deleted": num_symlinks_deleted,
+        "list_dirs_seconds": round(list_dirs_seconds, 3),
+        "delete_seconds": round(delete_seconds, 3),
+    }
+
+
+async def _audit_symlinks(scanner: AsyncScanner, changed_project_ids_by_run_id: dict[str, set[str]]):
+    """
+    Same as `core._audit_symlinks`, with the symlink directories walked and listed in the scanner's executor,
+    and the stored symlinks read and written on the asyncio engine.
+
+    Manifests are compacted in the executor as well. Each manifest is compacted while its lock is held
+    (see `manifest.compact_manifest`), so the stored symlinks that it reads are read from the same thread,
+    through the synchronous engine. Nothing else uses the database while the symlinks are audited.
+
+    :param scanner: Resources shared by all of the runs in the scan.
+    :type scanner: AsyncScanner
+    :param changed_project_ids_by_run_id: See `core._audit_symlinks`.
+    :type changed_project_ids_by_run_id: dict[str, set[str]]
+    :return: None
+    :rtype: NoneType
+    """
+    config = scanner.config
+    audit_start_time = time.monotonic()
+    if config.get('incremental_scan', False):
+        logging.debug(json.dumps({"event_type": "reconcile_symlinks_start"}))
+        with metrics.timer("reconcile_symlinks"):
+            reconcile_symlinks_counts = await _reconcile_symlinks(scanner, changed_project_ids_by_run_id)
+        metrics.increment("symlink_dirs_changed", reconcile_symlinks_counts['num_symlink_dirs_changed'])
+        logging.debug(json.dumps(dict({"event_type": "reconcile_symlinks_complete"}, **reconcile_symlinks_counts)))
+    else:
+        logging.debug(json.dumps({"event_type": "find_and_store_symlinks_start"}))
+        with metrics.timer("find_and_store_symlinks"):
+            store_symlinks_counts = await _find_and_store_symlinks(scanner)
+        logging.debug(json.dumps(dict({"event_type": "find_and_store_symlinks_complete"}, **store_symlinks_counts)))
+
+    logging.debug(json.dumps({"event_type": "delete_nonexistent_symlinks_start"}))
+    with metrics.timer("delete_nonexistent_symlinks"):
+        delete_nonexistent_symlinks_counts = await _delete_nonexistent_symlinks(scanner)
+    metrics.increment("nonexistent_symlinks_deleted", delete_nonexistent_symlinks_counts['num_symlinks_deleted'])
+    logging.info(json.dumps(dict({"event_type": "delete_nonexistent_symlinks_complete"}, **delete_nonexistent_symlinks_counts)))
+
+    if config.get('write_manifests', False):
+        with metrics.timer("compact_manifests"):
+            compact_manifests_counts = await scanner.run_in_executor(manifest.compact_manifests, config)
+        metrics.increment("manifests_rewritten", compact_manifests_counts['num_manifests_rewritten'])
+        logging.debug(json.dumps(dict({"event_type": "compact_manifests_complete"}, **compact_manifests_counts)))
+    core._last_symlink_audit_time = audit_start_time
+
+
+async def _begin_scan(scanner: AsyncScanner, changed_project_ids: Optional[set[str]]) -> tuple[Optional[set[str]], dict[str, set[str]]]:
+    """
+    Same as `core._begin_scan`, with filesystem calls made in the scanner's executor and database calls on the asyncio engine.
+
+    :param scanner: Resources shared by all of the runs in the scan.
+    :type scanner: AsyncScanner
+    :param changed_project_ids: See `core.scan`.
+    :type changed_project_ids: set[str] | None
+    :return: Tuple of (changed project IDs, changed project IDs indexed by run ID), to be passed to `core._set_replan_project_ids`.
+    :rtype: tuple[set[str] | None, dict[str, set[str]]]
+    """
+    config = scanner.config
+    logging.info(json.dumps({"event_type": "scan_start"}))
+    logging.debug(json.dumps({"event_type": "collect_projects_start"}))
+    with metrics.timer("collect_projects"):
+        projects = await scanner.run_in_executor(core.collect_project_info, config)
+    logging.debug(json.dumps({"event_type": "collect_projects_complete", "num_projects": len(projects)}))
+
+    if changed_project_ids is None or changed_project_ids:
+        logging.debug(json.dumps({"event_type": "store_projects_start"}))
+        with metrics.timer("store_projects"):
+            await scanner.run_in_db(db.store_projects, config, projects)
+        logging.debug(json.dumps({"event_type": "store_projects_complete"}))
+
+    changed_project_ids_by_run_id = {}
+    symlink_auditor = await scanner.run_in_db(core._claim_symlink_audit, config)
+    if symlink_auditor and core._symlink_audit_due(config):
+        await _audit_symlinks(scanner, changed_project_ids_by_run_id)
+    else:
+        logging.debug(json.dumps({"event_type": "symlink_audit_skipped", "reason": "not_due" if symlink_auditor else "leased_by_other_worker"}))
+        metrics.increment("symlink_audits_skipped")
+    if not symlink_auditor:
+        changed_project_ids = None
+
+    return changed_project_ids, changed_project_ids_by_run_id
+
+
+def _list_run_dirs(run_parent_dirs: list[str]) -> list[str]:
+    """
+    :return: Paths to all of the run directories under the `run_parent_dirs` (see `core._find_run_dirs`).
+    :rtype: list[str]
+    """
+    return list(core._find_run_dirs(run_parent_dirs))
+
+
+def _list_claimed_run_dirs(config: dict[str, object], run_dir_paths: list[str]) -> list[str]:
+    """
+    :return: Paths to the run directories whose run this worker holds a lease on (see `core._claim_run_dirs`).
+    :rtype: list[str]
+    """
+    return list(core._claim_run_dirs(config, run_dir_paths))
+
+
+async def _find_run_dirs(scanner: AsyncScanner, run_dir_paths: Optional[list[str]]) -> list[str]:
+    """
+    Same as the first part of `core.find_runs`: list the run directories (unless they're provided)
+    and, if `scan_leases` is enabled, keep only the ones whose run this worker holds a lease on.
+
+    :return: Paths to the run directories that this worker should scan.
+    :rtype: list[str]
+    """
+    config = scanner.config
+    if run_dir_paths is None:
+        run_dir_paths = await scanner.run_in_executor(_list_run_dirs, config['run_parent_dirs'])
+    if config.get('scan_leases', False):
+        run_dir_paths = await scanner.run_in_db(_list_claimed_run_dirs, config, run_dir_paths)
+
+    return run_dir_paths
+
+
+async def scan_and_symlink(config: dict[str, object], changed_project_ids: Optional[set[str]] = None, run_dir_paths: Optional[list[str]] = None) -> list[dict[str, object]]:
+    """
+    Do the same work as calling `core.symlink_run` for each run from `core.scan` (or from `core.scan_runs`,
+    if `run_dir_paths` is provided), but with up to `async_scan_concurrency` runs in progress at once.
+
+    Each run goes through its own pipeline: check the run directory, store the run, plan, create and store
+    its symlinks. Filesystem calls are made in a pool of up to `async_scan_executor_workers` threads, and
+    database calls go through the asyncio engine (see `db.init_async_db`), so a run that is waiting for
+    the filesystem or the database doesn't hold up the others. The same log events are emitted as by
+    the `core` functions, but the events for different runs may be interleaved.
+
+    :param config: Application config.
+    :type config: dict[str, object]
+    :param changed_project_ids: See `core.scan`. Ignored if `run_dir_paths` is provided.
+    :type changed_project_ids: set[str] | None
+    :param run_dir_paths: Paths to run directories to be scanned. If None, a full scan is done.
+    :type run_dir_paths: list[str] | None
+    :return: Info for each of the runs that were found, in the order that they finished.
+    :rtype: list[dict[str, object]]
+    """
+    scanner = AsyncScanner(config)
+    tasks = []
+    try:
+        changed_project_ids_by_run_id = {}
+        if run_dir_paths is None:
+            changed_project_ids, changed_project_ids_by_run_id = await _begin_scan(scanner, changed_project_ids)
+        else:
+            logging.info(json.dumps({"event_type": "scan_runs_start", "run_directories": run_dir_paths}))
+            changed_project_ids = None
+
+        logging.debug(json.dumps({"event_type": "find_and_store_runs_start"}))
+        stored_runs = {}
+        if config.get('incremental_scan', False):
+            run_ids = None if run_dir_paths is None else [os.path.basename(run_dir_path) for run_dir_path in run_dir_paths]
+            stored_runs = await scanner.run_in_db(db.get_run_fingerprints, config, run_ids)
+        run_dir_paths = iter(await _find_run_dirs(scanner, run_dir_paths))
+        runs = []
+
+        async def scan_and_symlink_runs():
+            # Each of these takes the next run directory as soon as it has finished with its previous one.
+            for run_dir_path in run_dir_paths:
+                run = await _scan_and_symlink_run(scanner, run_dir_path, stored_runs.get(os.path.basename(run_dir_path), None), changed_project_ids, changed_project_ids_by_run_id)
+                if run is not None:
+                    runs.append(run)
+
+        tasks = [asyncio.create_task(scan_and_symlink_runs()) for _ in range(scanner.concurrency)]
+        await asyncio.gather(*tasks)
+        num_runs_unchanged = len([run for run in runs if run.get('unchanged', False)])
+        logging.info(json.dumps({"event_type": "find_and_store_runs_complete", "num_runs_found": len(runs), "num_runs_unchanged": num_runs_unchanged}))
+
+        return runs
+    finally:
+        # If one run failed (or the scan was interrupted), the runs that are still in progress are cancelled.
+        # Their database transactions are rolled back, and they're picked up again on the next scan.
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        scanner.close()
+        await db.dispose_async_db()
+
+
+def scan(config: dict[str, object], changed_project_ids: Optional[set[str]] = None, run_dir_paths: Optional[list[str]] = None) -> list[dict[str, object]]:
+    """
+    Run `scan_and_symlink` in a new event loop, and wait for it to finish.
+
+    :param config: Application config.
+    :type config: dict[str, object]
+    :param changed_project_ids: See `core.scan`.
+    :type changed_project_ids: set[str] | None
+    :param run_dir_paths: Paths to run directories to be scanned. If None, a full scan is done.
+    :type run_dir_paths: list[str] | None
+    :return: Info for each of the runs that were found.
+    :rtype: list[dict[str, object]]
+    """
+    return asyncio.run(scan_and_symlink(config, changed_project_ids, run_dir_paths))
@@ -1,6 +1,8 @@
 import csv
 import json
 import logging
+import os
+from typing import Optional
 
 def _parse_list(list_path: str) -> list[str]:
     """
@@ -122,6 +124,119 @@ def load_config(config_path: str) -> dict[str, object]:
     return config
 
 
+def get_config_files(config_path: str, config: dict[str, object]) -> list[str]:
+    """
+    :param config_path: Path to application config file (json format)
+    :type config_path: str
+    :param config: Application config that was loaded from `config_path` (may be empty, if it hasn't been loaded yet).
+    :type config: dict[str, object]
+    :return: Paths to the config file, and all of the files that it refers to (projects definition file, project ID translation file and exclusion lists).
+    :rtype: list[str]
+    """
+    config_files = [config_path]
+    for key in ['projects_definition_file', 'project_id_translation_file']:
+        if key in config:
+            config_files.append(config[key])
+    for project_id, project in config.get('projects', {}).items():
+        for key in ['excluded_runs_list', 'excluded_libraries_list']:
+            if project.get(key, None):
+                config_files.append(project[key])
+
+    return config_files
+
+
+def get_config_file_stats(config_path: str, config: dict[str, object]) -> dict[str, Optional[list[int]]]:
+    """
+    Get the modification time (in nanoseconds), size and inode of the config file and all of the files that it refers to.
+    If none of them have changed, the config doesn't need to be re-loaded. Editors that replace a file (rather than
+    writing to it in place) change its inode, even if the modification time and size happen to be the same.
+
+    :param config_path: Path to application config file (json format)
+    :type config_path: str
+    :param config: Application config that was loaded from `config_path` (may be empty, if it hasn't been loaded yet).
+    :type config: dict[str, object]
+    :return: [mtime_ns, size, inode] for each file (or None if the file can't be found), indexed by path.
+    :rtype: dict[str, list[int] | None]
+    """
+    config_file_stats = {}
+    for config_file in get_config_files(config_path, config):
+        try:
+            stat = os.stat(config_file)
+            config_file_stats[config_file] = [stat.st_mtime_ns, stat.st_size, stat.st_ino]
+        except OSError as e:
+            config_file_stats[config_file] = None
+
+    return config_file_stats
+
+
+def diff_configs(old_config: dict[str, object], new_config: dict[str, object]) -> dict[str, object]:
+    """
+    Compare two loaded configs.
+
+    :param old_config: Previously-loaded application config
+    :type old_config: dict[str, object]
+    :param new_config: Newly-loaded application config
+    :type new_config: dict[str, object]
+    :return: Differences, with keys: `settings_changed` (top-level settings other than projects), `projects_added`,
+             `projects_removed`, `projects_changed` (project settings, other than exclusions), `excluded_runs_added`,
+             `excluded_runs_removed`, `excluded_libraries_added`, `excluded_libraries_removed` (indexed by project ID),
+             `project_id_translation_changed` (SampleSheet project IDs whose translation was added, removed or changed)
+    :rtype: dict[str, object]
+    """
+    settings = set(old_config.keys()) | set(new_config.keys())
+    settings -= {'projects', 'project_id_translation'}
+    old_projects = old_config.get('projects', {})
+    new_projects = new_config.get('projects', {})
+    config_diff = {
+        "settings_changed": sorted([setting for setting in settings if old_config.get(setting, None) != new_config.get(setting, None)]),
+        "projects_added": sorted(set(new_projects) - set(old_projects)),
+        "projects_removed": sorted(set(old_projects) - set(new_projects)),
+        "projects_changed": [],
+        "excluded_runs_added": {},
+        "excluded_runs_removed": {},
+        "excluded_libraries_added": {},
+        "excluded_libraries_removed": {},
+    }
+    exclusion_keys = ['excluded_runs', 'excluded_libraries']
+    for project_id in sorted(set(old_projects) & set(new_projects)):
+        old_project = old_projects[project_id]
+        new_project = new_projects[project_id]
+        old_project_settings = {k: v for k, v in old_project.items() if k not in exclusion_keys}
+        new_project_settings = {k: v for k, v in new_project.items() if k not in exclusion_keys}
+        if old_project_settings != new_project_settings:
+            config_diff['projects_changed'].append(project_id)
+        for exclusion_key in exclusion_keys:
+            old_exclusions = old_project.get(exclusion_key, set())
+            new_exclusions = new_project.get(exclusion_key, set())
+            if new_exclusions - old_exclusions:
+                config_diff[exclusion_key + '_added'][project_id] = sorted(new_exclusions - old_exclusions)
+            if old_exclusions - new_exclusions:
+                config_diff[exclusion_key + '_removed'][project_id] = sorted(old_exclusions - new_exclusions)
+
+    old_translation = old_config.get('project_id_translation', {})
+    new_translation = new_config.get('project_id_translation', {})
+    translated_project_ids = set(old_translation) | set(new_translation)
+    config_diff['project_id_translation_changed'] = sorted([
+        project_id for project_id in translated_project_ids if old_translation.get(project_id, None) != new_translation.get(project_id, None)
+    ])
+
+    return config_diff
+
+
+def get_changed_project_ids(config_diff: dict[str, object]) -> set[str]:
+    """
+    :param config_diff: Differences between two configs, as found by `diff_configs`
+    :type config_diff: dict[str, object]
+    :return: IDs of projects that were added, or whose settings or exclusions changed.
+    :rtype: set[str]
+    """
+    changed_project_ids = set(config_diff['projects_added']) | set(config_diff['projects_changed'])
+    for key in ['excluded_runs_added', 'excluded_runs_removed', 'excluded_libraries_added', 'excluded_libraries_removed']:
+        changed_project_ids |= set(config_diff[key].keys())
+
+    return changed_project_ids
+
+
 def make_config_json_serializable(original_config):
     """
     """
@@ -1,14 +1,38 @@
+import collections
+import concurrent.futures
 import datetime
+import hashlib
+import itertools
 import json
 import logging
 import os
 import re
-from typing import Iterable, Optional
+import socket
+import time
+from typing import Iterable, Iterator, Optional
 
 import jsonschema
 
 import auto_fastq_symlink.samplesheet as ss
 import auto_fastq_symlink.db as db
+import auto_fastq_symlink.manifest as manifest
+import auto_fastq_symlink.metrics as metrics
+
+# IDs of runs where some of the symlinks that were planned couldn't be created (see `create_symlinks`). These
+# runs are re-planned for all projects on the next scan, even if nothing about them has changed.
+_runs_with_failed_symlinks = set()
+
+# When the stored symlinks were last checked against the symlink directories (see `_symlink_audit_due`), by `time.monotonic()`.
+_last_symlink_audit_time = None
+
+DEFAULT_SCAN_LEASE_SECONDS = 300.0
+# Run leases are claimed this many at a time, just before the runs are scanned.
+SCAN_LEASE_BATCH_SIZE = 100
+# The lease for checking the stored symlinks against the symlink directories, which only one worker should do at a time.
+SYMLINK_AUDIT_LEASE_KEY = "symlink_audit"
+
+# When this process last sent a scan worker heartbeat (see `heartbeat_scan_worker`), by `time.monotonic()`.
+_last_scan_worker_heartbeat_time = None
 
 
 def collect_project_info(config: dict[str, object]) -> dict[str, str]:
@@ -164,6 +188,39 @@ def _sanitize_library_id(library_id: str):
     return sanitized_library_id
 
 
+ILLUMINA_FASTQ_FILENAME_REGEX = re.compile("(?P<library_id>[^_]+)_S\\d+(_L(?P<lane>\\d{3}))?_(?P<read_type>R[12])_(?P<chunk>\\d{3})")
+
+
+def _index_fastq_directory(fastq_dir: str, fastq_extensions: list[str]) -> dict[tuple[str, str], list[str]]:
+    """
+    List the fastq directory once, and index the fastq files that it contains by library ID and read type.
+    Illumina fastq filenames look like: `<library_id>_S<sample_num>_L<lane>_R<read>_<chunk>.fastq.gz` (lane is optional).
+    Library IDs can't contain underscores, because they are replaced with '-' when the fastq files are named.
+
+    :param fastq_dir: Path to the run's fastq directory.
+    :type fastq_dir: str
+    :param fastq_extensions: A list of valid fastq filename extensions (defined in config)
+    :type fastq_extensions: list[str]
+    :return: Sorted fastq filenames (one per lane & chunk), indexed by (library ID, read type), where read type is `R1` or `R2`.
+    :rtype: dict[tuple[str, str], list[str]]
+    """
+    fastq_extensions = tuple(fastq_extensions)
+    fastq_index = {}
+    with os.scandir(fastq_dir) as dir_entries:
+        for dir_entry in dir_entries:
+            if not dir_entry.name.endswith(fastq_extensions):
+                continue
+            fastq_filename_match = ILLUMINA_FASTQ_FILENAME_REGEX.match(dir_entry.name)
+            if fastq_filename_match and dir_entry.is_file():
+                library_id_read_type = (fastq_filename_match.group('library_id'), fastq_filename_match.group('read_type'))
+                fastq_index.setdefault(library_id_read_type, []).append(dir_entry.name)
+
+    for fastq_filenames in fastq_index.values():
+        fastq_filenames.sort()
+
+    return fastq_index
+
+
 def find_libraries(run: dict[str, object], samplesheet: dict[str, object], fastq_extensions: list[str]) -> list[dict[str, object]]:
     """
     Use parsed samplesheet and run info to find all libraries on the run, along with their project ID and fastq paths.
@@ -174,7 +231,8 @@ def find_libraries(run: dict[str, object], samplesheet: dict[str, object], fastq
     :type samplesheet: dict[str, object]
     :param fastq_extensions: A list of valid fastq filename extensions (defined in config)
     :type fastq_extensions: list[str]
-    :return: Libraries
+    :return: Libraries. `fastq_path_r1` and `fastq_path_r2` are the first (lowest lane & chunk) fastq file for each read,
+             and `fastq_paths_r1` and `fastq_paths_r2` list all of them.
     :rtype: list[dict[str, object]]
     """
     run_id = run['run_id']
@@ -195,9 +253,8 @@ def find_libraries(run: dict[str, object], samplesheet: dict[str, object], fastq
     libraries_section = _determine_libraries_section(samplesheet, run['instrument_type'])
     project_header = _determine_project_header(samplesheet, run['instrument_type'])
 
-    has_correct_extension = lambda x: any([x.endswith(ext) for ext in fastq_extensions])
-    run_fastq_dir_contents = os.listdir(fastq_dir)
-    run_fastq_files = set(filter(lambda x: all([has_correct_extension(x), os.path.isfile(os.path.join(fastq_dir, x))]), run_fastq_dir_contents))
+    with metrics.timer("index_fastq_directory"):
+        fastq_index = _index_fastq_directory(fastq_dir, fastq_extensions)
 
     library_id_header = _determine_library_id_header(samplesheet, run['instrument_type'])
     
@@ -215,30 +272,17 @@ def find_libraries(run: dict[str, object], samplesheet: dict[str, object], fastq
         library['library_id'] = library_id
         library['project_id'] = project_id
         logging.debug(json.dumps({"event_type": "found_library", "library_id": library_id, "samplesheet_project_id": project_id}))
-        r1_fastq_filenames = list(filter(lambda x: re.match(library_id + '_S\\d+(_L\\d{3})?' + '_R1_' + '\\d{3}', x), run_fastq_files))
-        if len(r1_fastq_filenames) > 0:
-            r1_fastq_filename = r1_fastq_filenames[0]
-        else:
-            logging.debug(json.dumps({"event_type": "failed_to_find_R1_fastq", "sequencing_run_id": run_id, "library_id": library_id, "samplesheet_project_id": project_id}))
-            r1_fastq_filename = None
-        r2_fastq_filenames = list(filter(lambda x: re.match(library_id + '_S\\d+(_L\\d{3})?' + '_R2_' + '\\d{3}', x), run_fastq_files))
-        if len(r2_fastq_filenames) > 0:
-            r2_fastq_filename = r2_fastq_filenames[0]
-        else:
-            logging.debug(json.dumps({"event_type": "failed_to_find_R2_fastq", "sequencing_run_id": run_id, "library_id": library_id, "samplesheet_project_id": project_id}))
-            r2_fastq_filename = None
-        r1_fastq_path = os.path.join(fastq_dir, r1_fastq_filename) if r1_fastq_filename else None
-        r2_fastq_path = os.path.join(fastq_dir, r2_fastq_filename) if r2_fastq_filename else None
-        if r1_fastq_path and os.path.exists(r1_fastq_path):
-            logging.debug(json.dumps({"event_type": "found_library_fastq_file", "library_id": library_id, "read_type": "R1", "fastq_path": r1_fastq_path}))
-            library['fastq_path_r1'] = r1_fastq_path
-        else:
-            library['fastq_path_r1'] = None
-        if r2_fastq_path and os.path.exists(r2_fastq_path):
-            logging.debug(json.dumps({"event_type": "found_library_fastq_file", "library_id": library_id, "read_type": "R2", "fastq_path": r2_fastq_path}))
-            library['fastq_path_r2'] = r2_fastq_path
-        else:
-            library['fastq_path_r2'] = None
+        for read_type in ['R1', 'R2']:
+            fastq_filenames = fastq_index.get((library_id, read_type), [])
+            fastq_paths = [os.path.join(fastq_dir, fastq_filename) for fastq_filename in fastq_filenames]
+            if len(fastq_paths) > 0:
+                logging.debug(json.dumps({"event_type": "found_library_fastq_file", "library_id": library_id, "read_type": read_type, "fastq_path": fastq_paths[0]}))
+                library['fastq_path_' + read_type.lower()] = fastq_paths[0]
+            else:
+                logging.debug(json.dumps({"event_type": "failed_to_find_" + read_type + "_fastq", "sequencing_run_id": run_id, "library_id": library_id, "samplesheet_project_id": project_id}))
+                library['fastq_path_' + read_type.lower()] = None
+            # All lanes & chunks for the library, in order.
+            library['fastq_paths_' + read_type.lower()] = fastq_paths
         found_library_ids.add(library_id)
         libraries.append(library)
         
@@ -246,100 +290,622 @@ def find_libraries(run: dict[str, object], samplesheet: dict[str, object], fastq
     return libraries
     
 
-def find_runs(config: dict[str, object]) -> Iterable[Optional[dict[str, object]]]:
+def _get_mtime_and_size(path: Optional[str]) -> tuple[Optional[float], Optional[int]]:
     """
-    Find all sequencing runs under all of the `run_parent_dirs` from the config.
-    Runs are found by matching sub-directory names against the following regexes: `"\\d{6}_M\\d{5}_\\d+_\\d{9}-[A-Z0-9]{5}"` (MiSeq) and `"\\d{6}_VH\\d{5}_\\d+_[A-Z0-9]{9}"` (NextSeq)
+    Get the modification time and size of a file or directory.
+
+    :param path: Path to the file or directory.
+    :type path: str | None
+    :return: Tuple of (mtime, size), or (None, None) if the path is None or can't be accessed.
+    :rtype: tuple[float | None, int | None]
+    """
+    if path is None:
+        return None, None
+    try:
+        stat_result = os.stat(path)
+    except OSError as e:
+        return None, None
+
+    return stat_result.st_mtime, stat_result.st_size
+
+
+def _compute_run_fingerprint(run_directory_mtime: Optional[float], samplesheet_path: Optional[str], fastq_directory: Optional[str]) -> dict[str, object]:
+    """
+    A run's fingerprint is the combination of the run directory mtime, the samplesheet mtime & size,
+    and the fastq directory mtime. If none of those have changed since the run was last stored,
+    there's no need to re-parse the samplesheet or re-list the fastq directory.
+
+    :param run_directory_mtime: Modification time of the run directory.
+    :type run_directory_mtime: float | None
+    :param samplesheet_path: Path to the SampleSheet that was (or will be) parsed for the run.
+    :type samplesheet_path: str | None
+    :param fastq_directory: Path to the run's fastq directory.
+    :type fastq_directory: str | None
+    :return: Run fingerprint
+    :rtype: dict[str, object]
+    """
+    samplesheet_mtime, samplesheet_size = _get_mtime_and_size(samplesheet_path)
+    fastq_directory_mtime, _ = _get_mtime_and_size(fastq_directory)
+    fingerprint = {
+        'run_directory_mtime': run_directory_mtime,
+        'samplesheet_mtime': samplesheet_mtime,
+        'samplesheet_size': samplesheet_size,
+        'fastq_directory_mtime': fastq_directory_mtime,
+    }
+
+    return fingerprint
+
+
+def _run_fingerprint_unchanged(stored_fingerprint: dict[str, object], fingerprint: dict[str, object]) -> bool:
+    """
+    :param stored_fingerprint: Fingerprint of the run as it was stored to the database.
+    :type stored_fingerprint: dict[str, object]
+    :param fingerprint: Current fingerprint of the run.
+    :type fingerprint: dict[str, object]
+    :return: True if every field of the fingerprint is available and unchanged.
+    :rtype: bool
+    """
+    for k, v in fingerprint.items():
+        if v is None or stored_fingerprint.get(k) != v:
+            return False
+
+    return True
+
+
+def _determine_run_layout(run_dir_path: str, fastq_directory: str, instrument_type: str) -> str:
+    """
+    :param run_dir_path: Path to the sequencing run directory.
+    :type run_dir_path: str
+    :param fastq_directory: Path to the run's fastq directory (see `_find_fastq_directory`).
+    :type fastq_directory: str
+    :param instrument_type: Instrument type ('miseq' or 'nextseq')
+    :type instrument_type: str
+    :return: Run directory layout. One of: 'miseq_v1', 'miseq_v2', 'nextseq'
+    :rtype: str
+    """
+    if instrument_type == 'nextseq':
+        return 'nextseq'
+    elif os.path.relpath(fastq_directory, run_dir_path).startswith("Alignment_"):
+        return 'miseq_v2'
+    else:
+        return 'miseq_v1'
+
+
+def _get_layout_directories(run_dir_path: str, layout: Optional[str], fastq_directory: Optional[str]) -> list[str]:
+    """
+    Find the directories (other than the run directory itself) whose contents determine the run's
+    fastq directory and samplesheet. If none of their modification times have changed, neither has the run's layout.
+
+    - miseq_v1: None. The fastq directory and samplesheet are determined by the contents of the run directory.
+    - miseq_v2: The latest `Alignment_N` directory, where a new timestamped analysis directory may be added.
+    - nextseq: The `Analysis` directory, where a new analysis may be added, and each `Analysis/N/Data` directory,
+      where a samplesheet may be added.
+
+    :return: Paths to layout directories
+    :rtype: list[str]
+    """
+    layout_directories = []
+    if layout == 'miseq_v2':
+        alignment_dir_name = os.path.relpath(fastq_directory, run_dir_path).split(os.sep)[0]
+        layout_directories.append(os.path.join(run_dir_path, alignment_dir_name))
+    elif layout == 'nextseq':
+        analysis_dir_path = os.path.join(run_dir_path, "Analysis")
+        layout_directories.append(analysis_dir_path)
+        with os.scandir(analysis_dir_path) as analysis_subdirs:
+            for analysis_subdir in sorted([subdir.path for subdir in analysis_subdirs]):
+                layout_directories.append(os.path.join(analysis_subdir, "Data"))
+
+    return layout_directories
+
+
+def _resolve_run_layout(run_dir_path: str, instrument_type: str, run_id: str) -> dict[str, object]:
+    """
+    Find the run's fastq directory and samplesheet.
+
+    :param run_dir_path: Path to the sequencing run directory.
+    :type run_dir_path: str
+    :param instrument_type: Instrument type ('miseq' or 'nextseq')
+    :type instrument_type: str
+    :param run_id: Sequencing run ID
+    :type run_id: str
+    :return: Run layout, with keys: `layout`, `fastq_directory`, `samplesheet_files`, `samplesheet`. All are None if the fastq directory can't be found.
+    :rtype: dict[str, object]
+    """
+    run_layout = {
+        "layout": None,
+        "fastq_directory": None,
+        "samplesheet_files": [],
+        "samplesheet": None,
+    }
+    fastq_directory = _find_fastq_directory(run_dir_path, instrument_type)
+    if fastq_directory is None:
+        return run_layout
+
+    samplesheet_paths = ss.find_samplesheets(run_dir_path, instrument_type)
+    run_layout['layout'] = _determine_run_layout(run_dir_path, fastq_directory, instrument_type)
+    run_layout['fastq_directory'] = fastq_directory
+    run_layout['samplesheet_files'] = samplesheet_paths
+    run_layout['samplesheet'] = ss.choose_samplesheet_to_parse(samplesheet_paths, instrument_type, run_id)
+
+    return run_layout
+
+
+def _layout_directories_unchanged(layout_directory_mtimes: Optional[dict[str, float]]) -> bool:
+    """
+    :param layout_directory_mtimes: Modification times of the run's layout directories, indexed by path.
+    :type layout_directory_mtimes: dict[str, float] | None
+    :return: True if none of the layout directories have been modified. False if their modification times weren't stored (eg. for fingerprints stored before layouts were, or if the layout couldn't be resolved), so that the layout is resolved again and its modification times are stored.
+    :rtype: bool
+    """
+    if layout_directory_mtimes is None:
+        return False
+
+    return all([_get_mtime_and_size(d)[0] == mtime for d, mtime in layout_directory_mtimes.items()])
+
+
+def _get_run_layout(run_dir_path: str, instrument_type: str, run_id: str, run_directory_mtime: Optional[float], stored_run: Optional[dict[str, object]]) -> dict[str, object]:
+    """
+    Get the run's layout (fastq directory and samplesheet), re-using the layout that was stored with the run's
+    fingerprint if neither the run directory nor any of its layout directories (see `_get_layout_directories`)
+    have been modified since it was stored. Otherwise, the layout is resolved (see `_resolve_run_layout`)
+    and the modification times of its layout directories are recorded in `layout_directory_mtimes`.
+
+    :param run_directory_mtime: Modification time of the run directory, taken before anything in the run directory was checked.
+    :type run_directory_mtime: float | None
+    :param stored_run: Run info & fingerprint that were stored the last time the run was scanned.
+    :type stored_run: dict[str, object] | None
+    :return: Run layout, with keys: `layout`, `fastq_directory`, `samplesheet_files`, `samplesheet`, `layout_directory_mtimes`
+    :rtype: dict[str, object]
+    """
+    stored_fingerprint = stored_run['fingerprint'] if stored_run is not None else {}
+    stored_layout_directory_mtimes = stored_fingerprint.get('layout_directory_mtimes', None)
+    if stored_fingerprint.get('layout', None) is not None and stored_layout_directory_mtimes is not None:
+        run_directory_unchanged = run_directory_mtime is not None and stored_fingerprint['run_directory_mtime'] == run_directory_mtime
+        if run_directory_unchanged and _layout_directories_unchanged(stored_layout_directory_mtimes):
+            metrics.increment("run_layouts_reused")
+            run_layout = {
+                "layout": stored_fingerprint['layout'],
+                "fastq_directory": stored_run['fastq_directory'],
+                "samplesheet_files": [stored_run['samplesheet']],
+                "samplesheet": stored_run['samplesheet'],
+                "layout_directory_mtimes": stored_layout_directory_mtimes,
+            }
+            return run_layout
+
+    run_layout = _resolve_run_layout(run_dir_path, instrument_type, run_id)
+    run_layout['layout_directory_mtimes'] = None
+    if run_layout['samplesheet'] is None:
+        return run_layout
+
+    # The layout directories' mtimes are only known after the layout is resolved. If anything changed
+    # between resolving the layout and taking the mtimes, the layout can't be re-used next time.
+    layout_directory_mtimes = {}
+    for layout_directory in _get_layout_directories(run_dir_path, run_layout['layout'], run_layout['fastq_directory']):
+        layout_directory_mtimes[layout_directory], _ = _get_mtime_and_size(layout_directory)
+    if run_layout['layout'] != 'miseq_v1':
+        if _resolve_run_layout(run_dir_path, instrument_type, run_id) != {k: v for k, v in run_layout.items() if k != 'layout_directory_mtimes'}:
+            return run_layout
+    if None not in layout_directory_mtimes.values():
+        run_layout['layout_directory_mtimes'] = layout_directory_mtimes
+
+    return run_layout
+
+
+MISEQ_RUN_ID_REGEX = "\\d{6}_M\\d{5}_\\d+_\\d{9}-[A-Z0-9]{5}"
+NEXTSEQ_RUN_ID_REGEX = "\\d{6}_VH\\d{5}_\\d+_[A-Z0-9]{9}"
+
+
+def _find_run(config: dict[str, object], run_dir_path: str, stored_run: Optional[dict[str, object]]) -> Optional[dict[str, object]]:
+    """
+    Check whether a single sub-directory of one of the `run_parent_dirs` is a sequencing run that is ready to be symlinked.
+    If it is, parse its SampleSheet and find its libraries. This function doesn't touch the database,
+    so it is safe to call from multiple threads at once.
 
     :param config: Application config.
     :type config: dict[str, object]
-    :return: Dictionary of sequencin run info, indexed by sequencing run ID.
-    :rtype: Iterable[dict[str, object]]
+    :param run_dir_path: Path to the (potential) run directory.
+    :type run_dir_path: str
+    :param stored_run: Run info & fingerprint that were stored the last time the run was scanned (only used if `incremental_scan` is enabled).
+    :type stored_run: dict[str, object] | None
+    :return: Sequencing run info, or None if the directory isn't a run that is ready to be symlinked.
+    :rtype: dict[str, object] | None
     """
     run = {}
-    miseq_run_id_regex = "\\d{6}_M\\d{5}_\\d+_\\d{9}-[A-Z0-9]{5}"
-    nextseq_run_id_regex = "\\d{6}_VH\\d{5}_\\d+_[A-Z0-9]{9}"
-    run_parent_dirs = config['run_parent_dirs']
+    instrument_type = None
     fastq_extensions = config['fastq_extensions']
+    incremental_scan = config.get('incremental_scan', False)
+    run_id = os.path.basename(run_dir_path)
+    if re.match(MISEQ_RUN_ID_REGEX, run_id):
+        instrument_type = "miseq"
+    elif re.match(NEXTSEQ_RUN_ID_REGEX, run_id):
+        instrument_type = "nextseq"
+
+    # Take the run directory mtime before checking anything inside the run directory,
+    # so that changes made while we're scanning the run will be picked up on the next scan.
+    run_directory_mtime = None
+    if incremental_scan:
+        run_directory_mtime, _ = _get_mtime_and_size(run_dir_path)
+
+    if stored_run is not None and stored_run['run_directory'] == run_dir_path:
+        fingerprint = _compute_run_fingerprint(run_directory_mtime, stored_run['samplesheet'], stored_run['fastq_directory'])
+        # A new analysis (eg. a new `Alignment_N/<timestamp>` directory) doesn't touch the old fastq directory,
+        # so the layout directories need to be checked too.
+        if _run_fingerprint_unchanged(stored_run['fingerprint'], fingerprint) and _layout_directories_unchanged(stored_run['fingerprint'].get('layout_directory_mtimes', None)):
+            logging.debug(json.dumps({"event_type": "run_unchanged_since_last_scan", "sequencing_run_id": run_id}))
+            run = {
+                "run_id": run_id,
+                "instrument_type": stored_run['instrument_type'],
+                "run_directory": stored_run['run_directory'],
+                "fastq_directory": stored_run['fastq_directory'],
+                "parsed_samplesheet": stored_run['samplesheet'],
+                "unchanged": True,
+            }
+            return run
+
+    subdir_is_dir = os.path.isdir(run_dir_path)
+    upload_complete_file_exists = os.path.exists(os.path.join(run_dir_path, "upload_complete.json"))
+    qc_check_complete_file_exists = os.path.exists(os.path.join(run_dir_path, "qc_check_complete.json"))
+    determined_instrument_type = instrument_type != None
+
+    passed_run_qc_check = False
+    if qc_check_complete_file_exists:
+        try:
+            with open(os.path.join(run_dir_path, "qc_check_complete.json")) as f:
+                qc_check = json.load(f)
+        except json.decoder.JSONDecodeError as e:
+            logging.error(json.dumps({"event_type": "qc_check_json_decode_error", "sequencing_run_id": run_id, "error": str(e)}))
+            qc_check = {}
+        overall_pass_fail = qc_check.get('overall_pass_fail', None)
+        if overall_pass_fail is not None and re.match("PASS", overall_pass_fail, re.IGNORECASE):
+            passed_run_qc_check = True
+
+    conditions_checked = {
+        'subdir_is_directory': subdir_is_dir,
+        'upload_complete': upload_complete_file_exists,
+        'qc_check_complete': qc_check_complete_file_exists,
+        'passed_run_qc_check': passed_run_qc_check,
+        'determined_instrument_type': determined_instrument_type,
+    }
+    conditions_met = [v for k, v in conditions_checked.items()]
+    if not all(conditions_met):
+        logging.info(json.dumps({"event_type": "skipped_run", "sequencing_run_id": run_id, "conditions_checked": conditions_checked}))
+        metrics.increment("runs_skipped")
+        return None
+
+    logging.info(json.dumps({"event_type": "scan_run_start", "sequencing_run_id": run_id}))
+    if incremental_scan:
+        run_layout = _get_run_layout(run_dir_path, instrument_type, run_id, run_directory_mtime, stored_run)
+    else:
+        run_layout = _resolve_run_layout(run_dir_path, instrument_type, run_id)
+    fastq_directory = run_layout['fastq_directory']
+    if fastq_directory == None:
+        return None
+
+    logging.debug(json.dumps({"event_type": "sequencing_run_found", "sequencing_run_id": run_id}))
+    run = {
+        "run_id": run_id,
+        "instrument_type": instrument_type,
+        "samplesheet_files": run_layout['samplesheet_files'],
+        "run_directory": run_dir_path,
+        "fastq_directory": fastq_directory,
+    }
+    samplesheet_to_parse = run_layout['samplesheet']
+    if samplesheet_to_parse:
+        logging.debug(json.dumps({"event_type": "samplesheet_found", "sequencing_run_id": run_id, "samplesheet_path": samplesheet_to_parse}))
+    else:
+        logging.error(json.dumps({"event_type": "samplesheet_not_found", "sequencing_run_id": run_id, "samplesheet_path": samplesheet_to_parse}))
+        return None
+
+    run['parsed_samplesheet'] = samplesheet_to_parse
+    if incremental_scan:
+        # Fingerprint is taken before parsing, for the same reason as the run directory mtime above.
+        run['fingerprint'] = _compute_run_fingerprint(run_directory_mtime, samplesheet_to_parse, fastq_directory)
+        run['fingerprint']['layout'] = run_layout['layout']
+        run['fingerprint']['layout_directory_mtimes'] = run_layout['layout_directory_mtimes']
+    try:
+        with metrics.timer("parse_samplesheet"):
+            samplesheet = ss.parse_samplesheet(samplesheet_to_parse, run['instrument_type'])
+    except jsonschema.ValidationError as e:
+        metrics.increment("samplesheets_invalid")
+        return None
+
+    libraries = find_libraries(run, samplesheet, fastq_extensions)
+    for library in libraries:
+        if library['project_id'] in config['project_id_translation']:
+            samplesheet_project_id = library['project_id']
+            symlinking_project_id = config['project_id_translation'][samplesheet_project_id]
+            library['project_id'] = symlinking_project_id
+        elif library['project_id'] == '':
+            library['project_id'] = None
+    run['libraries'] = libraries
+    metrics.increment("libraries_found", len(libraries))
+
+    return run
+
+
+def _find_run_dirs(run_parent_dirs: list[str]) -> Iterable[str]:
+    """
+    List the sub-directories of each of the `run_parent_dirs`. Sub-directories are listed in order of
+    `run_parent_dirs`, then sorted by name, so that runs are always found in the same order.
+
+    :param run_parent_dirs: Directories to look for sequencing runs in.
+    :type run_parent_dirs: list[str]
+    :return: Paths to (potential) run directories.
+    :rtype: Iterable[str]
+    """
     for run_parent_dir in run_parent_dirs:
         if not os.path.exists(run_parent_dir):
             logging.warning(json.dumps({"event_type": "run_parent_dir_does_not_exist", "run_parent_dir": run_parent_dir}))
             continue
-        subdirs = os.scandir(run_parent_dir)
-        for subdir in subdirs:
-            run = {}
-            instrument_type = None
-            run_id = subdir.name
-            if re.match(miseq_run_id_regex, run_id):
-                instrument_type = "miseq"
-            elif re.match(nextseq_run_id_regex, run_id):
-                instrument_type = "nextseq"
-
-            subdir_is_dir = os.path.isdir(subdir.path)
-            upload_complete_file_exists = os.path.exists(os.path.join(subdir.path, "upload_complete.json"))
-            qc_check_complete_file_exists = os.path.exists(os.path.join(subdir.path, "qc_check_complete.json"))
-            determined_instrument_type = instrument_type != None
-
-            passed_run_qc_check = False
-            if qc_check_complete_file_exists:
-                try:
-                    qc_check = json.load(open(os.path.join(subdir.path, "qc_check_complete.json")))
-                except json.decoder.JSONDecodeError as e:
-                    logging.error(json.dumps({"event_type": "qc_check_json_decode_error", "sequencing_run_id": run_id, "error": str(e)}))
-                    qc_check = {}
-                overall_pass_fail = qc_check.get('overall_pass_fail', None)
-                if overall_pass_fail is not None and re.match("PASS", overall_pass_fail, re.IGNORECASE):
-                    passed_run_qc_check = True
-
-            conditions_checked = {
-                'subdir_is_directory': subdir_is_dir,
-                'upload_complete': upload_complete_file_exists,
-                'qc_check_complete': qc_check_complete_file_exists,
-                'passed_run_qc_check': passed_run_qc_check,
-                'determined_instrument_type': determined_instrument_type,
-            }
-            conditions_met = [v for k, v in conditions_checked.items()]
-            if not all(conditions_met):
-                logging.info(json.dumps({"event_type": "skipped_run", "sequencing_run_id": run_id, "conditions_checked": conditions_checked}))
-                yield None
-
-            if all(conditions_met):
-                logging.info(json.dumps({"event_type": "scan_run_start", "sequencing_run_id": run_id}))
-                samplesheet_paths = ss.find_samplesheets(subdir.path, instrument_type)
-                fastq_directory = _find_fastq_directory(subdir.path, instrument_type)
-                if fastq_directory != None:
-                    logging.debug(json.dumps({"event_type": "sequencing_run_found", "sequencing_run_id": run_id}))
-                    run = {
-                        "run_id": run_id,
-                        "instrument_type": instrument_type,
-                        "samplesheet_files": samplesheet_paths,
-                        "run_directory": subdir.path,
-                        "fastq_directory": fastq_directory,
-                    }
-                    samplesheet_to_parse = ss.choose_samplesheet_to_parse(run['samplesheet_files'], run['instrument_type'], run_id)
-                    if samplesheet_to_parse:
-                        logging.debug(json.dumps({"event_type": "samplesheet_found", "sequencing_run_id": run_id, "samplesheet_path": samplesheet_to_parse}))
-                    else:
-                        logging.error(json.dumps({"event_type": "samplesheet_not_found", "sequencing_run_id": run_id, "samplesheet_path": samplesheet_to_parse}))
-                        run['libraries'] = []
-                        continue
-
-                    run['parsed_samplesheet'] = samplesheet_to_parse
-                    try:
-                        samplesheet = ss.parse_samplesheet(samplesheet_to_parse, run['instrument_type'])
-                        libraries = find_libraries(run, samplesheet, fastq_extensions)
-                        for library in libraries:
-                            if library['project_id'] in config['project_id_translation']:
-                                samplesheet_project_id = library['project_id']
-                                symlinking_project_id = config['project_id_translation'][samplesheet_project_id]
-                                library['project_id'] = symlinking_project_id
-                            elif library['project_id'] == '':
-                                library['project_id'] = None
-                        run['libraries'] = libraries
-                        yield run
-                    except jsonschema.ValidationError as e:
-                        yield None
-                    
+        with os.scandir(run_parent_dir) as subdirs:
+            subdir_paths = sorted([subdir.path for subdir in subdirs])
+        for subdir_path in subdir_paths:
+            yield subdir_path
+
+
+def get_scan_worker_id(config: dict[str, object]) -> str:
+    """
+    :param config: Application config.
+    :type config: dict[str, object]
+    :return: The `scan_worker_id` from the config, or `<hostname>:<process ID>` if it isn't set.
+    :rtype: str
+    """
+    scan_worker_id = config.get('scan_worker_id', None)
+    if scan_worker_id is None:
+        scan_worker_id = socket.gethostname() + ":" + str(os.getpid())
+
+    return scan_worker_id
+
+
+def get_scan_lease_heartbeat_interval_seconds(config: dict[str, object]) -> float:
+    """
+    :param config: Application config.
+    :type config: dict[str, object]
+    :return: How often heartbeats should be sent, so that leases don't expire while this worker is alive. Infinite if `scan_leases` isn't enabled.
+    :rtype: float
+    """
+    if not config.get('scan_leases', False):
+        return float('inf')
+
+    return float(config.get('scan_lease_seconds', DEFAULT_SCAN_LEASE_SECONDS)) / 3
+
+
+def heartbeat_scan_worker(config: dict[str, object], force: bool = False):
+    """
+    If `scan_leases` is enabled, record that this worker is alive and extend all of its leases.
+    Heartbeats are only sent once per `get_scan_lease_heartbeat_interval_seconds`, unless `force` is True,
+    so this can be called often.
+
+    :param config: Application config.
+    :type config: dict[str, object]
+    :param force: Send a heartbeat even if one was sent recently.
+    :type force: bool
+    :return: None
+    :rtype: NoneType
+    """
+    global _last_scan_worker_heartbeat_time
+    if not config.get('scan_leases', False):
+        return
+    now = time.monotonic()
+    if not force and _last_scan_worker_heartbeat_time is not None and now - _last_scan_worker_heartbeat_time < get_scan_lease_heartbeat_interval_seconds(config):
+        return
+
+    lease_seconds = float(config.get('scan_lease_seconds', DEFAULT_SCAN_LEASE_SECONDS))
+    db.heartbeat_scan_worker(config, get_scan_worker_id(config), socket.gethostname(), lease_seconds)
+    _last_scan_worker_heartbeat_time = now
+    metrics.increment("scan_worker_heartbeats")
+
+
+def release_scan_leases(config: dict[str, object]):
+    """
+    If `scan_leases` is enabled, give up all of this worker's leases, so that other workers
+    can take over its runs straight away. Should be called before exiting.
+
+    :param config: Application config.
+    :type config: dict[str, object]
+    :return: None
+    :rtype: NoneType
+    """
+    global _last_scan_worker_heartbeat_time
+    if not config.get('scan_leases', False):
+        return
+    db.release_scan_leases(config, get_scan_worker_id(config))
+    _last_scan_worker_heartbeat_time = None
+    logging.info(json.dumps({"event_type": "scan_leases_released", "scan_worker_id": get_scan_worker_id(config)}))
+
+
+def _get_preferred_scan_worker_id(lease_key: str, scan_worker_ids: list[str]) -> Optional[str]:
+    """
+    Pick the worker that should hold a lease, by rendezvous (highest random weight) hashing. Every worker
+    picks the same one, and when a worker joins or leaves, only the leases that it would be picked for move.
+
+    :param lease_key: Lease key (eg. a run ID)
+    :type lease_key: str
+    :param scan_worker_ids: IDs of the live scan workers
+    :type scan_worker_ids: list[str]
+    :return: ID of the preferred worker, or None if there are no workers.
+    :rtype: str | None
+    """
+    if not scan_worker_ids:
+        return None
+
+    return max(scan_worker_ids, key=lambda scan_worker_id: hashlib.sha1((scan_worker_id + "/" + lease_key).encode('utf-8')).digest())
+
+
+def _claim_scan_leases(config: dict[str, object], lease_keys: list[str], live_scan_worker_ids: list[str]) -> set[str]:
+    """
+    :param config: Application config.
+    :type config: dict[str, object]
+    :param lease_keys: Keys of the leases to claim
+    :type lease_keys: list[str]
+    :param live_scan_worker_ids: IDs of the live scan workers, used to pick the preferred worker for each lease.
+    :type live_scan_worker_ids: list[str]
+    :return: Keys of the leases that this worker holds.
+    :rtype: set[str]
+    """
+    scan_worker_id = get_scan_worker_id(config)
+    lease_seconds = float(config.get('scan_lease_seconds', DEFAULT_SCAN_LEASE_SECONDS))
+    preferred_lease_keys = set([lease_key for lease_key in lease_keys if _get_preferred_scan_worker_id(lease_key, live_scan_worker_ids) == scan_worker_id])
+    claimed_lease_keys = db.claim_scan_leases(config, lease_keys, scan_worker_id, lease_seconds, preferred_lease_keys)
+
+    return claimed_lease_keys
+
+
+def _claim_run_dirs(config: dict[str, object], run_dir_paths: Iterable[str]) -> Iterator[str]:
+    """
+    Filter run directories down to those whose run this worker holds a lease on (see `db.claim_scan_leases`).
+    Leases are keyed by run ID, so workers that see the same run under different paths still share one lease.
+    Leases are claimed in batches, just before the runs are scanned, and a heartbeat is sent between batches
+    if one is due. Directories that can't be runs (by name) are passed through, without a lease.
+
+    :param config: Application config.
+    :type config: dict[str, object]
+    :param run_dir_paths: Paths to (potential) run directories.
+    :type run_dir_paths: Iterable[str]
+    :return: Paths to the run directories that this worker should scan.
+    :rtype: Iterator[str]
+    """
+    heartbeat_scan_worker(config)
+    lease_seconds = float(config.get('scan_lease_seconds', DEFAULT_SCAN_LEASE_SECONDS))
+    live_scan_worker_ids = db.get_live_scan_worker_ids(config, lease_seconds)
+    run_dir_paths = iter(run_dir_paths)
+    while True:
+        run_dir_paths_batch = list(itertools.islice(run_dir_paths, SCAN_LEASE_BATCH_SIZE))
+        if not run_dir_paths_batch:
+            return
+        heartbeat_scan_worker(config)
+        run_ids = [os.path.basename(run_dir_path) for run_dir_path in run_dir_paths_batch]
+        lease_keys = [run_id for run_id in run_ids if re.match(MISEQ_RUN_ID_REGEX, run_id) or re.match(NEXTSEQ_RUN_ID_REGEX, run_id)]
+        claimed_lease_keys = _claim_scan_leases(config, lease_keys, live_scan_worker_ids)
+        metrics.increment("run_leases_claimed", len(claimed_lease_keys))
+        metrics.increment("run_leases_skipped", len(lease_keys) - len(claimed_lease_keys))
+        for run_dir_path, run_id in zip(run_dir_paths_batch, run_ids):
+            if run_id in claimed_lease_keys or run_id not in lease_keys:
+                yield run_dir_path
+            else:
+                logging.debug(json.dumps({"event_type": "run_leased_by_other_worker", "sequencing_run_id": run_id}))
+
+
+def _claim_symlink_audit(config: dict[str, object]) -> bool:
+    """
+    :param config: Application config.
+    :type config: dict[str, object]
+    :return: Whether this worker should check the stored symlinks against the symlink directories. Always True if `scan_leases` isn't enabled.
+    :rtype: bool
+    """
+    if not config.get('scan_leases', False):
+        return True
+    heartbeat_scan_worker(config)
+    lease_seconds = float(config.get('scan_lease_seconds', DEFAULT_SCAN_LEASE_SECONDS))
+    live_scan_worker_ids = db.get_live_scan_worker_ids(config, lease_seconds)
+    claimed_lease_keys = _claim_scan_leases(config, [SYMLINK_AUDIT_LEASE_KEY], live_scan_worker_ids)
+
+    return SYMLINK_AUDIT_LEASE_KEY in claimed_lease_keys
+
+
+def find_runs(config: dict[str, object], run_dir_paths: Optional[list[str]] = None) -> Iterable[Optional[dict[str, object]]]:
+    """
+    Find all sequencing runs under all of the `run_parent_dirs` from the config.
+    Runs are found by matching sub-directory names against the following regexes: `"\\d{6}_M\\d{5}_\\d+_\\d{9}-[A-Z0-9]{5}"` (MiSeq) and `"\\d{6}_VH\\d{5}_\\d+_[A-Z0-9]{9}"` (NextSeq)
+
+    If `incremental_scan` is enabled in the config, runs whose fingerprint (see `_compute_run_fingerprint`)
+    hasn't changed since they were last stored are not re-parsed. They are yielded with `'unchanged': True`
+    and only the run info that was stored to the database.
+
+    If `scan_num_workers` is greater than 1 in the config, that many runs are checked and parsed concurrently
+    (in a pool of threads). Runs are always yielded in the same order, regardless of the number of workers.
+
+    If `scan_leases` is enabled, only runs that this worker holds a lease on are checked (see `_claim_run_dirs`),
+    so several workers can share the runs between them.
+
+    :param config: Application config.
+    :type config: dict[str, object]
+    :param run_dir_paths: Paths to run directories to be checked. If None, all sub-directories of all of the `run_parent_dirs` are checked.
+    :type run_dir_paths: list[str] | None
+    :return: Sequencing run info, or None for each directory that isn't a run that is ready to be symlinked.
+    :rtype: Iterable[dict[str, object] | None]
+    """
+    stored_runs = {}
+    if config.get('incremental_scan', False):
+        if run_dir_paths is None:
+            stored_runs = db.get_run_fingerprints(config)
+        else:
+            stored_runs = db.get_run_fingerprints(config, [os.path.basename(run_dir_path) for run_dir_path in run_dir_paths])
+
+    def find_run(run_dir_path):
+        with metrics.timer("find_run"):
+            return _find_run(config, run_dir_path, stored_runs.get(os.path.basename(run_dir_path), None))
+
+    if run_dir_paths is None:
+        run_dir_paths = _find_run_dirs(config['run_parent_dirs'])
+    if config.get('scan_leases', False):
+        run_dir_paths = _claim_run_dirs(config, run_dir_paths)
+
+    num_workers = int(config.get('scan_num_workers', 1))
+    if num_workers <= 1:
+        for run_dir_path in run_dir_paths:
+            yield find_run(run_dir_path)
+        return
+
+    # Keep a bounded number of runs in flight, and always yield the oldest one first.
+    executor = concurrent.futures.ThreadPoolExecutor(max_workers=num_workers, thread_name_prefix='find_runs')
+    runs_in_flight = collections.deque()
+    try:
+        for run_dir_path in run_dir_paths:
+            runs_in_flight.append(executor.submit(find_run, run_dir_path))
+            if len(runs_in_flight) >= num_workers * 2:
+                yield runs_in_flight.popleft().result()
+        while runs_in_flight:
+            yield runs_in_flight.popleft().result()
+    finally:
+        executor.shutdown(wait=True, cancel_futures=True)
+
+
+def find_symlinks_in_dir(symlinks_by_run_dir_path: str) -> list[dict[str, str]]:
+    """
+    Find all symlinks in a single per-run symlink directory (eg. `<fastq_symlinks_dir>/<run_id>`).
+
+    :param symlinks_by_run_dir_path: Path to the per-run symlink directory
+    :type symlinks_by_run_dir_path: str
+    :return: Symlinks, with keys: `sequencing_run_id`, `path`, `target`
+    :rtype: list[dict[str, str]]
+    """
+    symlinks = []
+    with os.scandir(symlinks_by_run_dir_path) as dir_items:
+        for dir_item in dir_items:
+            if dir_item.is_symlink():
+                path = dir_item.path
+                target = os.path.realpath(dir_item.path)
+                symlink = {
+                    "sequencing_run_id": os.path.basename(symlinks_by_run_dir_path),
+                    "path": path,
+                    "target": target,
+                }
+                symlinks.append(symlink)
+
+    return symlinks
+
+
+def iter_symlinks(projects: dict[str, object]) -> Iterator[tuple[str, dict[str, str]]]:
+    """
+    Find all existing symlinks under each project's `fastq_symlinks_dir`, one at a time.
+    At most one per-run symlink directory's worth of symlinks is held in memory.
+
+    :param projects: Project info, indexed by project ID.
+    :type projects: dict[str, object]
+    :return: (project ID, symlink) pairs
+    :rtype: Iterator[tuple[str, dict[str, str]]]
+    """
+    for project_id, project in projects.items():
+        fastq_symlinks_dir = project['fastq_symlinks_dir']
+        if not os.path.exists(fastq_symlinks_dir):
+            continue
+        with os.scandir(fastq_symlinks_dir) as project_symlinks_by_run_dirs:
+            for project_symlinks_by_run_dir in project_symlinks_by_run_dirs:
+                if not project_symlinks_by_run_dir.is_dir():
+                    continue
+                for symlink in find_symlinks_in_dir(project_symlinks_by_run_dir.path):
+                    yield project_id, symlink
 
 
 def find_symlinks(projects):
@@ -351,88 +917,356 @@ def find_symlinks(projects):
     :return: Dict of existing symlinks, indexed by project ID
     :rtype: dict[str, object]
     """
-    symlinks_by_project = {}
-    for project_id, project in projects.items():
-        symlinks_by_project[project_id] = []
+    symlinks_by_project = {project_id: [] for project_id in projects}
+    for project_id, symlink in iter_symlinks(projects):
+        symlinks_by_project[project_id].append(symlink)
+
+    return symlinks_by_project
+
+
+def reconcile_symlinks(config: dict[str, object], changed_project_ids_by_run_id: Optional[dict[str, set[str]]] = None) -> dict[str, int]:
+    """
+    Incremental alternative to `find_symlinks` followed by `db.store_symlinks`.
+    The modification time of each per-run symlink directory is stored. Only directories
+    whose modification time has changed since the last reconciliation (or that are new) are
+    re-walked, and only the stored symlinks for those directories are updated.
+    Directories that have been removed have their stored symlinks deleted.
+
+    Creating, removing, renaming or re-pointing (`ln -sfn`) a symlink all update the modification time of its directory.
+
+    :param config: Application config.
+    :type config: dict[str, object]
+    :param changed_project_ids_by_run_id: If provided, the IDs of the projects whose symlink directory for a run has changed (or was removed) are added to this, indexed by run ID.
+    :type changed_project_ids_by_run_id: dict[str, set[str]] | None
+    :return: Counts, with keys: `num_symlink_dirs_checked`, `num_symlink_dirs_changed`, `num_symlink_dirs_removed`, `num_symlinks_stored`, `num_symlinks_deleted`
+    :rtype: dict[str, int]
+    """
+    stored_symlink_dirs = db.get_symlink_directories(config)
+    changed_symlink_dirs, removed_symlink_dirs, num_symlink_dirs_checked = _find_changed_symlink_dirs(config, stored_symlink_dirs)
+
+    return _store_changed_symlink_dirs(config, changed_symlink_dirs, removed_symlink_dirs, num_symlink_dirs_checked, changed_project_ids_by_run_id)
+
+
+def _find_changed_symlink_dirs(config: dict[str, object], stored_symlink_dirs: dict[str, dict[str, object]]) -> tuple[list[dict[str, object]], list[dict[str, object]], int]:
+    """
+    The filesystem part of `reconcile_symlinks`: find the per-run symlink directories that have changed
+    since they were stored (with the symlinks that are in them now), and the ones that have been removed.
+
+    :param config: Application config.
+    :type config: dict[str, object]
+    :param stored_symlink_dirs: Stored symlink directories, indexed by path (see `db.get_symlink_directories`).
+    :type stored_symlink_dirs: dict[str, dict[str, object]]
+    :return: Tuple of (changed symlink directories, removed symlink directories, number of symlink directories checked)
+    :rtype: tuple[list[dict[str, object]], list[dict[str, object]], int]
+    """
+    num_symlink_dirs_checked = 0
+    changed_symlink_dirs = []
+    found_symlink_dir_paths = set()
+    for project_id, project in config['projects'].items():
         fastq_symlinks_dir = project['fastq_symlinks_dir']
-        if os.path.exists(fastq_symlinks_dir):
-            project_symlinks_by_run_dirs = os.scandir(fastq_symlinks_dir)
+        if not os.path.exists(fastq_symlinks_dir):
+            continue
+        with os.scandir(fastq_symlinks_dir) as project_symlinks_by_run_dirs:
             for project_symlinks_by_run_dir in project_symlinks_by_run_dirs:
-                if not os.path.isdir(project_symlinks_by_run_dir):
+                if not project_symlinks_by_run_dir.is_dir():
+                    continue
+                num_symlink_dirs_checked += 1
+                symlink_dir_path = project_symlinks_by_run_dir.path
+                found_symlink_dir_paths.add(symlink_dir_path)
+                # Take the mtime before walking the directory, so that changes made during the walk are picked up next time.
+                directory_mtime = project_symlinks_by_run_dir.stat().st_mtime
+                stored_symlink_dir = stored_symlink_dirs.get(symlink_dir_path, None)
+                if stored_symlink_dir is not None and stored_symlink_dir['project_id'] == project_id and stored_symlink_dir['directory_mtime'] == directory_mtime:
                     continue
-                project_symlinks_by_run_dir_contents = os.scandir(project_symlinks_by_run_dir)
-                for dir_item in project_symlinks_by_run_dir_contents:
-                    if os.path.islink(dir_item):
-                        path = dir_item.path
-                        target = os.path.realpath(dir_item.path)
-                        symlink = {
-                            "sequencing_run_id": os.path.basename(project_symlinks_by_run_dir),
-                            "path": path,
-                            "target": target,
-                        }
-                        symlinks_by_project[project_id].append(symlink)
+                changed_symlink_dirs.append({
+                    "path": symlink_dir_path,
+                    "project_id": project_id,
+                    "sequencing_run_id": project_symlinks_by_run_dir.name,
+                    "directory_mtime": directory_mtime,
+                    "symlinks": find_symlinks_in_dir(symlink_dir_path),
+                })
 
-    return symlinks_by_project
+    removed_symlink_dirs = []
+    for symlink_dir_path, stored_symlink_dir in stored_symlink_dirs.items():
+        if stored_symlink_dir['project_id'] in config['projects'] and symlink_dir_path not in found_symlink_dir_paths:
+            removed_symlink_dirs.append(stored_symlink_dir)
 
+    return changed_symlink_dirs, removed_symlink_dirs, num_symlink_dirs_checked
 
-def determine_symlinks_to_create_for_run(config: dict[str, object], run_id: str) -> dict[str, dict[str, str]]:
+
+def _store_changed_symlink_dirs(config: dict[str, object], changed_symlink_dirs: list[dict[str, object]], removed_symlink_dirs: list[dict[str, object]], num_symlink_dirs_checked: int, changed_project_ids_by_run_id: Optional[dict[str, set[str]]]) -> dict[str, int]:
     """
-    :param config: Application config
-    :type config: dict[str, object]
-    :param run_id: Sequencing run identifier
-    :type run_id: str
-    :return: Dictionary of file paths to fastq files for which symlinks should be created, indexed by project ID
-    :rtype: dict[str, dict[str, str]]
+    The database part of `reconcile_symlinks`: store the symlinks in the changed symlink directories, and delete
+    the ones in the removed symlink directories (see `db.reconcile_symlink_directories`).
+
+    :return: Counts (see `reconcile_symlinks`).
+    :rtype: dict[str, int]
     """
-    logging.debug(json.dumps({"event_type": "determine_symlinks_for_run_start", "sequencing_run_id": run_id}))
-    symlinks_to_create_by_project_id = {}
+    if changed_project_ids_by_run_id is not None:
+        for symlink_dir in changed_symlink_dirs + removed_symlink_dirs:
+            changed_project_ids_by_run_id.setdefault(symlink_dir['sequencing_run_id'], set()).add(symlink_dir['project_id'])
 
-    existing_symlinks = db.get_symlinks_by_run_id(config, run_id)
-    existing_project_target_pairs = set()
-    for symlink in existing_symlinks:
-        project_target_pair = (symlink['project_id'], symlink['target'])
-        existing_project_target_pairs.add(project_target_pair)
+    counts = db.reconcile_symlink_directories(config, changed_symlink_dirs, removed_symlink_dirs)
+    counts.update({
+        "num_symlink_dirs_checked": num_symlink_dirs_checked,
+        "num_symlink_dirs_changed": len(changed_symlink_dirs),
+        "num_symlink_dirs_removed": len(removed_symlink_dirs),
+    })
 
-    for project_id in config['projects']:
-        symlinks_to_create_by_project_id[project_id] = []
-        project_libraries = db.get_libraries_by_project_id_and_run_id(config, project_id, run_id)
-        project_excluded_runs = config['projects'][project_id]['excluded_runs']
-        project_excluded_libraries = config['projects'][project_id]['excluded_libraries']
+    return counts
 
-        for library in project_libraries:
+
+def determine_symlinks_to_create_for_runs(config: dict[str, object], run_ids: list[str], project_ids: Optional[set[str]] = None) -> dict[str, dict[str, list[dict[str, str]]]]:
+    """
+    Plan the symlinks for a batch of runs. All libraries and existing symlinks for the runs are fetched
+    with one query each, then grouped by project in memory, so the cost of planning doesn't depend on the
+    number of projects.
+
+    :param config: Application config
+    :type config: dict[str, object]
+    :param run_ids: Sequencing run identifiers
+    :type run_ids: list[str]
+    :param project_ids: Only plan symlinks for these projects. If None, symlinks are planned for all projects in the config.
+    :type project_ids: set[str] | None
+    :return: Symlinks to create, indexed by run ID, then by project ID.
+    :rtype: dict[str, dict[str, list[dict[str, str]]]]
+    """
+    existing_symlinks_by_run_id = db.get_symlinks_by_run_ids(config, run_ids)
+    libraries_by_run_id = db.get_libraries_by_run_ids(config, run_ids)
+
+    symlinks_to_create_by_run_id = {}
+    for run_id in run_ids:
+        logging.debug(json.dumps({"event_type": "determine_symlinks_for_run_start", "sequencing_run_id": run_id}))
+        existing_project_target_pairs = set()
+        for symlink in existing_symlinks_by_run_id[run_id]:
+            project_target_pair = (symlink['project_id'], symlink['target'])
+            existing_project_target_pairs.add(project_target_pair)
+
+        symlinks_to_create_by_project_id = {project_id: [] for project_id in config['projects'] if project_ids is None or project_id in project_ids}
+        for library in libraries_by_run_id[run_id]:
+            project_id = library['project_id']
+            if project_id not in symlinks_to_create_by_project_id:
+                continue
+            project_excluded_runs = config['projects'][project_id]['excluded_runs']
+            project_excluded_libraries = config['projects'][project_id]['excluded_libraries']
             if (library['sequencing_run_id'] not in project_excluded_runs) and (library['library_id'] not in project_excluded_libraries):
                 project_fastq_path_r1_pair = (library['project_id'], library['fastq_path_r1'])
                 if project_fastq_path_r1_pair not in existing_project_target_pairs:
                     fastq_path_r1 = {
                         'project_id': library['project_id'],
                         'sequencing_run_id': library['sequencing_run_id'],
+                        'library_id': library['library_id'],
                         'target': library['fastq_path_r1'],
                     }
                     symlinks_to_create_by_project_id[project_id].append(fastq_path_r1)
                     fastq_path_r2 = {
                         'project_id': library['project_id'],
                         'sequencing_run_id': library['sequencing_run_id'],
+                        'library_id': library['library_id'],
                         'target': library['fastq_path_r2'],
                     }
                     symlinks_to_create_by_project_id[project_id].append(fastq_path_r2)
 
-    total_num_symlinks_to_create = 0
-    num_symlinks_to_create_by_project_id = {}
-    for project_id, symlinks in symlinks_to_create_by_project_id.items():
-        num_symlinks_to_create_by_project_id[project_id] = len(symlinks)
-    logging.debug(json.dumps({
-        "event_type": "determine_symlinks_for_run_complete",
-        "sequencing_run_id": run_id,
-        "total_num_symlinks_to_create": total_num_symlinks_to_create,
-        "num_symlinks_to_create_by_project_id": num_symlinks_to_create_by_project_id,
-    }))
+        total_num_symlinks_to_create = 0
+        num_symlinks_to_create_by_project_id = {}
+        for project_id, symlinks in symlinks_to_create_by_project_id.items():
+            num_symlinks_to_create_by_project_id[project_id] = len(symlinks)
+            total_num_symlinks_to_create += len(symlinks)
+        logging.debug(json.dumps({
+            "event_type": "determine_symlinks_for_run_complete",
+            "sequencing_run_id": run_id,
+            "total_num_symlinks_to_create": total_num_symlinks_to_create,
+            "num_symlinks_to_create_by_project_id": num_symlinks_to_create_by_project_id,
+        }))
+        symlinks_to_create_by_run_id[run_id] = symlinks_to_create_by_project_id
+
+    return symlinks_to_create_by_run_id
+
 
+def determine_symlinks_to_create_for_run(config: dict[str, object], run_id: str, project_ids: Optional[set[str]] = None) -> dict[str, dict[str, str]]:
+    """
+    :param config: Application config
+    :type config: dict[str, object]
+    :param run_id: Sequencing run identifier
+    :type run_id: str
+    :param project_ids: Only plan symlinks for these projects. If None, symlinks are planned for all projects in the config.
+    :type project_ids: set[str] | None
+    :return: Dictionary of file paths to fastq files for which symlinks should be created, indexed by project ID
+    :rtype: dict[str, dict[str, str]]
+    """
+    symlinks_to_create_by_project_id = determine_symlinks_to_create_for_runs(config, [run_id], project_ids)[run_id]
 
     return symlinks_to_create_by_project_id
 
 
+def _get_symlink_filename(target: str, simplify_symlink_filenames: bool) -> str:
+    """
+    :param target: Path to the fastq file that the symlink will point to.
+    :type target: str
+    :param simplify_symlink_filenames: If True, the symlink is named like `<library_id>_R1.fastq.gz`. Otherwise it has the same name as the target.
+    :type simplify_symlink_filenames: bool
+    :return: Filename for the symlink
+    :rtype: str
+    """
+    if simplify_symlink_filenames:
+        target_basename = os.path.basename(target)
+        r1_r2_match = re.search("_(R[12])_", target_basename)
+        if r1_r2_match:
+            r1_r2 = r1_r2_match.group(1)
+        else:
+            r1_r2 = ""
+        symlink_filename = os.path.basename(target).split('_')[0] + '_' + r1_r2 + '.fastq.gz'
+    else:
+        symlink_filename = os.path.basename(target)
+
+    return symlink_filename
+
+
+def _create_symlink(symlink: dict[str, str]) -> Optional[OSError]:
+    """
+    :param symlink: Symlink to create, with keys: `target`, `path`
+    :type symlink: dict[str, str]
+    :return: None if the symlink was created, otherwise the error.
+    :rtype: OSError | None
+    """
+    # The order and naming of the parameters to os.symlink are a bit confusing
+    # src = 'target' = the original fastq file
+    # dst = 'path' = the symlink
+    try:
+        os.symlink(src=symlink['target'], dst=symlink['path'])
+    except OSError as e:
+        return e
+
+    return None
+
+
+def _write_symlinks_complete(symlink_parent_dir: str, num_symlinks_created: int):
+    """
+    Write the `symlinks_complete.json` file to a per-run symlink directory. The file is written
+    to a temporary file first, then renamed, so it is never seen partially-written.
+
+    :param symlink_parent_dir: Per-run symlink directory
+    :type symlink_parent_dir: str
+    :param num_symlinks_created: Number of symlinks that were created in the directory
+    :type num_symlinks_created: int
+    :return: None
+    :rtype: NoneType
+    """
+    project_symlinks_complete = {}
+    project_symlinks_complete['num_symlinks_created'] = num_symlinks_created
+    timestamp = datetime.datetime.now().isoformat()
+    project_symlinks_complete['timestamp'] = timestamp
+
+    symlinks_complete_path = os.path.join(symlink_parent_dir, 'symlinks_complete.json')
+    tmp_symlinks_complete_path = os.path.join(symlink_parent_dir, '.symlinks_complete.json.tmp')
+    with open(tmp_symlinks_complete_path, 'w') as f:
+        f.write(json.dumps(project_symlinks_complete, indent=2) + '\n')
+    os.replace(tmp_symlinks_complete_path, symlinks_complete_path)
+
+
+def _get_symlink_dir_mtimes(config: dict[str, object], project_ids: Iterable[str], run_id: str) -> dict[str, Optional[float]]:
+    """
+    :param config: Application config.
+    :type config: dict[str, object]
+    :param project_ids: Project IDs
+    :type project_ids: Iterable[str]
+    :param run_id: Sequencing run identifier
+    :type run_id: str
+    :return: Modification time of each project's symlink directory for the run (or None, if it doesn't exist), indexed by project ID.
+    :rtype: dict[str, float | None]
+    """
+    symlink_dir_mtimes = {}
+    for project_id in project_ids:
+        symlink_dir_path = os.path.join(config['projects'][project_id]['fastq_symlinks_dir'], run_id)
+        try:
+            symlink_dir_mtimes[project_id] = os.stat(symlink_dir_path).st_mtime
+        except FileNotFoundError:
+            symlink_dir_mtimes[project_id] = None
+
+    return symlink_dir_mtimes
+
+
+def register_created_symlinks(config: dict[str, object], symlinks_complete_by_project_id: dict[str, list[dict[str, str]]], run_id: str, previous_symlink_dir_mtimes: Optional[dict[str, Optional[float]]] = None) -> tuple[int, dict[str, list[dict[str, str]]]]:
+    """
+    Store the symlinks that were created for a run (see `create_symlinks`), so that they don't
+    need to be found by walking the symlink directories on the next scan.
+
+    Stored symlink targets are fully resolved (as they are when symlinks are found by `find_symlinks_in_dir`).
+    Each target directory is resolved once, rather than resolving every target.
+
+    :param config: Application config.
+    :type config: dict[str, object]
+    :param symlinks_complete_by_project_id: Symlinks that were created, indexed by project ID.
+    :type symlinks_complete_by_project_id: dict[str, list[dict[str, str]]]
+    :param run_id: Sequencing run identifier
+    :type run_id: str
+    :param previous_symlink_dir_mtimes: Modification times of the symlink directories before the symlinks were created, indexed by project ID (see `_get_symlink_dir_mtimes`). If provided, the directories' new modification times are stored, so that they aren't re-walked by `reconcile_symlinks`.
+    :type previous_symlink_dir_mtimes: dict[str, float | None] | None
+    :return: Tuple of (number of symlinks stored, the symlinks as they were stored (with resolved targets) indexed by project ID).
+    :rtype: tuple[int, dict[str, list[dict[str, str]]]]
+    """
+    symlinks_to_register_by_project_id, symlink_dirs = _prepare_created_symlinks(config, symlinks_complete_by_project_id, run_id, previous_symlink_dir_mtimes)
+    num_symlinks_stored = db.register_symlinks(config, symlinks_to_register_by_project_id, symlink_dirs)
+
+    return num_symlinks_stored, symlinks_to_register_by_project_id
+
+
+def _prepare_created_symlinks(config: dict[str, object], symlinks_complete_by_project_id: dict[str, list[dict[str, str]]], run_id: str, previous_symlink_dir_mtimes: Optional[dict[str, Optional[float]]] = None) -> tuple[dict[str, list[dict[str, str]]], Optional[list[dict[str, object]]]]:
+    """
+    The filesystem half of `register_created_symlinks`: resolve the symlinks' targets, and find the new
+    modification times of the symlink directories. Doesn't touch the database.
+
+    :param config: Application config.
+    :type config: dict[str, object]
+    :param symlinks_complete_by_project_id: Symlinks that were created, indexed by project ID.
+    :type symlinks_complete_by_project_id: dict[str, list[dict[str, str]]]
+    :param run_id: Sequencing run identifier
+    :type run_id: str
+    :param previous_symlink_dir_mtimes: See `register_created_symlinks`.
+    :type previous_symlink_dir_mtimes: dict[str, float | None] | None
+    :return: Tuple of (symlinks to store indexed by project ID, symlink directories to store or None). See `db.register_symlinks`.
+    :rtype: tuple[dict[str, list[dict[str, str]]], list[dict[str, object]] | None]
+    """
+    resolved_target_dirs = {}
+    symlinks_to_register_by_project_id = {}
+    for project_id, symlinks_complete in symlinks_complete_by_project_id.items():
+        symlinks_to_register_by_project_id[project_id] = []
+        for symlink in symlinks_complete:
+            target_dir, target_filename = os.path.split(symlink['target'])
+            if target_dir not in resolved_target_dirs:
+                resolved_target_dirs[target_dir] = os.path.realpath(target_dir)
+            resolved_target = os.path.join(resolved_target_dirs[target_dir], target_filename)
+            symlinks_to_register_by_project_id[project_id].append(dict(symlink, target=resolved_target))
+
+    symlink_dirs = None
+    if previous_symlink_dir_mtimes is not None:
+        symlink_dirs = []
+        symlink_dir_mtimes = _get_symlink_dir_mtimes(config, previous_symlink_dir_mtimes.keys(), run_id)
+        for project_id, directory_mtime in symlink_dir_mtimes.items():
+            if directory_mtime is None:
+                continue
+            symlink_dirs.append({
+                "path": os.path.join(config['projects'][project_id]['fastq_symlinks_dir'], run_id),
+                "project_id": project_id,
+                "sequencing_run_id": run_id,
+                "directory_mtime": directory_mtime,
+                "previous_directory_mtime": previous_symlink_dir_mtimes[project_id],
+            })
+
+    return symlinks_to_register_by_project_id, symlink_dirs
+
+
 def create_symlinks(config: dict[str, object], symlinks_to_create_by_project_id: dict[str, list[dict[str, str]]], run_id: str):
     """
+    Create symlinks. Each per-run symlink directory is created (if needed) once, before any symlinks
+    are created in it. If `symlink_num_workers` is greater than 1 in the config, that many symlinks
+    are created concurrently (in a pool of threads). A `symlinks_complete.json` file is written
+    to each per-run symlink directory once all of its symlinks have been created.
+
+    If creating any of the symlinks fails, the run is re-planned in full on the next scan (see `_set_replan_project_ids`).
+    Symlinks that are skipped, because they have no target or already exist, don't count as failures:
+    planning them again wouldn't change anything.
+
     :param config:
     :type config: dict[str, object]
     :param symlinks_to_create_by_project_id:
@@ -443,111 +1277,269 @@ def create_symlinks(config: dict[str, object], symlinks_to_create_by_project_id:
     :rtype: dict[str, list[dict[str, str]]]
     """
     logging.debug(json.dumps({"event_type": "create_symlinks_start", "sequencing_run_id": run_id}))
+    num_workers = int(config.get('symlink_num_workers', 1))
     symlinks_complete_by_project_id = {}
-    for project_id, symlinks in symlinks_to_create_by_project_id.items():
-        project_fastq_symlinks_dir = config['projects'][project_id]['fastq_symlinks_dir']
+    num_symlinks_failed_by_project_id = {}
+    executor = None
+    if num_workers > 1:
+        executor = concurrent.futures.ThreadPoolExecutor(max_workers=num_workers, thread_name_prefix='create_symlinks')
+    try:
+        for project_id, symlinks in symlinks_to_create_by_project_id.items():
+            project_fastq_symlinks_dir = config['projects'][project_id]['fastq_symlinks_dir']
+            simplify_symlink_filenames = config['projects'][project_id]['simplify_symlink_filenames']
+            symlinks_complete_by_project_id[project_id] = []
+            num_symlinks_failed_by_project_id[project_id] = 0
 
-        symlinks_complete_by_project_id[project_id] = []
-        for symlink in symlinks:
             # Defend against cases where symlink target is None
             # See https://github.com/BCCDC-PHL/auto-fastq-symlink/issues/18
-            if symlink['target'] is None:
-                continue
+            symlinks = [symlink for symlink in symlinks if symlink['target'] is not None]
+            symlink_parent_dirs = set()
+            for symlink in symlinks:
+                symlink_parent_dir = os.path.join(project_fastq_symlinks_dir, symlink['sequencing_run_id'])
+                symlink_parent_dirs.add(symlink_parent_dir)
+                symlink['path'] = os.path.join(symlink_parent_dir, _get_symlink_filename(symlink['target'], simplify_symlink_filenames))
+
+            for symlink_parent_dir in sorted(symlink_parent_dirs):
+                os.makedirs(symlink_parent_dir, exist_ok=True)
+
+            if executor is None:
+                errors = map(_create_symlink, symlinks)
+            else:
+                errors = executor.map(_create_symlink, symlinks)
+
+            for symlink, error in zip(symlinks, errors):
+                if error is None:
+                    symlinks_complete_by_project_id[project_id].append({
+                        "sequencing_run_id": symlink['sequencing_run_id'],
+                        "library_id": symlink.get('library_id', None),
+                        "target": symlink['target'],
+                        "path": symlink['path'],
+                    })
+                elif isinstance(error, FileExistsError):
+                    logging.warning(json.dumps({
+                        "event_type": "attempted_to_create_existing_symlink",
+                        "sequencing_run_id": run_id,
+                        "symlink_target": symlink['target'],
+                        "symlink_path": symlink['path'],
+                    }))
+                else:
+                    num_symlinks_failed_by_project_id[project_id] += 1
+                    logging.error(json.dumps({
+                        "event_type": "create_symlink_failed",
+                        "sequencing_run_id": run_id,
+                        "symlink_target": symlink['target'],
+                        "symlink_path": symlink['path'],
+                        "error": str(error),
+                    }))
+
+            for symlink_parent_dir in sorted(symlink_parent_dirs):
+                _write_symlinks_complete(symlink_parent_dir, len(symlinks_complete_by_project_id[project_id]))
+    finally:
+        if executor is not None:
+            executor.shutdown(wait=True)
+
+    total_num_symlinks_failed = sum(num_symlinks_failed_by_project_id.values())
+    metrics.increment("symlinks_failed", total_num_symlinks_failed)
+    if total_num_symlinks_failed > 0:
+        _runs_with_failed_symlinks.add(run_id)
+        logging.error(json.dumps({
+            "event_type": "create_symlinks_failures",
+            "sequencing_run_id": run_id,
+            "total_num_symlinks_failed": total_num_symlinks_failed,
+            "num_symlinks_failed_by_project_id": num_symlinks_failed_by_project_id,
+        }))
+    else:
+        _runs_with_failed_symlinks.discard(run_id)
 
-            symlink_parent_dir = os.path.join(project_fastq_symlinks_dir, symlink['sequencing_run_id'])
+    return symlinks_complete_by_project_id
 
-            if not os.path.exists(symlink_parent_dir):
-                os.makedirs(symlink_parent_dir)
 
-            if config['projects'][project_id]['simplify_symlink_filenames']:
-                target_basename = os.path.basename(symlink['target'])
-                r1_r2_match = re.search("_(R[12])_", target_basename)
-                if r1_r2_match:
-                    r1_r2 = r1_r2_match.group(1)
-                else:
-                    r1_r2 = ""
-                symlink_filename = os.path.basename(symlink['target']).split('_')[0] + '_' + r1_r2 + '.fastq.gz'
-            else:
-                symlink_filename = os.path.basename(symlink['target'])
-
-            symlink['path'] = os.path.join(symlink_parent_dir, symlink_filename)
-
-            # The order and naming of the parameters to os.symlink are a bit confusing
-            # src = 'target' = the original fastq file
-            # dst = 'path' = the symlink
-            try:
-                os.symlink(src=symlink['target'], dst=symlink['path'])
-                symlinks_complete_by_project_id[project_id].append({"target": symlink['target'], "path": symlink['path']})
-            except FileExistsError as e:
-                logging.warning(json.dumps({
-                    "event_type": "attempted_to_create_existing_symlink",
-                    "sequencing_run_id": run_id,
-                    "symlink_target": symlink['target'],
-                    "symlink_path": symlink['path'],
-                }))
-
-            project_symlinks_complete = {}
-            project_symlinks_complete['num_symlinks_created'] = len(symlinks_complete_by_project_id[project_id])
-            timestamp = datetime.datetime.now().isoformat()
-            project_symlinks_complete['timestamp'] = timestamp
-
-            with open(os.path.join(symlink_parent_dir, 'symlinks_complete.json'), 'w') as f:
-                f.write(json.dumps(project_symlinks_complete, indent=2) + '\n')
-                
-    return symlinks_complete_by_project_id
+def _symlink_audit_due(config: dict[str, object]) -> bool:
+    """
+    Symlinks are stored as they're created (see `register_created_symlinks`), so the stored symlinks only drift
+    from what's on disk if symlinks are created, removed or re-pointed by something else. By default, the
+    stored symlinks are checked against the symlink directories on every scan. If `symlink_audit_interval_seconds`
+    is set, they're only checked if at least that long has passed since the last check.
+
+    :param config: Application config.
+    :type config: dict[str, object]
+    :return: Whether the stored symlinks should be checked against the symlink directories on this scan.
+    :rtype: bool
+    """
+    symlink_audit_interval_seconds = config.get('symlink_audit_interval_seconds', None)
+    if symlink_audit_interval_seconds is None or _last_symlink_audit_time is None:
+        return True
+
+    return time.monotonic() - _last_symlink_audit_time >= float(symlink_audit_interval_seconds)
 
 
-def scan(config: dict[str, object]) -> Iterable[Optional[dict[str, object]]]:
+def _audit_symlinks(config: dict[str, object], changed_project_ids_by_run_id: dict[str, set[str]]):
+    """
+    Bring the stored symlinks in line with the symlink directories: store the symlinks that exist but
+    aren't stored, and delete the stored symlinks that no longer exist. If `write_manifests` is set,
+    each project's manifest is then compacted (see `manifest.compact_manifest`).
+
+    :param config: Application config.
+    :type config: dict[str, object]
+    :param changed_project_ids_by_run_id: The IDs of the projects whose symlink directory for a run has changed are added to this, indexed by run ID (incremental scans only).
+    :type changed_project_ids_by_run_id: dict[str, set[str]]
+    :return: None
+    :rtype: NoneType
+    """
+    global _last_symlink_audit_time
+    # Take the time before the audit, so that the interval is measured between the starts of audits.
+    audit_start_time = time.monotonic()
+    if config.get('incremental_scan', False):
+        logging.debug(json.dumps({"event_type": "reconcile_symlinks_start"}))
+        with metrics.timer("reconcile_symlinks"):
+            reconcile_symlinks_counts = reconcile_symlinks(config, changed_project_ids_by_run_id)
+        metrics.increment("symlink_dirs_changed", reconcile_symlinks_counts['num_symlink_dirs_changed'])
+        logging.debug(json.dumps(dict({"event_type": "reconcile_symlinks_complete"}, **reconcile_symlinks_counts)))
+    else:
+        # Symlinks are found and stored in chunks, rather than collecting all of them first.
+        logging.debug(json.dumps({"event_type": "find_and_store_symlinks_start"}))
+        with metrics.timer("find_and_store_symlinks"):
+            store_symlinks_counts = db.store_symlinks_in_chunks(config, iter_symlinks(config['projects']))
+        logging.debug(json.dumps(dict({"event_type": "find_and_store_symlinks_complete"}, **store_symlinks_counts)))
+
+    logging.debug(json.dumps({"event_type": "delete_nonexistent_symlinks_start"}))
+    with metrics.timer("delete_nonexistent_symlinks"):
+        delete_nonexistent_symlinks_counts = db.delete_nonexistent_symlinks(config)
+    metrics.increment("nonexistent_symlinks_deleted", delete_nonexistent_symlinks_counts['num_symlinks_deleted'])
+    logging.info(json.dumps(dict({"event_type": "delete_nonexistent_symlinks_complete"}, **delete_nonexistent_symlinks_counts)))
+
+    if config.get('write_manifests', False):
+        # The stored symlinks have just been brought up to date, so the manifests can be re-written from them.
+        with metrics.timer("compact_manifests"):
+            compact_manifests_counts = manifest.compact_manifests(config)
+        metrics.increment("manifests_rewritten", compact_manifests_counts['num_manifests_rewritten'])
+        logging.debug(json.dumps(dict({"event_type": "compact_manifests_complete"}, **compact_manifests_counts)))
+    _last_symlink_audit_time = audit_start_time
+
+
+def scan(config: dict[str, object], changed_project_ids: Optional[set[str]] = None) -> Iterable[Optional[dict[str, object]]]:
     """
     Scanning involves looking for all existing runs and storing them to the database,
     then looking for all existing symlinks and storing them to the database.
     At the end of a scan, we should be able to determine which (if any) symlinks need to be created.
+    If `symlink_audit_interval_seconds` is set, existing symlinks are only looked for once per interval (see `_symlink_audit_due`).
+    If `scan_leases` is enabled, only runs that this worker holds a lease on are scanned, and existing symlinks
+    are only looked for by the worker that holds the symlink audit lease.
+
+    If `changed_project_ids` is provided, projects are only stored if some of them changed. In incremental scans,
+    runs that haven't changed are yielded with `replan_project_ids`: the changed projects, plus any projects
+    whose symlink directory for the run has changed. `symlink_run` only re-plans the symlinks for those projects.
 
     :param config: Application config.
     :type config: dict[str, object]
+    :param changed_project_ids: IDs of projects that were added or whose settings or exclusions changed since the last scan (see `config.get_changed_project_ids`). If None, everything is re-stored and re-planned.
+    :type changed_project_ids: set[str] | None
     :return: None
     :rtype: NoneType
     """
+    changed_project_ids, changed_project_ids_by_run_id = _begin_scan(config, changed_project_ids)
+    for run in _find_and_store_runs(config):
+        _set_replan_project_ids(run, changed_project_ids, changed_project_ids_by_run_id)
+        yield run
+
+
+def _begin_scan(config: dict[str, object], changed_project_ids: Optional[set[str]]) -> tuple[Optional[set[str]], dict[str, set[str]]]:
+    """
+    The steps of a scan that come before runs are found: store the projects, and check the stored
+    symlinks against the symlink directories (if an audit is due, and this worker holds the audit lease).
+
+    :param config: Application config.
+    :type config: dict[str, object]
+    :param changed_project_ids: See `scan`.
+    :type changed_project_ids: set[str] | None
+    :return: Tuple of (changed project IDs, changed project IDs indexed by run ID), to be passed to `_set_replan_project_ids`.
+    :rtype: tuple[set[str] | None, dict[str, set[str]]]
+    """
     logging.info(json.dumps({"event_type": "scan_start"}))
     logging.debug(json.dumps({"event_type": "collect_projects_start"}))
-    projects = collect_project_info(config)
+    with metrics.timer("collect_projects"):
+        projects = collect_project_info(config)
     num_projects = len(projects)
     logging.debug(json.dumps({"event_type": "collect_projects_complete", "num_projects": num_projects}))
 
-    logging.debug(json.dumps({"event_type": "store_projects_start"}))
-    db.store_projects(config, projects)
-    logging.debug(json.dumps({"event_type": "store_projects_complete"}))
+    if changed_project_ids is None or changed_project_ids:
+        logging.debug(json.dumps({"event_type": "store_projects_start"}))
+        with metrics.timer("store_projects"):
+            db.store_projects(config, projects)
+        logging.debug(json.dumps({"event_type": "store_projects_complete"}))
 
-    logging.debug(json.dumps({"event_type": "find_symlinks_start"}))
-    num_symlinks_found = 0
-    symlinks_by_destination_dir = find_symlinks(config['projects'])
-    for destination_dir, symlinks in symlinks_by_destination_dir.items():
-        num_symlinks_found += len(symlinks)
-    logging.debug(json.dumps({"event_type": "find_symlinks_complete", "num_symlinks_found": num_symlinks_found}))
+    changed_project_ids_by_run_id = {}
+    symlink_auditor = _claim_symlink_audit(config)
+    if symlink_auditor and _symlink_audit_due(config):
+        _audit_symlinks(config, changed_project_ids_by_run_id)
+    else:
+        logging.debug(json.dumps({"event_type": "symlink_audit_skipped", "reason": "not_due" if symlink_auditor else "leased_by_other_worker"}))
+        metrics.increment("symlink_audits_skipped")
+    if not symlink_auditor:
+        # Only the worker that audits the symlinks knows which symlink directories have changed.
+        changed_project_ids = None
 
-    logging.debug(json.dumps({"event_type": "store_symlinks_start"}))
-    db.store_symlinks(config, symlinks_by_destination_dir)
-    logging.debug(json.dumps({"event_type": "store_symlinks_complete"}))
+    return changed_project_ids, changed_project_ids_by_run_id
+
+
+def _set_replan_project_ids(run: Optional[dict[str, object]], changed_project_ids: Optional[set[str]], changed_project_ids_by_run_id: dict[str, set[str]]):
+    """
+    Nothing that the plan for an unchanged run depends on has changed, other than the config and symlinks
+    of the changed projects. Runs where symlinks couldn't be created last time are re-planned in full.
+    """
+    if run is not None and run.get('unchanged', False) and changed_project_ids is not None and run['run_id'] not in _runs_with_failed_symlinks:
+        run['replan_project_ids'] = changed_project_ids | changed_project_ids_by_run_id.get(run['run_id'], set())
 
-    logging.debug(json.dumps({"event_type": "delete_nonexistent_symlinks_start"}))
-    db.delete_nonexistent_symlinks(config)
-    logging.debug(json.dumps({"event_type": "delete_nonexistent_symlinks_complete"}))
 
+def scan_runs(config: dict[str, object], run_dir_paths: list[str]) -> Iterable[Optional[dict[str, object]]]:
+    """
+    Scan only the specified run directories, and store the runs that are found to the database.
+    Used to react to new runs between full scans (see: `auto_fastq_symlink.watch`). Projects and
+    existing symlinks aren't re-scanned, so this should only be called after at least one full scan.
+
+    :param config: Application config.
+    :type config: dict[str, object]
+    :param run_dir_paths: Paths to run directories to be scanned.
+    :type run_dir_paths: list[str]
+    :return: Sequencing run info, or None for each directory that isn't a run that is ready to be symlinked.
+    :rtype: Iterable[dict[str, object] | None]
+    """
+    logging.info(json.dumps({"event_type": "scan_runs_start", "run_directories": run_dir_paths}))
+    yield from _find_and_store_runs(config, run_dir_paths)
+
+
+def _find_and_store_runs(config: dict[str, object], run_dir_paths: Optional[list[str]] = None) -> Iterable[Optional[dict[str, object]]]:
+    """
+    :param config: Application config.
+    :type config: dict[str, object]
+    :param run_dir_paths: Paths to run directories to be scanned. If None, all of the `run_parent_dirs` are scanned.
+    :type run_dir_paths: list[str] | None
+    :return: Sequencing run info, or None for each directory that isn't a run that is ready to be symlinked.
+    :rtype: Iterable[dict[str, object] | None]
+    """
     logging.debug(json.dumps({"event_type": "find_and_store_runs_start"}))
     num_runs_found = 0
-    for run in find_runs(config):
+    num_runs_unchanged = 0
+    for run in find_runs(config, run_dir_paths):
         if run is not None:
-            db.store_run(config, run)
+            if run.get('unchanged', False):
+                num_runs_unchanged += 1
+                metrics.increment("runs_unchanged")
+            else:
+                with metrics.timer("store_run"):
+                    db.store_run(config, run)
             num_runs_found += 1
+            metrics.increment("runs_found")
         yield run
 
-    logging.info(json.dumps({"event_type": "find_and_store_runs_complete", "num_runs_found": num_runs_found}))
+    logging.info(json.dumps({"event_type": "find_and_store_runs_complete", "num_runs_found": num_runs_found, "num_runs_unchanged": num_runs_unchanged}))
 
 
 def symlink_run(config: dict[str, object], run: dict[str, object]):
     """
     Determine which symlinks need to be created for one run, based on the current state of the database.
-    Then create all symlinks that need to be created.
+    Then create all symlinks that need to be created, and store the ones that were created.
+    If `write_manifests` is set, rows for the symlinks that were created are added to each project's manifest.
 
     :param config: Application config.
     :type config: dict[str, object]
@@ -557,13 +1549,69 @@ def symlink_run(config: dict[str, object], run: dict[str, object]):
     :rtype: NoneType
     """
     run_id = run['run_id']
-    logging.debug(json.dumps({"event_type": "symlink_run_start", "sequencing_run_id": run_id}))
+    replan_project_ids = run.get('replan_project_ids', None)
+    if not _start_symlink_run(run):
+        return
+
+    with metrics.timer("determine_symlinks_to_create"):
+        symlinks_to_create = determine_symlinks_to_create_for_run(config, run_id, replan_project_ids)
+    previous_symlink_dir_mtimes = None
+    if config.get('incremental_scan', False):
+        previous_symlink_dir_mtimes = _get_symlink_dir_mtimes(config, [project_id for project_id, symlinks in symlinks_to_create.items() if symlinks], run_id)
+    with metrics.timer("create_symlinks"):
+        symlinks_complete_by_project_id = create_symlinks(config, symlinks_to_create, run_id)
+    manifest_project_ids = []
+    if config.get('write_manifests', False):
+        manifest_project_ids = [project_id for project_id, symlinks_complete in symlinks_complete_by_project_id.items() if symlinks_complete]
+    # Held until the stored symlinks have been appended, so that a compaction (which reads the stored symlinks) can't add them first.
+    manifest.lock_manifests(config, manifest_project_ids)
+    try:
+        with metrics.timer("register_symlinks"):
+            num_symlinks_registered, symlinks_registered_by_project_id = register_created_symlinks(config, symlinks_complete_by_project_id, run_id, previous_symlink_dir_mtimes)
+        metrics.increment("symlinks_registered", num_symlinks_registered)
+        if config.get('write_manifests', False):
+            # With the same (resolved) targets as the stored symlinks, so that compaction doesn't change these rows.
+            with metrics.timer("append_to_manifests"):
+                for project_id, symlinks_registered in symlinks_registered_by_project_id.items():
+                    manifest.append_to_manifest(config, project_id, symlinks_registered)
+    finally:
+        manifest.unlock_manifests(config, manifest_project_ids)
+    _finish_symlink_run(run_id, symlinks_complete_by_project_id)
+
+
+def _start_symlink_run(run: dict[str, object]) -> bool:
+    """
+    :param run: Sequencing run info.
+    :type run: dict[str, object]
+    :return: Whether the run's symlinks need to be re-planned (see `_set_replan_project_ids`). If not, the skip is logged.
+    :rtype: bool
+    """
+    run_id = run['run_id']
+    replan_project_ids = run.get('replan_project_ids', None)
+    if replan_project_ids is not None and not replan_project_ids:
+        logging.debug(json.dumps({"event_type": "symlink_run_skipped", "sequencing_run_id": run_id, "reason": "run_config_and_symlinks_unchanged"}))
+        metrics.increment("runs_not_replanned")
+        return False
+    logging.debug(json.dumps({"event_type": "symlink_run_start", "sequencing_run_id": run_id, "replan_project_ids": sorted(replan_project_ids) if replan_project_ids is not None else None}))
+
+    return True
+
+
+def _finish_symlink_run(run_id: str, symlinks_complete_by_project_id: dict[str, list[dict[str, str]]]):
+    """
+    Count the symlinks that were created for a run, and log the result.
 
-    symlinks_to_create = determine_symlinks_to_create_for_run(config, run_id)
-    symlinks_complete_by_project_id = create_symlinks(config, symlinks_to_create, run_id)
+    :param run_id: Sequencing run identifier
+    :type run_id: str
+    :param symlinks_complete_by_project_id: Symlinks that were created, indexed by project ID.
+    :type symlinks_complete_by_project_id: dict[str, list[dict[str, str]]]
+    :return: None
+    :rtype: NoneType
+    """
     total_num_symlinks_created = 0
     for project_id, symlinks_complete in symlinks_complete_by_project_id.items():
         total_num_symlinks_created += len(symlinks_complete)
+    metrics.increment("symlinks_created", total_num_symlinks_created)
     logging.debug(json.dumps({"event_type": "create_symlinks_complete", "sequencing_run_id": run_id}))
     num_symlinks_created_by_project_id = {project_id: len(symlinks) for project_id, symlinks in symlinks_complete_by_project_id.items()}
     logging.info(json.dumps({
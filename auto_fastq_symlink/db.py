@@ -1,48 +1,452 @@
+import concurrent.futures
+import contextlib
+import contextvars
+import csv
 import datetime
+import io
+import itertools
 import json
 import logging
 import os
+import time
+from typing import Iterable, Iterator, Optional
 
-from sqlalchemy.orm import Session, sessionmaker
-from sqlalchemy import create_engine
+from sqlalchemy.orm import Session, scoped_session, sessionmaker
+from sqlalchemy import create_engine, event, and_, cast, func, or_, text, tuple_
+from sqlalchemy.dialects.postgresql import JSONB
+from sqlalchemy.dialects.postgresql import insert as postgresql_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.engine import Engine, make_url
+from sqlalchemy.ext.asyncio import AsyncEngine, AsyncSession, create_async_engine
+from sqlalchemy.pool import QueuePool
 
 import auto_fastq_symlink.util as util
 
 from auto_fastq_symlink.model import *
 
+# One engine (and connection pool) is shared by the whole process.
+# It is (re)built by `init_db` whenever the connection URI or pool settings in the config change.
+_engine = None
+_engine_settings = None
+_Session = scoped_session(sessionmaker())
+
+# The engine used by `auto_fastq_symlink.async_core` (see `init_async_db`). Its connections belong to the
+# event loop that opened them, so it is disposed of (with `dispose_async_db`) before that loop closes.
+_async_engine = None
+_async_engine_settings = None
+# The session that `session_scope` hands out while a function runs inside `run_in_async_session`.
+_async_session = contextvars.ContextVar('_async_session', default=None)
+
+# The asyncio driver that is used for each database backend, unless `async_database_connection_uri` is set in the config.
+ASYNC_DRIVERS = {
+    "sqlite": "aiosqlite",
+    "postgresql": "asyncpg",
+}
+
+DATABASE_POOL_SETTINGS = [
+    'pool_size',
+    'max_overflow',
+    'pool_timeout',
+    'pool_recycle',
+    'pool_pre_ping',
+]
+
+# Applied to every SQLite connection when `sqlite_performance_mode` is enabled in the config.
+# Individual pragmas can be added or overridden with the `sqlite_pragmas` config entry.
+SQLITE_PERFORMANCE_PRAGMAS = {
+    "journal_mode": "WAL",     # Readers don't block the writer (or vice versa)
+    "synchronous": "NORMAL",   # In WAL mode, only checkpoints wait for an fsync, not every commit
+    "cache_size": -65536,      # Negative values are in KiB (64 MiB)
+    "mmap_size": 268435456,    # 256 MiB
+    "temp_store": "MEMORY",
+    "busy_timeout": 5000,      # Milliseconds to wait for another process's lock before failing
+}
+
+# Keep `IN (...)` clauses under SQLite's limit on the number of bound parameters in one statement.
+IN_CLAUSE_CHUNK_SIZE = 500
+
+# Columns that are bulk-loaded with `COPY` when storing symlinks in PostgreSQL (see `_copy_symlinks`).
+SYMLINK_COPY_COLUMNS = ['project_id', 'sequencing_run_id', 'library_id', 'path', 'target']
+
+# Symlinks are stored and checked this many at a time (unless `symlink_chunk_size` is set in the config),
+# so memory use doesn't grow with the total number of symlinks.
+DEFAULT_SYMLINK_CHUNK_SIZE = 1000
+
+
+def _get_engine_settings(config: dict[str, object]) -> tuple[str, dict[str, object]]:
+    """
+    Collect the connection URI and connection pool settings from the config.
+    Pool settings are taken from the (optional) `database_pool` config entry.
+
+    :param config: Application config.
+    :type config: dict[str, object]
+    :return: Tuple of (connection URI, keyword arguments to `create_engine`)
+    :rtype: tuple[str, dict[str, object]]
+    """
+    connection_uri = str(config['database_connection_uri'])
+    pool_config = config.get('database_pool', {})
+    engine_kwargs = {}
+    for pool_setting in DATABASE_POOL_SETTINGS:
+        if pool_setting in pool_config:
+            engine_kwargs[pool_setting] = pool_config[pool_setting]
+
+    # SQLite file databases don't use a QueuePool by default, so the size-related
+    # settings would be rejected unless we ask for one explicitly.
+    queue_pool_settings = ['pool_size', 'max_overflow', 'pool_timeout']
+    if connection_uri.startswith('sqlite') and any([k in engine_kwargs for k in queue_pool_settings]):
+        engine_kwargs['poolclass'] = QueuePool
+        engine_kwargs['connect_args'] = {'check_same_thread': False}
+    # SQLite only allows one writer at a time, so in performance mode (unless the pool is configured explicitly)
+    # all database work goes through a single long-lived connection, which keeps its page cache and memory map
+    # between sessions instead of re-opening the database file for each one.
+    elif connection_uri.startswith('sqlite') and config.get('sqlite_performance_mode', False):
+        engine_kwargs['poolclass'] = QueuePool
+        engine_kwargs['pool_size'] = 1
+        engine_kwargs['max_overflow'] = 0
+        engine_kwargs['connect_args'] = {'check_same_thread': False}
+
+    return connection_uri, engine_kwargs
+
+
+def _get_sqlite_pragmas(config: dict[str, object]) -> dict[str, object]:
+    """
+    Collect the pragmas to apply to each new SQLite connection: `SQLITE_PERFORMANCE_PRAGMAS` if
+    `sqlite_performance_mode` is enabled, updated with the (optional) `sqlite_pragmas` config entry.
+
+    :param config: Application config.
+    :type config: dict[str, object]
+    :return: Pragma values, indexed by pragma name. Empty for databases other than SQLite.
+    :rtype: dict[str, object]
+    :raises ValueError: If a pragma name or value isn't a plain identifier or number.
+    """
+    if not str(config['database_connection_uri']).startswith('sqlite'):
+        return {}
+
+    pragmas = {}
+    if config.get('sqlite_performance_mode', False):
+        pragmas.update(SQLITE_PERFORMANCE_PRAGMAS)
+    pragmas.update(config.get('sqlite_pragmas', {}))
+    for pragma, value in pragmas.items():
+        # Pragmas can't be set with bound parameters, so only allow values that are safe to format into the statement.
+        if not pragma.isidentifier() or not (isinstance(value, int) or str(value).isidentifier()):
+            raise ValueError("Invalid SQLite pragma: " + str(pragma) + " = " + str(value))
+
+    return pragmas
+
+
+def _set_sqlite_pragmas(dbapi_connection, pragmas: dict[str, object]):
+    """
+    Apply pragmas to a new SQLite connection. Used as a `connect` event listener (see `init_db`).
+
+    :param dbapi_connection: sqlite3 connection
+    :type dbapi_connection: sqlite3.Connection
+    :param pragmas: Pragma values, indexed by pragma name.
+    :type pragmas: dict[str, object]
+    :return: None
+    """
+    cursor = dbapi_connection.cursor()
+    for pragma, value in pragmas.items():
+        cursor.execute("PRAGMA " + pragma + " = " + str(value))
+    cursor.close()
+
+
+def init_db(config: dict[str, object]) -> Engine:
+    """
+    Get the process-wide database engine, creating it if it doesn't exist yet. If the connection URI,
+    pool settings or SQLite pragmas have changed since the engine was created, the old engine is
+    disposed of and a new one is created.
+
+    :param config: Application config.
+    :type config: dict[str, object]
+    :return: The shared database engine.
+    :rtype: sqlalchemy.engine.Engine
+    """
+    global _engine, _engine_settings
+    connection_uri, engine_kwargs = _get_engine_settings(config)
+    sqlite_pragmas = _get_sqlite_pragmas(config)
+    engine_settings = (connection_uri, json.dumps(engine_kwargs, sort_keys=True, default=str), json.dumps(sqlite_pragmas, sort_keys=True))
+    if _engine is None or engine_settings != _engine_settings:
+        dispose_db()
+        _engine = create_engine(connection_uri, **engine_kwargs)
+        if sqlite_pragmas:
+            event.listen(_engine, 'connect', lambda dbapi_connection, connection_record: _set_sqlite_pragmas(dbapi_connection, sqlite_pragmas))
+        _engine_settings = engine_settings
+        _Session.configure(bind=_engine)
+        logging.debug(json.dumps({
+            "event_type": "database_engine_created",
+            "pool_settings": {k: v for k, v in engine_kwargs.items() if k in DATABASE_POOL_SETTINGS},
+            "sqlite_pragmas": sqlite_pragmas,
+        }))
+
+    return _engine
+
+
+def dispose_db():
+    """
+    Close all sessions and release all pooled connections held by the shared engine.
+    """
+    global _engine, _engine_settings
+    _Session.remove()
+    if _engine is not None:
+        _engine.dispose()
+    _engine = None
+    _engine_settings = None
+
+
+@contextlib.contextmanager
+def session_scope(config: dict[str, object]) -> Iterator[Session]:
+    """
+    Provide a session from the shared session factory. The session is rolled back if an exception is raised,
+    and is always closed (returning its connection to the pool) when the block exits.
+
+    :param config: Application config.
+    :type config: dict[str, object]
+    :return: Database session
+    :rtype: Iterator[sqlalchemy.orm.Session]
+    """
+    async_session = _async_session.get()
+    if async_session is not None:
+        # Inside `run_in_async_session`, which opened (and will close) this session.
+        try:
+            yield async_session
+        except Exception as e:
+            async_session.rollback()
+            raise e
+        return
+
+    init_db(config)
+    session = _Session()
+    try:
+        yield session
+    except Exception as e:
+        session.rollback()
+        raise e
+    finally:
+        _Session.remove()
+
+
+def get_async_connection_uri(config: dict[str, object]) -> str:
+    """
+    :param config: Application config.
+    :type config: dict[str, object]
+    :return: The `async_database_connection_uri` from the config if it is set, otherwise the `database_connection_uri` with its driver replaced by an asyncio driver (see `ASYNC_DRIVERS`).
+    :rtype: str
+    :raises ValueError: If there is no asyncio driver for the database.
+    """
+    if config.get('async_database_connection_uri', None):
+        return str(config['async_database_connection_uri'])
+
+    url = make_url(str(config['database_connection_uri']))
+    backend = url.get_backend_name()
+    if backend not in ASYNC_DRIVERS:
+        raise ValueError("No asyncio driver for database: " + backend + ". Supported databases: " + ", ".join(sorted(ASYNC_DRIVERS)))
+
+    return str(url.set(drivername=backend + "+" + ASYNC_DRIVERS[backend]))
+
+
+def init_async_db(config: dict[str, object]) -> AsyncEngine:
+    """
+    Get the process-wide asyncio database engine, creating it if it doesn't exist yet (or if its settings have
+    changed). It uses the same connection pool settings and SQLite pragmas as the engine from `init_db`.
+
+    :param config: Application config.
+    :type config: dict[str, object]
+    :return: The shared asyncio database engine.
+    :rtype: sqlalchemy.ext.asyncio.AsyncEngine
+    """
+    global _async_engine, _async_engine_settings
+    connection_uri = get_async_connection_uri(config)
+    pool_config = config.get('database_pool', {})
+    engine_kwargs = {}
+    # SQLite databases don't use a queue pool by default, so the pool settings don't apply.
+    if not connection_uri.startswith('sqlite'):
+        engine_kwargs = {pool_setting: pool_config[pool_setting] for pool_setting in DATABASE_POOL_SETTINGS if pool_setting in pool_config}
+    sqlite_pragmas = _get_sqlite_pragmas(config)
+    engine_settings = (connection_uri, json.dumps(engine_kwargs, sort_keys=True, default=str), json.dumps(sqlite_pragmas, sort_keys=True))
+    if _async_engine is None or engine_settings != _async_engine_settings:
+        _async_engine = create_async_engine(connection_uri, **engine_kwargs)
+        if sqlite_pragmas:
+            event.listen(_async_engine.sync_engine, 'connect', lambda dbapi_connection, connection_record: _set_sqlite_pragmas(dbapi_connection, sqlite_pragmas))
+        _async_engine_settings = engine_settings
+        logging.debug(json.dumps({"event_type": "async_database_engine_created", "pool_settings": engine_kwargs, "sqlite_pragmas": sqlite_pragmas}))
+
+    return _async_engine
+
+
+async def dispose_async_db():
+    """
+    Release all pooled connections held by the shared asyncio engine.
+    """
+    global _async_engine, _async_engine_settings
+    if _async_engine is not None:
+        await _async_engine.dispose()
+    _async_engine = None
+    _async_engine_settings = None
+
+
+def _call_with_session(session: Session, fn, args: tuple) -> object:
+    """
+    Call `fn(*args)`, with `session_scope` handing out `session` for the duration of the call.
+    """
+    token = _async_session.set(session)
+    try:
+        return fn(*args)
+    finally:
+        _async_session.reset(token)
+
+
+async def run_in_async_session(config: dict[str, object], fn, *args) -> object:
+    """
+    Call one of the functions in this module (or any function that only uses the database through them)
+    on the shared asyncio engine. The function runs in its own session, and while it waits for the
+    database, other coroutines on the same event loop can run.
+
+    :param config: Application config.
+    :type config: dict[str, object]
+    :param fn: Function to call (eg. `store_run`)
+    :type fn: Callable
+    :param args: Arguments to pass to `fn`
+    :type args: tuple
+    :return: The return value of `fn`.
+    :rtype: object
+    """
+    async with AsyncSession(init_async_db(config)) as session:
+        return await session.run_sync(_call_with_session, fn, args)
+
 
 def store_projects(config, projects):
     """
     """
-    connection_uri = config['database_connection_uri']
-    engine = create_engine(connection_uri)
-    Session = sessionmaker(bind=engine)
-    session = Session()
+    with session_scope(config) as session:
+        existing_projects = session.query(Project).all()
+        existing_project_ids = set([project.project_id for project in existing_projects])
 
-    existing_projects = session.query(Project).all()
-    existing_project_ids = set([project.project_id for project in existing_projects])
+        projects_to_store = []
+        for project_id, project in projects.items():
+            if project_id not in existing_project_ids:
+                p = Project(
+                    project_id = project_id,
+                    fastq_symlinks_directory = project['fastq_symlinks_dir']
+                )
+                projects_to_store.append(p)
 
-    projects_to_store = []
-    for project_id, project in projects.items():
-        if project_id not in existing_project_ids:
-            p = Project(
-                project_id = project_id,
-                fastq_symlinks_directory = project['fastq_symlinks_dir']
-            )
-            projects_to_store.append(p)
+        for project in projects_to_store:
+            logging.debug(json.dumps({"event_type": "project_stored", "project_id": project.project_id}))
 
-    for project in projects_to_store:
-        logging.debug(json.dumps({"event_type": "project_stored", "project_id": project.project_id}))
+        insert = _get_dialect_insert(session)
+        if insert is not None and projects_to_store:
+            # Another scan worker may store the same projects between the query above and this insert.
+            rows = [{"project_id": p.project_id, "fastq_symlinks_directory": p.fastq_symlinks_directory} for p in projects_to_store]
+            session.execute(insert(Project.__table__).values(rows).on_conflict_do_nothing(index_elements=['project_id']))
+        else:
+            session.add_all(projects_to_store)
+        session.commit()
 
-    session.add_all(projects_to_store)
-    session.commit()
 
+def _chunks(items: Iterable, chunk_size: int) -> Iterator[list]:
+    """
+    :param items: Items to be split into chunks. May be a generator, which is consumed one chunk at a time.
+    :type items: Iterable
+    :param chunk_size: Maximum number of items per chunk
+    :type chunk_size: int
+    :return: Consecutive chunks of `items`
+    :rtype: Iterator[list]
+    """
+    items = iter(items)
+    while True:
+        chunk = list(itertools.islice(items, chunk_size))
+        if not chunk:
+            return
+        yield chunk
 
-def store_libraries(session: Session, run: dict[str, object]):
+
+def _get_dialect_insert(session: Session):
+    """
+    Get the dialect-specific `insert` construct for the database that the session is bound to.
+    Only the SQLite and PostgreSQL dialects support `INSERT ... ON CONFLICT`.
+
+    :param session: Database session
+    :type session: sqlalchemy.orm.Session
+    :return: The dialect's `insert` function, or None if the dialect doesn't support `ON CONFLICT`.
+    :rtype: Callable | None
+    """
+    dialect_name = session.get_bind().dialect.name
+    if dialect_name == 'sqlite':
+        return sqlite_insert
+    elif dialect_name == 'postgresql':
+        return postgresql_insert
+    else:
+        return None
+
+
+def _bulk_upsert(session: Session, model, rows: list[dict[str, object]], key_columns: list[str], update_columns: list[str]):
+    """
+    Insert many rows in a single statement. If a row with the same key already exists, update its `update_columns`
+    (and `timestamp_updated`), but only if at least one of those columns has actually changed.
+    Does not commit.
+
+    :param session: Database session
+    :type session: sqlalchemy.orm.Session
+    :param model: The model class for the table (eg. `Library`)
+    :type model: type
+    :param rows: Rows to upsert. Every row should have the same keys.
+    :type rows: list[dict[str, object]]
+    :param key_columns: Columns that identify a row (the table's primary key)
+    :type key_columns: list[str]
+    :param update_columns: Columns to update when a row with the same key already exists
+    :type update_columns: list[str]
+    :return: None
+    """
+    if not rows:
+        return
+
+    timestamp_updated = datetime.datetime.now()
+    rows = [dict(row, timestamp_updated=timestamp_updated) for row in rows]
+    insert = _get_dialect_insert(session)
+    if insert is None:
+        for row in rows:
+            session.merge(model(**row))
+        return
+
+    table = model.__table__
+    stmt = insert(table)
+    set_ = {column: stmt.excluded[column] for column in update_columns + ['timestamp_updated']}
+    column_changed = []
+    for column in update_columns:
+        stored_value, new_value = table.c[column], stmt.excluded[column]
+        # PostgreSQL has no equality operator for `json` values, but does for `jsonb`.
+        if isinstance(stored_value.type, JSON) and session.get_bind().dialect.name == 'postgresql':
+            stored_value, new_value = cast(stored_value, JSONB), cast(new_value, JSONB)
+        column_changed.append(stored_value.is_distinct_from(new_value))
+    any_column_changed = or_(*column_changed)
+    stmt = stmt.on_conflict_do_update(index_elements=key_columns, set_=set_, where=any_column_changed)
+    session.execute(stmt, rows)
+
+
+def store_libraries(session: Session, run: dict[str, object]) -> int:
     """
+    Store all of the run's libraries. The libraries that are already stored for the run are loaded with a single query,
+    and only new libraries, or libraries whose project or fastq paths have changed, are written.
+    Does not commit.
+
+    :param session: Database session
+    :type session: sqlalchemy.orm.Session
+    :param run: Sequencing run info, including its libraries.
+    :type run: dict[str, object]
+    :return: Number of libraries written.
+    :rtype: int
     """
     run_id = run['run_id']
-    
+    library_columns = ['project_id', 'fastq_path_r1', 'fastq_path_r2']
+
+    existing_libraries = session.query(
+        Library.library_id,
+        Library.project_id,
+        Library.fastq_path_r1,
+        Library.fastq_path_r2,
+    ).filter(Library.sequencing_run_id == run_id)
+    existing_libraries_by_id = {row.library_id: tuple(row[1:]) for row in existing_libraries}
+
     libraries_to_store = []
     for library in run['libraries']:
         if library['project_id'] == "":
@@ -50,78 +454,72 @@ def store_libraries(session: Session, run: dict[str, object]):
         else:
             project_id = library['project_id']
 
-        logging.debug(json.dumps({
-            "event_type": "preparing_to_queue_library_for_storage",
-            "sequencing_run_id": run_id,
-            "library_id": library['library_id'],
-            "project_id": library['project_id'],
-            "fastq_path_r1": library['fastq_path_r1'],
-            "fastq_path_r2": library['fastq_path_r2'],
-        }))
-        l = Library(
-            library_id = library['library_id'],
-            sequencing_run_id = run_id,
-            project_id = project_id,
-            fastq_path_r1 = library['fastq_path_r1'],
-            fastq_path_r2 = library['fastq_path_r2'],
-        )
+        l = {
+            'library_id': library['library_id'],
+            'sequencing_run_id': run_id,
+            'project_id': project_id,
+            'fastq_path_r1': library['fastq_path_r1'],
+            'fastq_path_r2': library['fastq_path_r2'],
+        }
+        if existing_libraries_by_id.get(l['library_id'], None) == tuple([l[k] for k in library_columns]):
+            continue
         libraries_to_store.append(l)
         logging.debug(json.dumps({
             "event_type": "queued_library_for_storage",
             "sequencing_run_id": run_id,
             "library_id": library['library_id'],
-            "project_id": library['project_id'],
+            "project_id": project_id,
             "fastq_path_r1": library['fastq_path_r1'],
             "fastq_path_r2": library['fastq_path_r2']
         }))
 
-    session.add_all(libraries_to_store)
-    session.commit()
-    logging.debug(json.dumps({"event_type": "run_libraries_stored", "sequencing_run_id": run_id}))
+    _bulk_upsert(session, Library, libraries_to_store, ['library_id', 'sequencing_run_id'], library_columns)
+    logging.debug(json.dumps({
+        "event_type": "run_libraries_stored",
+        "sequencing_run_id": run_id,
+        "num_libraries_stored": len(libraries_to_store),
+        "num_libraries_unchanged": len(run['libraries']) - len(libraries_to_store),
+    }))
 
+    return len(libraries_to_store)
 
-def update_libraries(session: Session, run: dict[str, object]):
+
+def store_run_fingerprint(session: Session, run: dict[str, object]):
     """
+    Queue the run's fingerprint (directory & samplesheet mtimes, samplesheet size and layout) for storage.
+    Runs that were found without a fingerprint (non-incremental scans) are left untouched.
+    Does not commit.
     """
-    run_id = run['run_id']
+    if run.get('fingerprint') is None:
+        return
 
-    for library in run['libraries']:
-        existing_library = session.query(Library).filter(
-            Library.sequencing_run_id == run_id,
-            Library.library_id == library['library_id']).first()
+    fingerprint_columns = [
+        'run_directory_mtime',
+        'samplesheet_mtime',
+        'samplesheet_size',
+        'fastq_directory_mtime',
+        'layout',
+        'layout_directory_mtimes',
+    ]
+    f = {'sequencing_run_id': run['run_id']}
+    for column in fingerprint_columns:
+        f[column] = run['fingerprint'].get(column, None)
+    _bulk_upsert(session, SequencingRunFingerprint, [f], ['sequencing_run_id'], fingerprint_columns)
+    logging.debug(json.dumps({"event_type": "run_fingerprint_queued_for_storage", "sequencing_run_id": run['run_id']}))
 
-        if existing_library:
-            existing_library.library_id = library['library_id']
-            existing_library.project_id = library['project_id']
-            existing_library.fastq_path_r1 = library['fastq_path_r1']
-            existing_library.fastq_path_r2 = library['fastq_path_r2']
-            session.commit()
-            logging.debug(json.dumps({"event_type": "library_updated", "sequencing_run_id": run_id, "library_id": library['library_id']}))
-        else:
-            l = Library(
-                library_id = library['library_id'],
-                sequencing_run_id = run_id,
-                project_id = library['project_id'],
-                fastq_path_r1 = library['fastq_path_r1'],
-                fastq_path_r2 = library['fastq_path_r2'],
-            )
-            session.add(l)
-            session.commit()
-            logging.debug(json.dumps({"event_type": "library_stored", "sequencing_run_id": run_id, "library_id": library['library_id']}))
-            
 
 def store_run(config: dict[str, object], run: dict[str, object]):
     """
-    """
-
-    connection_uri = str(config['database_connection_uri'])
-    engine = create_engine(connection_uri)
-    Session = sessionmaker(bind=engine)
-    session = Session()
+    Store the run, its libraries and its fingerprint in a single transaction.
+    If the run is already stored, only its samplesheet and fastq directory are updated.
 
+    :param config: Application config.
+    :type config: dict[str, object]
+    :param run: Sequencing run info, including its libraries.
+    :type run: dict[str, object]
+    :return: None
+    """
     run_id = run['run_id']
-    existing_run = session.query(SequencingRun).filter(SequencingRun.sequencing_run_id == run_id).first()
-
     six_digit_date = run_id.split('_')[0]
     year = int("20" + six_digit_date[0:2])
     month = int(six_digit_date[2:4])
@@ -130,162 +528,865 @@ def store_run(config: dict[str, object], run: dict[str, object]):
 
     instrument_id = run_id.split('_')[1]
 
-    if existing_run:
-        existing_run.samplesheet = run['parsed_samplesheet']
-        existing_run.fastq_directory = run['fastq_directory']
-        session.commit()
-        logging.debug(json.dumps({"event_type": "run_updated", "run_id": run_id}))
-        update_libraries(session, run)
-    else:
-        r = SequencingRun(
-            sequencing_run_id = run_id,
-            run_date = run_date,
-            instrument_type = run['instrument_type'],
-            instrument_id = instrument_id,
-            samplesheet = run['parsed_samplesheet'],
-            run_directory = run['run_directory'],
-            fastq_directory = run['fastq_directory'],
-        )
-        session.add(r)
+    r = {
+        'sequencing_run_id': run_id,
+        'run_date': run_date,
+        'instrument_type': run['instrument_type'],
+        'instrument_id': instrument_id,
+        'samplesheet': run['parsed_samplesheet'],
+        'run_directory': run['run_directory'],
+        'fastq_directory': run['fastq_directory'],
+    }
+
+    with session_scope(config) as session:
+        _bulk_upsert(session, SequencingRun, [r], ['sequencing_run_id'], ['samplesheet', 'fastq_directory'])
+        store_run_fingerprint(session, run)
         store_libraries(session, run)
+        session.commit()
         logging.debug(json.dumps({"event_type": "run_stored", "run_id": run_id}))
 
 
+def _make_symlink_row(project_id: str, sequencing_run_id: str, path: str, target: str, library_id: Optional[str] = None) -> dict[str, str]:
+    """
+    :return: Row for the `symlink` table. If the library ID isn't known, it is taken from the start of the target's filename.
+    :rtype: dict[str, str]
+    """
+    if library_id is None:
+        library_id = os.path.basename(target).split('_')[0]
+    symlink_row = {
+        "project_id": project_id,
+        "sequencing_run_id": sequencing_run_id,
+        "library_id": library_id,
+        "path": path,
+        "target": target,
+    }
+
+    return symlink_row
+
+
+def _supports_copy(session: Session) -> bool:
+    """
+    :param session: Database session
+    :type session: sqlalchemy.orm.Session
+    :return: Whether symlinks can be bulk-loaded with `COPY` (PostgreSQL, via psycopg2).
+    :rtype: bool
+    """
+    dialect = session.get_bind().dialect
+
+    return dialect.name == 'postgresql' and dialect.driver == 'psycopg2'
+
+
+def _copy_symlinks(session: Session, symlink_rows: list[dict[str, str]]) -> int:
+    """
+    Bulk-load symlinks into PostgreSQL. The rows are streamed into a temporary staging table with `COPY`,
+    then moved into the `symlink` table with a single `INSERT ... SELECT ... ON CONFLICT DO NOTHING`,
+    so symlinks that are already stored are skipped by the server rather than checked with a separate query.
+    Does not commit.
+
+    :param session: Database session (bound to PostgreSQL, using psycopg2)
+    :type session: sqlalchemy.orm.Session
+    :param symlink_rows: Rows for the `symlink` table, as made by `_make_symlink_row`
+    :type symlink_rows: list[dict[str, str]]
+    :return: Number of symlinks stored.
+    :rtype: int
+    """
+    if not symlink_rows:
+        return 0
+
+    connection = session.connection()
+    # Temporary tables belong to the database connection, so the staging table is
+    # created once per pooled connection and emptied after each use.
+    connection.execute(text(
+        "CREATE TEMPORARY TABLE IF NOT EXISTS symlink_staging (" +
+        ", ".join([column + " VARCHAR" for column in SYMLINK_COPY_COLUMNS]) +
+        ")"
+    ))
+    copy_buffer = io.StringIO()
+    writer = csv.writer(copy_buffer, lineterminator='\n')
+    for symlink_row in symlink_rows:
+        writer.writerow([symlink_row[column] for column in SYMLINK_COPY_COLUMNS])
+    copy_buffer.seek(0)
+    cursor = connection.connection.cursor()
+    try:
+        cursor.copy_expert("COPY symlink_staging (" + ", ".join(SYMLINK_COPY_COLUMNS) + ") FROM STDIN WITH (FORMAT csv)", copy_buffer)
+    finally:
+        cursor.close()
+
+    result = connection.execute(
+        text(
+            "INSERT INTO symlink (" + ", ".join(SYMLINK_COPY_COLUMNS) + ", timestamp_updated) " +
+            "SELECT " + ", ".join(SYMLINK_COPY_COLUMNS) + ", :timestamp_updated FROM symlink_staging " +
+            "ON CONFLICT (path, target) DO NOTHING"
+        ),
+        {"timestamp_updated": datetime.datetime.now()},
+    )
+    connection.execute(text("TRUNCATE symlink_staging"))
+
+    return result.rowcount
+
+
+def _insert_symlinks(session: Session, symlink_rows: list[dict[str, str]]) -> int:
+    """
+    Insert symlinks that aren't already stored. Uses `COPY` (see `_copy_symlinks`) where it's supported,
+    otherwise a single multi-row `INSERT`. Does not commit.
+
+    :param session: Database session
+    :type session: sqlalchemy.orm.Session
+    :param symlink_rows: Rows for the `symlink` table, as made by `_make_symlink_row`
+    :type symlink_rows: list[dict[str, str]]
+    :return: Number of symlinks stored.
+    :rtype: int
+    """
+    if not symlink_rows:
+        return 0
+    if _supports_copy(session):
+        return _copy_symlinks(session, symlink_rows)
+
+    session.execute(Symlink.__table__.insert(), symlink_rows)
+
+    return len(symlink_rows)
+
+
 def store_symlinks(config: dict[str, object], symlinks_by_project_id: dict[str, object]):
     """
     """
-    connection_uri = str(config['database_connection_uri'])
-    engine = create_engine(connection_uri)
-    Session = sessionmaker(bind=engine)
-    session = Session()
+    symlinks = ((project_id, symlink) for project_id, project_symlinks in symlinks_by_project_id.items() for symlink in project_symlinks)
+    store_symlinks_in_chunks(config, symlinks)
 
-    existing_symlinks = session.query(Symlink).all()
-    existing_symlink_path_target_tuples = set([(symlink.path, symlink.target) for symlink in existing_symlinks])
+
+def store_symlinks_in_chunks(config: dict[str, object], symlinks: Iterable[tuple[str, dict[str, str]]]) -> dict[str, int]:
+    """
+    Store symlinks that aren't already stored, consuming `symlinks` in chunks of `symlink_chunk_size`.
+    Each chunk is checked against only the stored symlinks with the same paths, so memory use is
+    bounded by the chunk size rather than the total number of symlinks. In PostgreSQL, each chunk
+    is bulk-loaded with `COPY`, and the server skips the symlinks that are already stored.
+
+    :param config: Application config.
+    :type config: dict[str, object]
+    :param symlinks: (project ID, symlink) pairs, as produced by `core.iter_symlinks`.
+    :type symlinks: Iterable[tuple[str, dict[str, str]]]
+    :return: Counts, with keys: `num_symlinks_found`, `num_symlinks_stored`
+    :rtype: dict[str, int]
+    """
+    chunk_size = int(config.get('symlink_chunk_size', DEFAULT_SYMLINK_CHUNK_SIZE))
+    num_symlinks_found = 0
+    num_symlinks_stored = 0
+    with session_scope(config) as session:
+        for symlinks_chunk in _chunks(symlinks, chunk_size):
+            num_symlinks_found += len(symlinks_chunk)
+            symlink_rows = [_make_symlink_row(project_id, symlink['sequencing_run_id'], symlink['path'], symlink['target']) for project_id, symlink in symlinks_chunk]
+            num_symlinks_stored += _store_new_symlinks(session, symlink_rows)
+            session.commit()
+
+    return {"num_symlinks_found": num_symlinks_found, "num_symlinks_stored": num_symlinks_stored}
+
+
+def _store_new_symlinks(session: Session, symlink_rows: list[dict[str, str]]) -> int:
+    """
+    Store the symlinks that aren't already stored. The rows are checked against only the stored
+    symlinks with the same paths. In PostgreSQL, the rows are bulk-loaded with `COPY`, and the server
+    skips the symlinks that are already stored. Does not commit.
+
+    :param session: Database session
+    :type session: sqlalchemy.orm.Session
+    :param symlink_rows: Rows for the `symlink` table, as made by `_make_symlink_row`
+    :type symlink_rows: list[dict[str, str]]
+    :return: Number of symlinks stored.
+    :rtype: int
+    """
+    if _supports_copy(session):
+        return _copy_symlinks(session, symlink_rows)
+
+    paths = list(set([symlink_row['path'] for symlink_row in symlink_rows]))
+    existing_symlink_path_target_tuples = set()
+    for paths_chunk in _chunks(paths, IN_CLAUSE_CHUNK_SIZE):
+        query_result = session.query(Symlink.path, Symlink.target).filter(Symlink.path.in_(paths_chunk))
+        existing_symlink_path_target_tuples.update([(row.path, row.target) for row in query_result])
 
     symlinks_to_store = []
+    for symlink_row in symlink_rows:
+        path_target_tuple = (symlink_row['path'], symlink_row['target'])
+        if path_target_tuple not in existing_symlink_path_target_tuples:
+            existing_symlink_path_target_tuples.add(path_target_tuple)
+            symlinks_to_store.append(symlink_row)
+
+    return _insert_symlinks(session, symlinks_to_store)
+
+
+def register_symlinks(config: dict[str, object], symlinks_by_project_id: dict[str, list[dict[str, str]]], symlink_dirs: Optional[list[dict[str, object]]] = None) -> int:
+    """
+    Store symlinks that have just been created (see `core.create_symlinks`), so that they don't need to be
+    found by walking the symlink directories. All of the symlinks (and symlink directories) are stored in one transaction.
+
+    If `symlink_dirs` are provided, the stored modification time of each directory is updated, so that it isn't
+    re-walked by `core.reconcile_symlinks`. A directory's modification time is only updated if the stored symlinks
+    were already up-to-date before the symlinks were created: if its stored modification time matches
+    `previous_directory_mtime`, or if the directory didn't exist before (`previous_directory_mtime` is None) and
+    isn't stored. Otherwise, the directory is left to be re-walked.
+
+    :param config: Application config.
+    :type config: dict[str, object]
+    :param symlinks_by_project_id: Symlinks that were created, with keys: `sequencing_run_id`, `path`, `target` and (optionally) `library_id`, indexed by project ID.
+    :type symlinks_by_project_id: dict[str, list[dict[str, str]]]
+    :param symlink_dirs: Per-run symlink directories that the symlinks were created in, with keys: `path`, `project_id`, `sequencing_run_id`, `directory_mtime`, `previous_directory_mtime`.
+    :type symlink_dirs: list[dict[str, object]] | None
+    :return: Number of symlinks stored.
+    :rtype: int
+    """
+    symlink_rows = []
     for project_id, symlinks in symlinks_by_project_id.items():
         for symlink in symlinks:
-            path_target_tuple = (symlink['path'], symlink['target'])
-            if path_target_tuple not in existing_symlink_path_target_tuples:
-                library_id = os.path.basename(symlink['target']).split('_')[0]
-                s = Symlink(
-                    project_id = project_id,
-                    sequencing_run_id = symlink['sequencing_run_id'],
-                    library_id = library_id,
-                    path = symlink['path'],
-                    target = symlink['target'],
-                )
-                symlinks_to_store.append(s)
+            symlink_rows.append(_make_symlink_row(project_id, symlink['sequencing_run_id'], symlink['path'], symlink['target'], symlink.get('library_id', None)))
+    if symlink_dirs is None:
+        symlink_dirs = []
+
+    with session_scope(config) as session:
+        num_symlinks_stored = _store_new_symlinks(session, symlink_rows)
+
+        symlink_dir_paths = [symlink_dir['path'] for symlink_dir in symlink_dirs]
+        stored_symlink_dirs = {}
+        for paths_chunk in _chunks(symlink_dir_paths, IN_CLAUSE_CHUNK_SIZE):
+            for row in session.query(SymlinkDirectory).filter(SymlinkDirectory.path.in_(paths_chunk)):
+                stored_symlink_dirs[row.path] = row
+        symlink_dir_columns = ['path', 'project_id', 'sequencing_run_id', 'directory_mtime']
+        symlink_dir_rows = []
+        for symlink_dir in symlink_dirs:
+            stored_symlink_dir = stored_symlink_dirs.get(symlink_dir['path'], None)
+            if stored_symlink_dir is None:
+                up_to_date = symlink_dir['previous_directory_mtime'] is None
+            else:
+                up_to_date = stored_symlink_dir.project_id == symlink_dir['project_id'] and stored_symlink_dir.directory_mtime == symlink_dir['previous_directory_mtime']
+            if up_to_date:
+                symlink_dir_rows.append({column: symlink_dir[column] for column in symlink_dir_columns})
+        _bulk_upsert(session, SymlinkDirectory, symlink_dir_rows, ['path'], symlink_dir_columns[1:])
+
+        session.commit()
 
-    session.add_all(symlinks_to_store)
-    session.commit()
+    return num_symlinks_stored
 
 
-def delete_nonexistent_symlinks(config):
+def get_symlink_directories(config: dict[str, object]) -> dict[str, dict[str, object]]:
     """
+    :param config: Application config.
+    :type config: dict[str, object]
+    :return: Per-run symlink directories (with their modification time at the last reconciliation), indexed by path.
+    :rtype: dict[str, dict[str, object]]
     """
-    connection_uri = config['database_connection_uri']
-    engine = create_engine(connection_uri)
-    Session = sessionmaker(bind=engine)
-    session = Session()
+    with session_scope(config) as session:
+        query_result = session.query(SymlinkDirectory).all()
 
-    existing_symlinks = session.query(Symlink).all()
+        symlink_directories = {}
+        for row in query_result:
+            symlink_directories[row.path] = util.row2dict(row)
 
-    for symlink in existing_symlinks:
-        if not os.path.exists(symlink.path):
-            session.delete(symlink)
+        return symlink_directories
 
-    session.commit()
-    
 
-def get_symlinks(config: dict[str, object]) -> list[dict[str, object]]:
+def _get_symlinks_in_directory(session: Session, symlink_dir: dict[str, object]) -> list[Symlink]:
     """
+    All of the symlinks in a per-run symlink directory belong to the same project and run,
+    so they can be found without loading the whole `symlink` table.
     """
-    connection_uri = config['database_connection_uri']
-    engine = create_engine(connection_uri)
-    Session = sessionmaker(bind=engine)
-    session = Session()
+    query_result = session.query(Symlink).filter(
+        Symlink.project_id == symlink_dir['project_id'],
+        Symlink.sequencing_run_id == symlink_dir['sequencing_run_id'],
+    )
+    symlinks_in_dir = [symlink for symlink in query_result if os.path.dirname(symlink.path) == symlink_dir['path']]
 
-    query_result = session.query(Symlink).all()
+    return symlinks_in_dir
 
-    existing_symlinks = []
-    for row in query_result:
-        existing_symlinks.append(util.row2dict(row))
-        
 
-    return existing_symlinks
+def reconcile_symlink_directories(config: dict[str, object], changed_symlink_dirs: list[dict[str, object]], removed_symlink_dirs: list[dict[str, object]]) -> dict[str, int]:
+    """
+    Bring the stored symlinks for each of the changed (or removed) per-run symlink directories in line with
+    what is currently in that directory, and record each directory's modification time. Symlinks in
+    directories that haven't changed are left untouched.
+
+    :param config: Application config.
+    :type config: dict[str, object]
+    :param changed_symlink_dirs: Symlink directories with keys: `path`, `project_id`, `sequencing_run_id`, `directory_mtime` and `symlinks` (as found by `core.find_symlinks_in_dir`).
+    :type changed_symlink_dirs: list[dict[str, object]]
+    :param removed_symlink_dirs: Previously-stored symlink directories that no longer exist.
+    :type removed_symlink_dirs: list[dict[str, object]]
+    :return: Number of symlinks stored and deleted, with keys: `num_symlinks_stored`, `num_symlinks_deleted`
+    :rtype: dict[str, int]
+    """
+    num_symlinks_deleted = 0
+    symlinks_to_store = []
+    with session_scope(config) as session:
+        for symlink_dir in changed_symlink_dirs + removed_symlink_dirs:
+            current_path_target_tuples = set([(symlink['path'], symlink['target']) for symlink in symlink_dir.get('symlinks', [])])
+            stored_path_target_tuples = set()
+            for symlink in _get_symlinks_in_directory(session, symlink_dir):
+                path_target_tuple = (symlink.path, symlink.target)
+                stored_path_target_tuples.add(path_target_tuple)
+                if path_target_tuple not in current_path_target_tuples:
+                    session.delete(symlink)
+                    num_symlinks_deleted += 1
+
+            for path, target in sorted(current_path_target_tuples - stored_path_target_tuples):
+                symlinks_to_store.append(_make_symlink_row(symlink_dir['project_id'], symlink_dir['sequencing_run_id'], path, target))
+
+        session.flush()
+        num_symlinks_stored = _insert_symlinks(session, symlinks_to_store)
+        symlink_dir_columns = ['path', 'project_id', 'sequencing_run_id', 'directory_mtime']
+        symlink_dir_rows = [{column: symlink_dir[column] for column in symlink_dir_columns} for symlink_dir in changed_symlink_dirs]
+        _bulk_upsert(session, SymlinkDirectory, symlink_dir_rows, ['path'], symlink_dir_columns[1:])
+        removed_symlink_dir_paths = [symlink_dir['path'] for symlink_dir in removed_symlink_dirs]
+        for paths_chunk in _chunks(removed_symlink_dir_paths, IN_CLAUSE_CHUNK_SIZE):
+            session.query(SymlinkDirectory).filter(SymlinkDirectory.path.in_(paths_chunk)).delete(synchronize_session=False)
+
+        session.commit()
+
+    return {"num_symlinks_stored": num_symlinks_stored, "num_symlinks_deleted": num_symlinks_deleted}
+
+
+def _list_directory(dir_path: str) -> set[str]:
+    """
+    :param dir_path: Path to a directory
+    :type dir_path: str
+    :return: Names of all entries in the directory (empty if the directory doesn't exist)
+    :rtype: set[str]
+    """
+    try:
+        with os.scandir(dir_path) as dir_items:
+            return set([dir_item.name for dir_item in dir_items])
+    except (FileNotFoundError, NotADirectoryError) as e:
+        return set()
+
+
+def _find_nonexistent_symlinks(path_target_tuples: list[tuple[str, str]], num_workers: int) -> tuple[set[tuple[str, str]], int]:
+    """
+    Check a chunk of stored symlinks against listings of the directories that they (and their targets) are in.
+    Stored targets are already resolved (with `os.path.realpath`), so listing the target's directory is
+    equivalent to following the symlink.
+
+    :param path_target_tuples: Stored (path, target) pairs
+    :type path_target_tuples: list[tuple[str, str]]
+    :param num_workers: Number of directories to list concurrently
+    :type num_workers: int
+    :return: (path, target) pairs of symlinks that don't exist (or whose target doesn't exist), and the number of directories listed.
+    :rtype: tuple[set[tuple[str, str]], int]
+    """
+    dir_paths = set()
+    for path, target in path_target_tuples:
+        dir_paths.add(os.path.dirname(path))
+        if target is not None:
+            dir_paths.add(os.path.dirname(target))
+    dir_paths = sorted(dir_paths)
+
+    if num_workers <= 1:
+        dir_listings = dict(zip(dir_paths, map(_list_directory, dir_paths)))
+    else:
+        with concurrent.futures.ThreadPoolExecutor(max_workers=num_workers, thread_name_prefix='list_symlink_dirs') as executor:
+            dir_listings = dict(zip(dir_paths, executor.map(_list_directory, dir_paths)))
+
+    nonexistent_symlinks = set()
+    for path, target in path_target_tuples:
+        path_exists = os.path.basename(path) in dir_listings[os.path.dirname(path)]
+        target_exists = target is None or os.path.basename(target) in dir_listings[os.path.dirname(target)]
+        if not (path_exists and target_exists):
+            nonexistent_symlinks.add((path, target))
+
+    return nonexistent_symlinks, len(dir_paths)
+
+
+def _get_path_target_tuples_chunk(config: dict[str, object], last_path_target_tuple: Optional[tuple[str, str]], chunk_size: int) -> list[tuple[str, str]]:
+    """
+    :param config: Application config.
+    :type config: dict[str, object]
+    :param last_path_target_tuple: The last (path, target) pair of the previous chunk, or None for the first chunk.
+    :type last_path_target_tuple: tuple[str, str] | None
+    :param chunk_size: Maximum number of (path, target) pairs to get.
+    :type chunk_size: int
+    :return: The next chunk of stored (path, target) pairs, in order of path then target.
+    :rtype: list[tuple[str, str]]
+    """
+    with session_scope(config) as session:
+        query = session.query(Symlink.path, Symlink.target).order_by(Symlink.path, Symlink.target)
+        if last_path_target_tuple is not None:
+            last_path, last_target = last_path_target_tuple
+            query = query.filter(or_(
+                Symlink.path > last_path,
+                and_(Symlink.path == last_path, Symlink.target > last_target),
+            ))
+
+        return [(row.path, row.target) for row in query.limit(chunk_size)]
+
+
+def _delete_symlinks(config: dict[str, object], path_target_tuples: Iterable[tuple[str, str]]) -> int:
+    """
+    Delete stored symlinks by primary key, with bulk `DELETE ... WHERE (path, target) IN (...)` statements.
+
+    :param config: Application config.
+    :type config: dict[str, object]
+    :param path_target_tuples: (path, target) pairs of the symlinks to delete
+    :type path_target_tuples: Iterable[tuple[str, str]]
+    :return: Number of symlinks deleted.
+    :rtype: int
+    """
+    num_symlinks_deleted = 0
+    with session_scope(config) as session:
+        for path_target_tuples_chunk in _chunks(sorted(path_target_tuples), IN_CLAUSE_CHUNK_SIZE):
+            # Rows that another process has already deleted aren't counted
+            num_symlinks_deleted += session.query(Symlink).filter(tuple_(Symlink.path, Symlink.target).in_(path_target_tuples_chunk)).delete(synchronize_session=False)
+        session.commit()
+
+    return num_symlinks_deleted
+
+
+def delete_nonexistent_symlinks(config: dict[str, object]) -> dict[str, object]:
+    """
+    Delete stored symlinks that no longer exist, or whose target no longer exists.
+
+    Stored symlinks are read in chunks of `symlink_chunk_size` (in order of path, so that symlinks in the same
+    directory are checked together). Rather than checking each symlink with `os.path.exists`, each directory
+    that contains a symlink or a symlink target is listed once per chunk, and the symlinks are checked against
+    those listings. If `scan_num_workers` is greater than 1 in the config, that many directories are listed
+    concurrently. Nonexistent symlinks are deleted by primary key (see `_delete_symlinks`), so that other
+    stored symlinks with the same path (but a different target) are kept.
+
+    :param config: Application config.
+    :type config: dict[str, object]
+    :return: Counts and timings, with keys: `num_symlinks_checked`, `num_dirs_listed`, `num_symlinks_deleted`, `list_dirs_seconds`, `delete_seconds`
+    :rtype: dict[str, object]
+    """
+    chunk_size = int(config.get('symlink_chunk_size', DEFAULT_SYMLINK_CHUNK_SIZE))
+    num_workers = int(config.get('scan_num_workers', 1))
+    num_symlinks_checked = 0
+    num_dirs_listed = 0
+    num_symlinks_deleted = 0
+    list_dirs_seconds = 0.0
+    delete_seconds = 0.0
+    last_path_target_tuple = None
+    while True:
+        path_target_tuples = _get_path_target_tuples_chunk(config, last_path_target_tuple, chunk_size)
+        if not path_target_tuples:
+            break
+        last_path_target_tuple = path_target_tuples[-1]
+        num_symlinks_checked += len(path_target_tuples)
+
+        list_dirs_start = time.perf_counter()
+        nonexistent_symlinks, num_chunk_dirs_listed = _find_nonexistent_symlinks(path_target_tuples, num_workers)
+        list_dirs_seconds += time.perf_counter() - list_dirs_start
+        num_dirs_listed += num_chunk_dirs_listed
+
+        delete_start = time.perf_counter()
+        num_symlinks_deleted += _delete_symlinks(config, nonexistent_symlinks)
+        delete_seconds += time.perf_counter() - delete_start
+
+    return {
+        "num_symlinks_checked": num_symlinks_checked,
+        "num_dirs_listed": num_dirs_listed,
+        "num_symlinks_deleted": num_symlinks_deleted,
+        "list_dirs_seconds": round(list_dirs_seconds, 3),
+        "delete_seconds": round(delete_seconds, 3),
+    }
+
+
+def get_symlinks(config: dict[str, object]) -> list[dict[str, object]]:
+    """
+    """
+    with session_scope(config) as session:
+        query_result = session.query(Symlink).all()
+
+        existing_symlinks = []
+        for row in query_result:
+            existing_symlinks.append(util.row2dict(row))
+
+        return existing_symlinks
 
 
 def get_symlinks_by_run_id(config, run_id):
     """
     """
-    connection_uri = config['database_connection_uri']
-    engine = create_engine(connection_uri)
-    Session = sessionmaker(bind=engine)
-    session = Session()
+    with session_scope(config) as session:
+        query_result = session.query(Symlink).filter(Symlink.sequencing_run_id == run_id)
 
-    query_result = session.query(Symlink).filter(Symlink.sequencing_run_id == run_id)
+        existing_symlinks_for_run = []
+        for row in query_result:
+            existing_symlinks_for_run.append(util.row2dict(row))
 
-    existing_symlinks_for_run = []
-    for row in query_result:
-        existing_symlinks_for_run.append(util.row2dict(row))
-        
+        return existing_symlinks_for_run
 
-    return existing_symlinks_for_run
 
+def get_symlinks_by_project_id(config: dict[str, object], project_id: str) -> list[dict[str, object]]:
+    """
+    :param config: Application config.
+    :type config: dict[str, object]
+    :param project_id: Project ID
+    :type project_id: str
+    :return: The project's stored symlinks.
+    :rtype: list[dict[str, object]]
+    """
+    with session_scope(config) as session:
+        query_result = session.query(Symlink).filter(Symlink.project_id == project_id)
 
-def get_libraries(config):
+        project_symlinks = []
+        for row in query_result:
+            project_symlinks.append(util.row2dict(row))
+
+        return project_symlinks
+
+
+def iter_symlinks_by_project_id(config: dict[str, object], project_id: str) -> Iterator[dict[str, object]]:
+    """
+    Read a project's stored symlinks in chunks of `symlink_chunk_size`, so that they don't all need to be held in memory at once.
+
+    The symlinks are ordered by run ID, then library ID, then path, so that the symlinks for each
+    run and library are read one after the other. Each chunk is a separate (keyset-paginated) query.
+
+    :param config: Application config.
+    :type config: dict[str, object]
+    :param project_id: Project ID
+    :type project_id: str
+    :return: The project's stored symlinks.
+    :rtype: Iterator[dict[str, object]]
     """
+    chunk_size = int(config.get('symlink_chunk_size', DEFAULT_SYMLINK_CHUNK_SIZE))
+    # Symlinks created by an audit may not have a library ID.
+    order_columns = [Symlink.sequencing_run_id, func.coalesce(Symlink.library_id, ''), Symlink.path, Symlink.target]
+    last_row_values = None
+    while True:
+        with session_scope(config) as session:
+            query = session.query(Symlink, *order_columns).filter(Symlink.project_id == project_id).order_by(*order_columns)
+            if last_row_values is not None:
+                # (run ID, library ID, path, target) > the last row's values
+                after_conditions = []
+                for idx, (order_column, last_value) in enumerate(zip(order_columns, last_row_values)):
+                    equal_conditions = [column == value for column, value in zip(order_columns[:idx], last_row_values[:idx])]
+                    after_conditions.append(and_(*equal_conditions, order_column > last_value))
+                query = query.filter(or_(*after_conditions))
+            rows = query.limit(chunk_size).all()
+            symlinks = [util.row2dict(row[0]) for row in rows]
+        if not rows:
+            break
+        last_row_values = tuple(rows[-1][1:])
+        yield from symlinks
+
+
+def get_symlinks_by_run_ids(config: dict[str, object], run_ids: list[str]) -> dict[str, list[dict[str, object]]]:
+    """
+    Get the existing symlinks for several runs at once.
+
+    :param config: Application config.
+    :type config: dict[str, object]
+    :param run_ids: Sequencing run IDs
+    :type run_ids: list[str]
+    :return: Symlinks, indexed by sequencing run ID. Every run in `run_ids` is included, even if it has no symlinks.
+    :rtype: dict[str, list[dict[str, object]]]
+    """
+    symlinks_by_run_id = {run_id: [] for run_id in run_ids}
+    with session_scope(config) as session:
+        for run_ids_chunk in _chunks(list(symlinks_by_run_id), IN_CLAUSE_CHUNK_SIZE):
+            query_result = session.query(Symlink).filter(Symlink.sequencing_run_id.in_(run_ids_chunk))
+            for row in query_result:
+                symlinks_by_run_id[row.sequencing_run_id].append(util.row2dict(row))
+
+    return symlinks_by_run_id
+
+
+def get_run_fingerprints(config: dict[str, object], run_ids: Optional[list[str]] = None) -> dict[str, dict[str, object]]:
+    """
+    Get the stored fingerprint of every run, along with the run info that was stored
+    when the fingerprint was taken.
+
+    :param config: Application config.
+    :type config: dict[str, object]
+    :param run_ids: Only get the fingerprints for these runs. If None, get the fingerprints for all runs.
+    :type run_ids: list[str] | None
+    :return: Run info and fingerprint, indexed by sequencing run ID.
+    :rtype: dict[str, dict[str, object]]
     """
-    connection_uri = config['database_connection_uri']
-    engine = create_engine(connection_uri)
-    Session = sessionmaker(bind=engine)
-    session = Session()
+    with session_scope(config) as session:
+        query_result = session.query(SequencingRun, SequencingRunFingerprint).join(
+            SequencingRunFingerprint,
+            SequencingRun.sequencing_run_id == SequencingRunFingerprint.sequencing_run_id,
+        )
+        if run_ids is not None:
+            query_result = query_result.filter(SequencingRun.sequencing_run_id.in_(run_ids))
+
+        fingerprints_by_run_id = {}
+        for run_row, fingerprint_row in query_result:
+            run = util.row2dict(run_row)
+            run['fingerprint'] = util.row2dict(fingerprint_row)
+            fingerprints_by_run_id[run_row.sequencing_run_id] = run
+
+        return fingerprints_by_run_id
 
-    query_result = session.query(Library).all()
 
-    all_libraries = []
-    for row in query_result:
-        all_libraries.append(util.row2dict(row))
+def get_libraries(config):
+    """
+    """
+    with session_scope(config) as session:
+        query_result = session.query(Library).all()
+
+        all_libraries = []
+        for row in query_result:
+            all_libraries.append(util.row2dict(row))
 
-    return all_libraries
+        return all_libraries
 
 
 def get_libraries_by_project_id(config, project_id):
     """
     """
-    connection_uri = config['database_connection_uri']
-    engine = create_engine(connection_uri)
-    Session = sessionmaker(bind=engine)
-    session = Session()
+    with session_scope(config) as session:
+        query_result = session.query(Library).filter(Library.project_id == project_id)
 
-    query_result = session.query(Library).filter(Library.project_id == project_id)
+        project_libraries = []
+        for row in query_result:
+            project_libraries.append(util.row2dict(row))
 
-    project_libraries = []
-    for row in query_result:
-        project_libraries.append(util.row2dict(row))
+        return project_libraries
 
-    return project_libraries
+
+def get_libraries_by_run_ids(config: dict[str, object], run_ids: list[str]) -> dict[str, list[dict[str, object]]]:
+    """
+    Get the libraries for several runs at once, for all projects.
+
+    :param config: Application config.
+    :type config: dict[str, object]
+    :param run_ids: Sequencing run IDs
+    :type run_ids: list[str]
+    :return: Libraries, indexed by sequencing run ID. Every run in `run_ids` is included, even if it has no libraries.
+    :rtype: dict[str, list[dict[str, object]]]
+    """
+    libraries_by_run_id = {run_id: [] for run_id in run_ids}
+    with session_scope(config) as session:
+        for run_ids_chunk in _chunks(list(libraries_by_run_id), IN_CLAUSE_CHUNK_SIZE):
+            query_result = session.query(Library).filter(Library.sequencing_run_id.in_(run_ids_chunk))
+            for row in query_result:
+                libraries_by_run_id[row.sequencing_run_id].append(util.row2dict(row))
+
+    return libraries_by_run_id
 
 
 def get_libraries_by_project_id_and_run_id(config, project_id, run_id):
     """
     """
-    connection_uri = config['database_connection_uri']
-    engine = create_engine(connection_uri)
-    Session = sessionmaker(bind=engine)
-    session = Session()
+    with session_scope(config) as session:
+        query_result = session.query(Library).filter(
+            Library.project_id == project_id,
+            Library.sequencing_run_id == run_id,
+        )
 
-    query_result = session.query(Library).filter(
-        Library.project_id == project_id,
-        Library.sequencing_run_id == run_id,
-    )
+        project_libraries = []
+        for row in query_result:
+            project_libraries.append(util.row2dict(row))
+
+        return project_libraries
+
+
+def _get_query_conditions(model, filters: dict[str, object], since: Optional[datetime.datetime] = None) -> list:
+    """
+    :return: Conditions that select the rows of `model` whose columns equal `filters`, and that were updated at or after `since`.
+    :rtype: list[sqlalchemy.sql.ColumnElement]
+    """
+    table = model.__table__
+    conditions = [table.c[column] == value for column, value in filters.items()]
+    if since is not None:
+        conditions.append(table.c['timestamp_updated'] >= since)
 
-    project_libraries = []
-    for row in query_result:
-        project_libraries.append(util.row2dict(row))
+    return conditions
 
-    return project_libraries
 
-    
-    
+def get_page(config: dict[str, object], model, filters: dict[str, object], order_columns: list[str], after: Optional[list[object]] = None, limit: int = 100, since: Optional[datetime.datetime] = None) -> list[dict[str, object]]:
+    """
+    Get one page of rows, in order of `order_columns`. Each page starts just after the last row of the previous
+    page (keyset pagination) rather than at an offset, so a page costs the same to fetch wherever it is in the
+    results, as long as there is an index on the `filters` columns followed by the `order_columns`.
+
+    :param config: Application config.
+    :type config: dict[str, object]
+    :param model: The model class for the table (eg. `Library`)
+    :type model: type
+    :param filters: Values that the rows' columns must equal, indexed by column name.
+    :type filters: dict[str, object]
+    :param order_columns: Columns to order the rows by. Should uniquely identify a row, among the rows that match the `filters`.
+    :type order_columns: list[str]
+    :param after: Values of the `order_columns` for the last row of the previous page. If None, get the first page.
+    :type after: list[object] | None
+    :param limit: Maximum number of rows to get.
+    :type limit: int
+    :param since: Only get rows that were updated at or after this time.
+    :type since: datetime.datetime | None
+    :return: Rows
+    :rtype: list[dict[str, object]]
+    """
+    table = model.__table__
+    conditions = _get_query_conditions(model, filters, since)
+    order_by = [table.c[column] for column in order_columns]
+    if after is not None:
+        conditions.append(tuple_(*order_by) > tuple_(*after))
+
+    with session_scope(config) as session:
+        query_result = session.query(model).filter(*conditions).order_by(*order_by).limit(limit)
+        rows = [util.row2dict(row) for row in query_result]
+
+    return rows
+
+
+def get_version(config: dict[str, object], model, filters: dict[str, object], since: Optional[datetime.datetime] = None) -> dict[str, object]:
+    """
+    Get the number of rows that match the `filters` and the time that the most recently-updated one was updated.
+    Rows are added, updated or deleted whenever these change, so they can be used to tell whether results
+    that were fetched earlier are still current, without fetching the rows again.
+
+    :param config: Application config.
+    :type config: dict[str, object]
+    :param model: The model class for the table (eg. `Library`)
+    :type model: type
+    :param filters: Values that the rows' columns must equal, indexed by column name.
+    :type filters: dict[str, object]
+    :param since: Only count rows that were updated at or after this time.
+    :type since: datetime.datetime | None
+    :return: Version, with keys: `num_rows`, `max_timestamp_updated`
+    :rtype: dict[str, object]
+    """
+    conditions = _get_query_conditions(model, filters, since)
+    with session_scope(config) as session:
+        num_rows, max_timestamp_updated = session.query(func.count(), func.max(model.__table__.c['timestamp_updated'])).filter(*conditions).one()
+
+    return {"num_rows": num_rows, "max_timestamp_updated": max_timestamp_updated}
+
+
+def _utcnow() -> datetime.datetime:
+    """
+    Leases are compared across hosts, so they use UTC (without a timezone, like the other timestamps).
+    """
+    return datetime.datetime.now(datetime.timezone.utc).replace(tzinfo=None)
+
+
+def heartbeat_scan_worker(config: dict[str, object], worker_id: str, hostname: str, lease_seconds: float):
+    """
+    Record that a scan worker is alive, and extend all of the leases that it holds.
+
+    :param config: Application config.
+    :type config: dict[str, object]
+    :param worker_id: Scan worker ID
+    :type worker_id: str
+    :param hostname: Host that the worker is running on
+    :type hostname: str
+    :param lease_seconds: How long the worker's leases are extended for.
+    :type lease_seconds: float
+    :return: None
+    :rtype: NoneType
+    """
+    now = _utcnow()
+    with session_scope(config) as session:
+        _bulk_upsert(session, ScanWorker, [{"worker_id": worker_id, "hostname": hostname, "heartbeat_at": now}], ['worker_id'], ['hostname', 'heartbeat_at'])
+        session.query(ScanLease).filter(ScanLease.worker_id == worker_id).update(
+            {"lease_expires_at": now + datetime.timedelta(seconds=lease_seconds)},
+            synchronize_session=False,
+        )
+        session.commit()
+
+
+def get_live_scan_worker_ids(config: dict[str, object], lease_seconds: float) -> list[str]:
+    """
+    :param config: Application config.
+    :type config: dict[str, object]
+    :param lease_seconds: Workers that haven't sent a heartbeat for this long are considered dead.
+    :type lease_seconds: float
+    :return: IDs of the scan workers that have sent a heartbeat recently, sorted.
+    :rtype: list[str]
+    """
+    heartbeat_cutoff = _utcnow() - datetime.timedelta(seconds=lease_seconds)
+    with session_scope(config) as session:
+        query_result = session.query(ScanWorker.worker_id).filter(ScanWorker.heartbeat_at >= heartbeat_cutoff).order_by(ScanWorker.worker_id)
+        live_worker_ids = [row.worker_id for row in query_result]
+
+    return live_worker_ids
+
+
+def claim_scan_leases(config: dict[str, object], lease_keys: list[str], worker_id: str, lease_seconds: float, preferred_lease_keys: set[str]) -> set[str]:
+    """
+    Try to claim (or renew) a lease on each of the `lease_keys`, in a single transaction. A lease is claimed if:
+
+    - It is already held by this worker (it is renewed).
+    - It has expired (its previous holder has stopped sending heartbeats, or it was on offer for a whole lease period without being claimed).
+    - Nobody holds it, and this is its preferred worker (its key is in `preferred_lease_keys`).
+
+    A lease that nobody holds, and that isn't preferred by this worker, is put on offer: it is stored without
+    a worker, so that its preferred worker can claim it. If the preferred worker doesn't claim it before it expires
+    (eg. because that worker can't see the run), any worker can. Each lease is claimed with a single conditional
+    `INSERT` or `UPDATE`, so that two workers can never both claim the same lease.
+
+    :param config: Application config.
+    :type config: dict[str, object]
+    :param lease_keys: Keys of the leases to claim (eg. run IDs)
+    :type lease_keys: list[str]
+    :param worker_id: Scan worker ID
+    :type worker_id: str
+    :param lease_seconds: How long a lease lasts, unless it is extended by a heartbeat (see `heartbeat_scan_worker`).
+    :type lease_seconds: float
+    :param preferred_lease_keys: Keys of the leases for which this is the preferred worker.
+    :type preferred_lease_keys: set[str]
+    :return: Keys of the leases that this worker now holds.
+    :rtype: set[str]
+    :raises ValueError: If the database isn't SQLite or PostgreSQL.
+    """
+    now = _utcnow()
+    lease_expires_at = now + datetime.timedelta(seconds=lease_seconds)
+    table = ScanLease.__table__
+    claimed_lease_keys = set()
+    with session_scope(config) as session:
+        insert = _get_dialect_insert(session)
+        if insert is None:
+            raise ValueError("Scan leases require SQLite or PostgreSQL")
+        stored_lease_keys = set()
+        for lease_keys_chunk in _chunks(lease_keys, IN_CLAUSE_CHUNK_SIZE):
+            stored_lease_keys.update([row.lease_key for row in session.query(ScanLease.lease_key).filter(ScanLease.lease_key.in_(lease_keys_chunk))])
+
+        # Always in the same order, so that concurrent claims on PostgreSQL lock rows in the same order.
+        for lease_key in sorted(set(lease_keys)):
+            preferred = lease_key in preferred_lease_keys
+            if lease_key not in stored_lease_keys:
+                lease_row = {
+                    "lease_key": lease_key,
+                    "worker_id": worker_id if preferred else None,
+                    "lease_expires_at": lease_expires_at,
+                    "timestamp_updated": now,
+                }
+                result = session.execute(insert(table).values(**lease_row).on_conflict_do_nothing(index_elements=['lease_key']))
+                if result.rowcount == 1:
+                    if preferred:
+                        claimed_lease_keys.add(lease_key)
+                    continue
+                # Another worker stored the lease since it was queried above, so it's claimed in the same way as a stored lease.
+
+            claimable = [table.c.worker_id == worker_id, table.c.lease_expires_at < now]
+            if preferred:
+                claimable.append(table.c.worker_id.is_(None))
+            result = session.execute(
+                table.update().where(table.c.lease_key == lease_key, or_(*claimable)).values(worker_id=worker_id, lease_expires_at=lease_expires_at, timestamp_updated=now)
+            )
+            if result.rowcount == 1:
+                claimed_lease_keys.add(lease_key)
+
+        session.commit()
+
+    return claimed_lease_keys
+
+
+def release_scan_leases(config: dict[str, object], worker_id: str):
+    """
+    Give up all of a worker's leases, so that other workers can claim them straight away
+    (rather than waiting for them to expire), and remove the worker from the live workers.
+
+    :param config: Application config.
+    :type config: dict[str, object]
+    :param worker_id: Scan worker ID
+    :type worker_id: str
+    :return: None
+    :rtype: NoneType
+    """
+    now = _utcnow()
+    with session_scope(config) as session:
+        session.query(ScanLease).filter(ScanLease.worker_id == worker_id).update(
+            {"worker_id": None, "lease_expires_at": now, "timestamp_updated": now},
+            synchronize_session=False,
+        )
+        session.query(ScanWorker).filter(ScanWorker.worker_id == worker_id).delete(synchronize_session=False)
+        session.commit()
@@ -0,0 +1,441 @@
+import contextlib
+import datetime
+import fcntl
+import filecmp
+import itertools
+import json
+import logging
+import os
+import re
+import threading
+from typing import Callable, Iterable, Iterator, Optional
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError as e:
+    pyarrow = None
+
+import auto_fastq_symlink.db as db
+
+# Both files are written to the top level of each project's `fastq_symlinks_dir`,
+# alongside (not inside) the per-run symlink directories.
+MANIFEST_FILENAME = "manifest.jsonl"
+MANIFEST_SNAPSHOT_FILENAMES = {
+    "parquet": "manifest.parquet",
+}
+
+MANIFEST_COLUMNS = [
+    'sequencing_run_id',
+    'library_id',
+    'symlink_path_r1',
+    'target_r1',
+    'symlink_path_r2',
+    'target_r2',
+    'timestamp_added',
+]
+
+FASTQ_READ_TYPE_REGEX = re.compile("_(?P<read_type>R[12])_\\d{3}")
+
+# The manifest locks that this process holds (see `_acquire_manifest_lock`), indexed by manifest path.
+_manifest_locks = {}
+_manifest_locks_lock = threading.Lock()
+
+
+def _forget_manifest_locks():
+    """
+    POSIX locks aren't inherited by child processes, so a forked child starts out without any manifest locks.
+    """
+    global _manifest_locks, _manifest_locks_lock
+    _manifest_locks = {}
+    _manifest_locks_lock = threading.Lock()
+
+
+os.register_at_fork(after_in_child=_forget_manifest_locks)
+
+
+def get_manifest_path(config: dict[str, object], project_id: str) -> str:
+    """
+    :param config: Application config.
+    :type config: dict[str, object]
+    :param project_id: Project ID
+    :type project_id: str
+    :return: Path to the project's manifest file.
+    :rtype: str
+    """
+    return os.path.join(config['projects'][project_id]['fastq_symlinks_dir'], MANIFEST_FILENAME)
+
+
+def _acquire_manifest_lock(manifest_path: str):
+    """
+    Take an exclusive lock on a manifest, so that other processes can't append to it or compact it until
+    it's released (with `_release_manifest_lock`). The lock is taken (with `fcntl.lockf`) on a separate lock
+    file alongside the manifest, because the manifest itself is replaced when it's compacted.
+
+    POSIX locks are held by the process, and closing any file descriptor for the lock file releases them,
+    so the lock is shared (and counted) between the threads and tasks of this process, and the lock file is
+    only closed once all of them have released it. It doesn't keep them apart from each other.
+
+    :param manifest_path: Path to the manifest file
+    :type manifest_path: str
+    :return: None
+    :rtype: NoneType
+    """
+    with _manifest_locks_lock:
+        manifest_lock = _manifest_locks.setdefault(manifest_path, {"lock": threading.Lock(), "lock_file": None, "num_holders": 0})
+    # Only one thread at a time waits for (or gives up) the lock on the same manifest.
+    with manifest_lock['lock']:
+        if manifest_lock['num_holders'] == 0:
+            lock_path = os.path.join(os.path.dirname(manifest_path), '.' + os.path.basename(manifest_path) + '.lock')
+            lock_file = open(lock_path, 'a')
+            try:
+                fcntl.lockf(lock_file, fcntl.LOCK_EX)
+            except BaseException:
+                lock_file.close()
+                raise
+            manifest_lock['lock_file'] = lock_file
+        manifest_lock['num_holders'] += 1
+
+
+def _release_manifest_lock(manifest_path: str):
+    """
+    Release a lock taken with `_acquire_manifest_lock`.
+
+    :param manifest_path: Path to the manifest file
+    :type manifest_path: str
+    :return: None
+    :rtype: NoneType
+    """
+    manifest_lock = _manifest_locks[manifest_path]
+    with manifest_lock['lock']:
+        manifest_lock['num_holders'] -= 1
+        if manifest_lock['num_holders'] == 0:
+            fcntl.lockf(manifest_lock['lock_file'], fcntl.LOCK_UN)
+            manifest_lock['lock_file'].close()
+            manifest_lock['lock_file'] = None
+
+
+@contextlib.contextmanager
+def _lock_manifest(manifest_path: str) -> Iterator[None]:
+    """
+    Hold the lock on a manifest (see `_acquire_manifest_lock`) for the duration of the `with` block.
+
+    :param manifest_path: Path to the manifest file
+    :type manifest_path: str
+    """
+    _acquire_manifest_lock(manifest_path)
+    try:
+        yield
+    finally:
+        _release_manifest_lock(manifest_path)
+
+
+def lock_manifests(config: dict[str, object], project_ids: Iterable[str]):
+    """
+    Lock the manifests of several projects (see `_acquire_manifest_lock`). The locks are always taken
+    in the same order, so that two processes locking overlapping sets of manifests can't deadlock.
+
+    :param config: Application config.
+    :type config: dict[str, object]
+    :param project_ids: IDs of the projects whose manifests should be locked. Each project's `fastq_symlinks_dir` must exist.
+    :type project_ids: Iterable[str]
+    :return: None
+    :rtype: NoneType
+    """
+    manifest_paths = sorted(set([get_manifest_path(config, project_id) for project_id in project_ids]))
+    num_locked = 0
+    try:
+        for manifest_path in manifest_paths:
+            _acquire_manifest_lock(manifest_path)
+            num_locked += 1
+    except BaseException:
+        for manifest_path in manifest_paths[:num_locked]:
+            _release_manifest_lock(manifest_path)
+        raise
+
+
+def unlock_manifests(config: dict[str, object], project_ids: Iterable[str]):
+    """
+    Release the locks taken with `lock_manifests`.
+
+    :param config: Application config.
+    :type config: dict[str, object]
+    :param project_ids: The same project IDs that were passed to `lock_manifests`.
+    :type project_ids: Iterable[str]
+    :return: None
+    :rtype: NoneType
+    """
+    for manifest_path in sorted(set([get_manifest_path(config, project_id) for project_id in project_ids])):
+        _release_manifest_lock(manifest_path)
+
+
+def _get_snapshot_format(config: dict[str, object]) -> Optional[str]:
+    """
+    :param config: Application config.
+    :type config: dict[str, object]
+    :return: The format of the columnar snapshot to write alongside each manifest, or None if snapshots aren't written.
+    :rtype: str | None
+    :raises ValueError: If the format isn't supported.
+    """
+    snapshot_format = config.get('manifest_snapshot_format', None)
+    if snapshot_format is not None and snapshot_format not in MANIFEST_SNAPSHOT_FILENAMES:
+        raise ValueError("Unsupported manifest_snapshot_format: " + str(snapshot_format) + ". Supported formats: " + ", ".join(sorted(MANIFEST_SNAPSHOT_FILENAMES)))
+
+    return snapshot_format
+
+
+def _make_manifest_row(symlinks: list[dict[str, object]], timestamp_added: Optional[str]) -> dict[str, object]:
+    """
+    Combine the symlinks for one run and library into a row, with the R1 and R2 symlinks side-by-side.
+    The read type is taken from the target's filename (eg. `..._R1_001.fastq.gz`). If it can't be
+    found there, the symlink fills the R1 columns if they're still empty, otherwise the R2 columns.
+
+    :param symlinks: Symlinks for the same run and library, sorted by path, with keys: `sequencing_run_id`, `library_id`, `path`, `target`
+    :type symlinks: list[dict[str, object]]
+    :param timestamp_added: The row's `timestamp_added`.
+    :type timestamp_added: str | None
+    :return: Manifest row
+    :rtype: dict[str, object]
+    """
+    row = {column: None for column in MANIFEST_COLUMNS}
+    row.update({
+        "sequencing_run_id": symlinks[0]['sequencing_run_id'],
+        "library_id": symlinks[0]['library_id'],
+        "timestamp_added": timestamp_added,
+    })
+    for symlink in symlinks:
+        read_type_match = FASTQ_READ_TYPE_REGEX.search(os.path.basename(symlink['target']))
+        if read_type_match is not None:
+            read_type = read_type_match.group('read_type')
+        elif row['symlink_path_r1'] is None:
+            read_type = 'R1'
+        else:
+            read_type = 'R2'
+        row['symlink_path_' + read_type.lower()] = symlink['path']
+        row['target_' + read_type.lower()] = symlink['target']
+
+    return row
+
+
+def _make_manifest_rows(symlinks: list[dict[str, object]], get_timestamp_added: Callable[[tuple[str, str], dict[str, object]], Optional[str]]) -> list[dict[str, object]]:
+    """
+    Combine symlinks into one row per run and library (see `_make_manifest_row`).
+
+    :param symlinks: Symlinks, with keys: `sequencing_run_id`, `library_id`, `path`, `target`
+    :type symlinks: list[dict[str, object]]
+    :param get_timestamp_added: Called with the (run ID, library ID) key and the first symlink for each row, returns the row's `timestamp_added`.
+    :type get_timestamp_added: Callable[[tuple[str, str], dict[str, object]], str | None]
+    :return: Manifest rows, sorted by run ID then library ID.
+    :rtype: list[dict[str, object]]
+    """
+    symlinks_by_key = {}
+    for symlink in sorted(symlinks, key=lambda symlink: symlink['path']):
+        symlinks_by_key.setdefault((symlink['sequencing_run_id'], symlink['library_id']), []).append(symlink)
+
+    return [_make_manifest_row(symlinks_by_key[key], get_timestamp_added(key, symlinks_by_key[key][0])) for key in sorted(symlinks_by_key)]
+
+
+def _iter_manifest(manifest_path: str) -> Iterator[dict[str, object]]:
+    """
+    Read a manifest file one row at a time. Lines that can't be parsed (eg. a partially-written last line) are skipped.
+
+    :param manifest_path: Path to the manifest file
+    :type manifest_path: str
+    :return: Manifest rows, in the order that they appear in the file. Empty if the file doesn't exist.
+    :rtype: Iterator[dict[str, object]]
+    """
+    if not os.path.exists(manifest_path):
+        return
+
+    with open(manifest_path, 'r') as f:
+        for line_num, line in enumerate(f, start=1):
+            try:
+                yield json.loads(line)
+            except json.JSONDecodeError as e:
+                logging.warning(json.dumps({"event_type": "manifest_line_skipped", "manifest_path": manifest_path, "line_num": line_num, "error": str(e)}))
+
+
+def read_manifest(manifest_path: str) -> list[dict[str, object]]:
+    """
+    Read a manifest file. Lines that can't be parsed (eg. a partially-written last line) are skipped.
+
+    :param manifest_path: Path to the manifest file
+    :type manifest_path: str
+    :return: Manifest rows, in the order that they appear in the file. Empty if the file doesn't exist.
+    :rtype: list[dict[str, object]]
+    """
+    return list(_iter_manifest(manifest_path))
+
+
+def append_to_manifest(config: dict[str, object], project_id: str, symlinks: list[dict[str, object]]) -> int:
+    """
+    Add rows for newly-created symlinks to the end of a project's manifest. Existing rows aren't read or re-written.
+    The manifest should be locked (see `lock_manifests`) from before the symlinks are stored, otherwise a
+    compaction in between could add rows for them as well.
+
+    :param config: Application config.
+    :type config: dict[str, object]
+    :param project_id: Project ID
+    :type project_id: str
+    :param symlinks: Symlinks that were created for the project, as they were stored (see `core.register_created_symlinks`), with keys: `sequencing_run_id`, `library_id`, `path`, `target`
+    :type symlinks: list[dict[str, object]]
+    :return: Number of rows added.
+    :rtype: int
+    """
+    if not symlinks:
+        return 0
+
+    timestamp_added = datetime.datetime.now().isoformat()
+    rows = _make_manifest_rows(symlinks, lambda key, symlink: timestamp_added)
+    manifest_path = get_manifest_path(config, project_id)
+    # A single write, so that a reader sees at most one partially-written line.
+    with _lock_manifest(manifest_path), open(manifest_path, 'a') as f:
+        f.write("".join([json.dumps(row) + '\n' for row in rows]))
+
+    return len(rows)
+
+
+def _write_manifest(manifest_path: str, rows: Iterable[dict[str, object]]) -> Optional[int]:
+    """
+    Replace a manifest file, unless its contents wouldn't change. The rows are written to a temporary
+    file as they're produced, then the temporary file is renamed, so the manifest is never seen partially-written.
+
+    :param manifest_path: Path to the manifest file
+    :type manifest_path: str
+    :param rows: Manifest rows
+    :type rows: Iterable[dict[str, object]]
+    :return: Number of rows written, or None if the manifest was left as it was.
+    :rtype: int | None
+    """
+    tmp_manifest_path = os.path.join(os.path.dirname(manifest_path), '.' + os.path.basename(manifest_path) + '.tmp')
+    num_rows = 0
+    with open(tmp_manifest_path, 'w') as f:
+        for row in rows:
+            f.write(json.dumps(row) + '\n')
+            num_rows += 1
+    if os.path.exists(manifest_path) and filecmp.cmp(tmp_manifest_path, manifest_path, shallow=False):
+        os.remove(tmp_manifest_path)
+        return None
+    os.replace(tmp_manifest_path, manifest_path)
+
+    return num_rows
+
+
+def _write_parquet_snapshot(snapshot_path: str, manifest_path: str, batch_size: int):
+    """
+    Replace a parquet snapshot of a manifest, by writing to a temporary file then renaming it.
+    The manifest is read (and written to the snapshot) `batch_size` rows at a time.
+    """
+    schema = pyarrow.schema([(column, pyarrow.string()) for column in MANIFEST_COLUMNS])
+    tmp_snapshot_path = os.path.join(os.path.dirname(snapshot_path), '.' + os.path.basename(snapshot_path) + '.tmp')
+    with pyarrow.parquet.ParquetWriter(tmp_snapshot_path, schema) as writer:
+        rows = _iter_manifest(manifest_path)
+        while True:
+            batch = list(itertools.islice(rows, batch_size))
+            if not batch:
+                break
+            writer.write_table(pyarrow.Table.from_pylist(batch, schema=schema))
+    os.replace(tmp_snapshot_path, snapshot_path)
+
+
+def compact_manifest(config: dict[str, object], project_id: str) -> dict[str, object]:
+    """
+    Re-write a project's manifest from the symlinks that are stored for the project, so that
+    it has exactly one row for each run and library, sorted by run ID then library ID. Rows
+    for symlinks that no longer exist are dropped, and symlinks that were created by something
+    else (and found by an audit) are added. Rows keep the `timestamp_added` of the first row for
+    the same run and library. The manifest is only re-written if its contents would change, and
+    is replaced atomically.
+
+    The stored symlinks are read in chunks of `symlink_chunk_size` (see `db.iter_symlinks_by_project_id`),
+    and each row is written to a temporary file as soon as it's complete, so neither the symlinks nor the
+    rows are all held in memory. Only the `timestamp_added` of each existing row is kept.
+
+    The manifest is locked (see `_acquire_manifest_lock`) from when it's read until it's replaced, so that rows
+    appended by other processes in the meantime aren't lost. Symlinks are stored and appended under the same
+    lock (see `core.symlink_run`), so a compaction either includes both the stored symlinks and their appended
+    rows, or neither. Manifests are only compacted by the worker that holds the symlink audit lease (see
+    `core._begin_scan`), so two workers never compact the same manifest.
+
+    If `manifest_snapshot_format` is set in the config, a columnar snapshot of the manifest is written as well,
+    whenever the manifest is re-written (or if the snapshot is missing, or older than the manifest).
+
+    :param config: Application config.
+    :type config: dict[str, object]
+    :param project_id: Project ID
+    :type project_id: str
+    :return: Counts, with keys: `num_rows_before`, `num_rows`, `manifest_rewritten`, `snapshot_written`
+    :rtype: dict[str, object]
+    """
+    snapshot_format = _get_snapshot_format(config)
+    manifest_path = get_manifest_path(config, project_id)
+
+    def get_timestamp_added(key, symlink):
+        if key in timestamp_added_by_key:
+            return timestamp_added_by_key[key]
+        if symlink['timestamp_updated'] is not None:
+            return symlink['timestamp_updated'].isoformat()
+        return None
+
+    def make_rows(symlinks_by_key):
+        for key, symlinks in symlinks_by_key:
+            symlinks = list(symlinks)
+            yield _make_manifest_row(symlinks, get_timestamp_added(key, symlinks[0]))
+
+    if not os.path.exists(manifest_path) and next(db.iter_symlinks_by_project_id(config, project_id), None) is None:
+        return {"num_rows_before": 0, "num_rows": 0, "manifest_rewritten": False, "snapshot_written": False}
+
+    os.makedirs(os.path.dirname(manifest_path), exist_ok=True)
+    with _lock_manifest(manifest_path):
+        num_rows_before = 0
+        timestamp_added_by_key = {}
+        for row in _iter_manifest(manifest_path):
+            timestamp_added_by_key.setdefault((row['sequencing_run_id'], row['library_id']), row['timestamp_added'])
+            num_rows_before += 1
+        symlinks_by_key = itertools.groupby(db.iter_symlinks_by_project_id(config, project_id), key=lambda symlink: (symlink['sequencing_run_id'], symlink['library_id']))
+        num_rows_written = _write_manifest(manifest_path, make_rows(symlinks_by_key))
+    manifest_rewritten = num_rows_written is not None
+    num_rows = num_rows_written if manifest_rewritten else num_rows_before
+
+    snapshot_written = False
+    if snapshot_format is not None and os.path.exists(manifest_path):
+        snapshot_path = os.path.join(os.path.dirname(manifest_path), MANIFEST_SNAPSHOT_FILENAMES[snapshot_format])
+        snapshot_outdated = manifest_rewritten or not os.path.exists(snapshot_path) or os.path.getmtime(snapshot_path) < os.path.getmtime(manifest_path)
+        if snapshot_outdated and pyarrow is None:
+            logging.warning(json.dumps({"event_type": "manifest_snapshot_unavailable", "project_id": project_id, "message": "pyarrow is not installed. Skipping manifest snapshot."}))
+        elif snapshot_outdated:
+            _write_parquet_snapshot(snapshot_path, manifest_path, int(config.get('symlink_chunk_size', db.DEFAULT_SYMLINK_CHUNK_SIZE)))
+            snapshot_written = True
+
+    return {
+        "num_rows_before": num_rows_before,
+        "num_rows": num_rows,
+        "manifest_rewritten": manifest_rewritten,
+        "snapshot_written": snapshot_written,
+    }
+
+
+def compact_manifests(config: dict[str, object]) -> dict[str, int]:
+    """
+    Compact the manifest for each project in the config (see `compact_manifest`). If `scan_leases` is
+    enabled, this should only be called by the worker that holds the symlink audit lease.
+
+    :param config: Application config.
+    :type config: dict[str, object]
+    :return: Counts, with keys: `num_manifests_checked`, `num_manifests_rewritten`, `num_snapshots_written`
+    :rtype: dict[str, int]
+    """
+    num_manifests_rewritten = 0
+    num_snapshots_written = 0
+    for project_id in config['projects']:
+        compaction_counts = compact_manifest(config, project_id)
+        if compaction_counts['manifest_rewritten']:
+            num_manifests_rewritten += 1
+        if compaction_counts['snapshot_written']:
+            num_snapshots_written += 1
+
+    return {
+        "num_manifests_checked": len(config['projects']),
+        "num_manifests_rewritten": num_manifests_rewritten,
+        "num_snapshots_written": num_snapshots_written,
+    }
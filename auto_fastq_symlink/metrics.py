@@ -0,0 +1,153 @@
+import contextlib
+import os
+import threading
+import time
+from typing import Iterator, Optional
+
+# Histogram bucket upper bounds, in seconds. Also used for histograms of other values.
+DEFAULT_BUCKETS = [0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0, 10.0, 30.0, 60.0, 300.0, 600.0]
+
+PROMETHEUS_METRIC_PREFIX = "auto_fastq_symlink_"
+
+# Metrics are collected in a single process-wide registry, which is reset at the start of each scan.
+# Run discovery happens in a pool of threads (see `core.find_runs`), so all updates hold the lock.
+_lock = threading.Lock()
+_counters = {}
+_histograms = {}
+
+
+def reset():
+    """
+    Clear all counters and histograms.
+    """
+    with _lock:
+        _counters.clear()
+        _histograms.clear()
+
+
+def increment(name: str, value: int = 1):
+    """
+    :param name: Counter name
+    :type name: str
+    :param value: Amount to add to the counter
+    :type value: int
+    :return: None
+    :rtype: NoneType
+    """
+    with _lock:
+        _counters[name] = _counters.get(name, 0) + value
+
+
+def observe(name: str, value: float):
+    """
+    Add one observation to a histogram.
+
+    :param name: Histogram name
+    :type name: str
+    :param value: Observed value
+    :type value: float
+    :return: None
+    :rtype: NoneType
+    """
+    with _lock:
+        histogram = _histograms.get(name, None)
+        if histogram is None:
+            histogram = {
+                "count": 0,
+                "sum": 0.0,
+                "min": value,
+                "max": value,
+                "bucket_counts": [0] * len(DEFAULT_BUCKETS),
+            }
+            _histograms[name] = histogram
+        histogram['count'] += 1
+        histogram['sum'] += value
+        histogram['min'] = min(histogram['min'], value)
+        histogram['max'] = max(histogram['max'], value)
+        for idx, upper_bound in enumerate(DEFAULT_BUCKETS):
+            if value <= upper_bound:
+                histogram['bucket_counts'][idx] += 1
+                break
+
+
+@contextlib.contextmanager
+def timer(name: str) -> Iterator[None]:
+    """
+    Time the enclosed block, and add the duration (in seconds) to the `<name>_seconds` histogram.
+
+    :param name: Name of the phase or step being timed
+    :type name: str
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe(name + "_seconds", time.perf_counter() - start)
+
+
+def get_summary() -> dict[str, object]:
+    """
+    :return: Counters and histograms (count, sum, min, max & mean), with keys: `counters`, `histograms`
+    :rtype: dict[str, object]
+    """
+    with _lock:
+        summary = {"counters": dict(_counters), "histograms": {}}
+        for name, histogram in _histograms.items():
+            summary['histograms'][name] = {
+                "count": histogram['count'],
+                "sum": round(histogram['sum'], 6),
+                "min": round(histogram['min'], 6),
+                "max": round(histogram['max'], 6),
+                "mean": round(histogram['sum'] / histogram['count'], 6),
+            }
+
+    return summary
+
+
+def _format_prometheus(gauges: dict[str, float]) -> str:
+    """
+    Format the current metrics in the Prometheus text exposition format.
+    Counters are reset with each scan, so they are exposed as gauges (values for the last scan).
+    """
+    lines = []
+    with _lock:
+        for name, value in sorted(gauges.items()):
+            metric_name = PROMETHEUS_METRIC_PREFIX + name
+            lines.append("# TYPE " + metric_name + " gauge")
+            lines.append(metric_name + " " + str(value))
+        for name, value in sorted(_counters.items()):
+            metric_name = PROMETHEUS_METRIC_PREFIX + name
+            lines.append("# TYPE " + metric_name + " gauge")
+            lines.append(metric_name + " " + str(value))
+        for name, histogram in sorted(_histograms.items()):
+            metric_name = PROMETHEUS_METRIC_PREFIX + name
+            lines.append("# TYPE " + metric_name + " histogram")
+            cumulative_count = 0
+            for upper_bound, bucket_count in zip(DEFAULT_BUCKETS, histogram['bucket_counts']):
+                cumulative_count += bucket_count
+                lines.append(metric_name + '_bucket{le="' + str(upper_bound) + '"} ' + str(cumulative_count))
+            lines.append(metric_name + '_bucket{le="+Inf"} ' + str(histogram['count']))
+            lines.append(metric_name + "_sum " + str(histogram['sum']))
+            lines.append(metric_name + "_count " + str(histogram['count']))
+
+    return "\n".join(lines) + "\n"
+
+
+def write_prometheus_textfile(path: str, gauges: Optional[dict[str, float]] = None):
+    """
+    Write the current metrics to a file for the Prometheus node exporter's textfile collector.
+    The file is written to a temporary file first, then moved into place, so the collector never reads a partial file.
+
+    :param path: Path to the output file (should end with `.prom`)
+    :type path: str
+    :param gauges: Additional values to include (eg. `scan_duration_seconds`)
+    :type gauges: dict[str, float] | None
+    :return: None
+    :rtype: NoneType
+    """
+    if gauges is None:
+        gauges = {}
+    tmp_path = path + ".tmp"
+    with open(tmp_path, 'w') as f:
+        f.write(_format_prometheus(gauges))
+    os.replace(tmp_path, path)
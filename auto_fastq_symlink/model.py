@@ -1,6 +1,7 @@
 import datetime
 
 from sqlalchemy import Column
+from sqlalchemy import Index
 from sqlalchemy import ForeignKey
 from sqlalchemy import Boolean
 from sqlalchemy import Integer
@@ -11,6 +12,7 @@ from sqlalchemy import DateTime
 from sqlalchemy import JSON
 
 from sqlalchemy.orm import declarative_base
+from sqlalchemy.orm import foreign
 from sqlalchemy.orm import relationship
 
 Base = declarative_base()
@@ -18,6 +20,10 @@ Base = declarative_base()
 
 class SequencingRun(Base):
     __tablename__ = 'sequencing_run'
+    __table_args__ = (
+        # For paging through the runs that have been updated since a given time (see `auto_fastq_symlink.api`).
+        Index('ix_sequencing_run_timestamp_updated', 'timestamp_updated', 'sequencing_run_id'),
+    )
 
     sequencing_run_id = Column(String, primary_key=True)
     instrument_type = Column(String)
@@ -31,20 +37,45 @@ class SequencingRun(Base):
     libraries = relationship(
         "Library", back_populates="sequencing_run", cascade="all, delete-orphan"
     )
+    fingerprint = relationship(
+        "SequencingRunFingerprint", back_populates="sequencing_run", uselist=False, cascade="all, delete-orphan"
+    )
+
+
+class SequencingRunFingerprint(Base):
+    __tablename__ = 'sequencing_run_fingerprint'
+
+    sequencing_run_id = Column(String, ForeignKey("sequencing_run.sequencing_run_id"), primary_key=True)
+    run_directory_mtime = Column(Float)
+    samplesheet_mtime = Column(Float)
+    samplesheet_size = Column(Integer)
+    fastq_directory_mtime = Column(Float)
+    layout = Column(String)
+    layout_directory_mtimes = Column(JSON)
+    timestamp_updated = Column(DateTime, default=datetime.datetime.now, onupdate=datetime.datetime.now)
+
+    sequencing_run = relationship("SequencingRun", back_populates="fingerprint")
 
 
 class Library(Base):
     __tablename__ = 'library'
+    __table_args__ = (
+        # The primary key starts with library_id, so it can't be used to look up libraries by run.
+        Index('ix_library_sequencing_run_id', 'sequencing_run_id'),
+        # Includes library_id so that a project's libraries can be paged through in index order.
+        Index('ix_library_project_id_sequencing_run_id_library_id', 'project_id', 'sequencing_run_id', 'library_id'),
+    )
 
     library_id = Column(String, primary_key=True)
     sequencing_run_id = Column(String, ForeignKey("sequencing_run.sequencing_run_id"), primary_key=True)
-    project_id = Column(String, ForeignKey("project.project_id"))
+    # Not a foreign key: SampleSheets may list projects that aren't in the projects definition file.
+    project_id = Column(String)
     fastq_path_r1 = Column(String)
     fastq_path_r2 = Column(String)
     timestamp_updated = Column(DateTime, default=datetime.datetime.now, onupdate=datetime.datetime.now)
 
     sequencing_run = relationship("SequencingRun", back_populates="libraries")
-    project = relationship("Project", back_populates="libraries")
+    project = relationship("Project", primaryjoin="Project.project_id == foreign(Library.project_id)", back_populates="libraries")
 
 
 class Project(Base):
@@ -55,16 +86,55 @@ class Project(Base):
     timestamp_updated = Column(DateTime, default=datetime.datetime.now, onupdate=datetime.datetime.now)
 
     libraries = relationship(
-        "Library", back_populates="project", cascade="all, delete-orphan"
+        "Library", primaryjoin="Project.project_id == foreign(Library.project_id)", back_populates="project", cascade="all, delete-orphan"
     )
 
 
 class Symlink(Base):
     __tablename__ = 'symlink'
+    __table_args__ = (
+        Index('ix_symlink_sequencing_run_id', 'sequencing_run_id'),
+        Index('ix_symlink_project_id_target', 'project_id', 'target'),
+    )
 
     project_id = Column(String, ForeignKey("project.project_id"))
-    sequencing_run_id = Column(String, ForeignKey("sequencing_run.sequencing_run_id"))
-    library_id = Column(String, ForeignKey("library.library_id"))
+    # Not foreign keys: symlinks are found on the filesystem before their run is stored (or for runs that
+    # are never stored), and `library_id` alone doesn't identify a library.
+    sequencing_run_id = Column(String)
+    library_id = Column(String)
     path = Column(String, primary_key=True)
     target = Column(String, primary_key=True)
     timestamp_updated = Column(DateTime, default=datetime.datetime.now, onupdate=datetime.datetime.now)
+
+
+class SymlinkDirectory(Base):
+    __tablename__ = 'symlink_directory'
+
+    path = Column(String, primary_key=True)
+    project_id = Column(String, ForeignKey("project.project_id"))
+    sequencing_run_id = Column(String)
+    directory_mtime = Column(Float)
+    timestamp_updated = Column(DateTime, default=datetime.datetime.now, onupdate=datetime.datetime.now)
+
+
+class ScanWorker(Base):
+    __tablename__ = 'scan_worker'
+
+    worker_id = Column(String, primary_key=True)
+    hostname = Column(String)
+    heartbeat_at = Column(DateTime)
+    timestamp_updated = Column(DateTime, default=datetime.datetime.now, onupdate=datetime.datetime.now)
+
+
+class ScanLease(Base):
+    __tablename__ = 'scan_lease'
+    __table_args__ = (
+        Index('ix_scan_lease_worker_id', 'worker_id'),
+    )
+
+    lease_key = Column(String, primary_key=True)
+    # Not a foreign key: leases outlive the workers that held them, until they expire.
+    # None while the lease is on offer to its preferred worker (see `db.claim_scan_leases`).
+    worker_id = Column(String)
+    lease_expires_at = Column(DateTime)
+    timestamp_updated = Column(DateTime, default=datetime.datetime.now, onupdate=datetime.datetime.now)
@@ -10,106 +10,288 @@ import jsonschema
 import auto_fastq_symlink.util as util
 
 
-def _parse_header_section_miseq_v1(samplesheet_path):
-    header_lines = []
-    header = {}
-    header['instrument_type'] = 'MiSeq'
+# Compiled schema validators, indexed by schema name. See: `_get_samplesheet_validator`
+_samplesheet_validators = {}
+
+SECTION_HEADER_REGEX = re.compile("\\[(?P<section_name>[^\\]]+)\\]")
+
+
+def _split_samplesheet_sections(samplesheet_path: str) -> dict[str, list[list[str]]]:
+    """
+    Read a SampleSheet once, splitting it into its sections (`[Header]`, `[Reads]`, `[Data]`, etc.).
+    Each line is stripped and split on commas exactly once. Lines before the first section header are ignored.
+    If a section header appears more than once, the rows of all occurrences are combined.
 
+    :param samplesheet_path: Path to SampleSheet to be split
+    :type samplesheet_path: str
+    :return: Rows of each section (as lists of fields), indexed by section name (without brackets)
+    :rtype: dict[str, list[list[str]]]
+    """
+    sections = {}
+    section_rows = None
     with open(samplesheet_path, 'r') as f:
         for line in f:
-            if line.strip().startswith('[Header]'):
-                continue
-            if line.strip().startswith('[Reads]'):
-                break
-            else:
-                header_lines.append(line.strip().rstrip(','))
+            line = line.strip()
+            section_header_match = SECTION_HEADER_REGEX.match(line)
+            if section_header_match:
+                section_name = section_header_match.group('section_name')
+                section_rows = sections.setdefault(section_name, [])
+            elif section_rows is not None:
+                section_rows.append(line.split(','))
+
+    return sections
+
+
+def _parse_samplesheet_sections(samplesheet_path: str, section_parsers: dict[str, tuple]) -> dict[str, object]:
+    """
+    Split a SampleSheet into its sections (in a single pass over the file), then hand each section's rows to its parser.
+    Sections that are missing from the SampleSheet are parsed as if they were empty.
+
+    :param samplesheet_path: Path to SampleSheet to be parsed
+    :type samplesheet_path: str
+    :param section_parsers: Tuples of (section name, section parser function), indexed by the key to use in the parsed SampleSheet
+    :type section_parsers: dict[str, tuple[str, Callable[[list[list[str]]], object]]]
+    :return: The parsed (but not yet validated) SampleSheet
+    :rtype: dict[str, object]
+    """
+    samplesheet = {}
+    sections = _split_samplesheet_sections(samplesheet_path)
+    for samplesheet_key, (section_name, parse_section) in section_parsers.items():
+        samplesheet[samplesheet_key] = parse_section(sections.get(section_name, []))
 
-    for line in header_lines:
-        header_key = line.split(',')[0].lower().replace(" ", "_")
+    return samplesheet
+
+
+def _get_schema_path(schema_name: str) -> str:
+    """
+    :param schema_name: Name of the schema (eg. `samplesheet_miseq_v1`)
+    :type schema_name: str
+    :return: Path to the schema file in the package `resources` directory.
+    :rtype: str
+    """
+    schema_path = os.path.join(os.path.dirname(__file__), "resources", schema_name + ".schema.json")
+
+    return schema_path
+
+
+def _get_samplesheet_validator(schema_name: str):
+    """
+    Get a validator for a SampleSheet schema. Validators are built (and the schema itself is checked)
+    once, then re-used for every SampleSheet. If the schema file has been modified since the validator
+    was built (for example, if the package was upgraded while the application was running), the
+    validator is rebuilt.
+
+    :param schema_name: Name of the schema (eg. `samplesheet_miseq_v1`)
+    :type schema_name: str
+    :return: Validator for the schema
+    :rtype: jsonschema.protocols.Validator
+    """
+    schema_path = _get_schema_path(schema_name)
+    schema_mtime = os.stat(schema_path).st_mtime
+    cached_validator = _samplesheet_validators.get(schema_name, None)
+    if cached_validator is not None and cached_validator['schema_mtime'] == schema_mtime:
+        return cached_validator['validator']
+
+    with open(schema_path, 'r') as f:
+        schema = json.load(f)
+    validator_class = jsonschema.validators.validator_for(schema)
+    validator_class.check_schema(schema)
+    validator = validator_class(schema)
+    _samplesheet_validators[schema_name] = {
+        'schema_mtime': schema_mtime,
+        'validator': validator,
+    }
+    logging.debug(json.dumps({"event_type": "samplesheet_schema_loaded", "schema_path": schema_path}))
+
+    return validator
+
+
+def reload_samplesheet_schemas():
+    """
+    Discard all cached SampleSheet schema validators. They will be rebuilt from the schema files the next time they're needed.
+    """
+    _samplesheet_validators.clear()
 
-        if len(line.split(',')) > 1:
-            header_value = line.split(',')[1]
+
+def _validate_samplesheet(samplesheet: dict[str, object], samplesheet_path: str, schema_name: str):
+    """
+    :param samplesheet: The parsed SampleSheet
+    :type samplesheet: dict[str, object]
+    :param samplesheet_path: Path to the SampleSheet that was parsed (used for logging)
+    :type samplesheet_path: str
+    :param schema_name: Name of the schema to validate against (eg. `samplesheet_miseq_v1`)
+    :type schema_name: str
+    :return: None
+    :raises jsonschema.ValidationError: If the parsed samplesheed doesn't conform to the schema.
+    """
+    validator = _get_samplesheet_validator(schema_name)
+    # Same error that `jsonschema.validate` would raise
+    error = jsonschema.exceptions.best_match(validator.iter_errors(samplesheet))
+    if error is not None:
+        logging.error(json.dumps({"event_type": "samplesheet_validation_failed", "samplesheet_path": samplesheet_path, "schema_path": _get_schema_path(schema_name)}))
+        raise error
+
+
+def _trim_trailing_empty_fields(fields: list[str]) -> list[str]:
+    """
+    Equivalent to calling `.rstrip(',')` on a line before splitting it.
+
+    :param fields: Fields from a single SampleSheet row
+    :type fields: list[str]
+    :return: Fields, with any empty trailing fields removed
+    :rtype: list[str]
+    """
+    num_fields = len(fields)
+    while num_fields > 0 and fields[num_fields - 1] == "":
+        num_fields -= 1
+
+    return fields[:num_fields]
+
+
+def _is_blank_row(fields: list[str]) -> bool:
+    """
+    :param fields: Fields from a single SampleSheet row
+    :type fields: list[str]
+    :return: True if the row contains nothing but commas.
+    :rtype: bool
+    """
+    return all([x == '' for x in fields])
+
+
+def _truncate_at_blank_row(rows: list[list[str]]) -> list[list[str]]:
+    """
+    In NextSeq SampleSheets, a section ends at the next section header, or at the first blank line.
+
+    :param rows: Rows of a single SampleSheet section
+    :type rows: list[list[str]]
+    :return: All rows up to (but not including) the first blank row.
+    :rtype: list[list[str]]
+    """
+    for idx, fields in enumerate(rows):
+        if _is_blank_row(fields):
+            return rows[:idx]
+
+    return rows
+
+
+def _parse_key_value_rows(rows: list[list[str]], key_transform, value_transform=None) -> dict[str, object]:
+    """
+    Parse SampleSheet section rows of the form: `key,value`. Rows with an empty key are skipped.
+
+    :param rows: Rows of a single SampleSheet section
+    :type rows: list[list[str]]
+    :param key_transform: Function applied to each key (eg. to convert it to snake_case)
+    :type key_transform: Callable[[str], str]
+    :param value_transform: Function applied to each non-empty value (eg. `int`)
+    :type value_transform: Callable[[str], object] | None
+    :return: Parsed section
+    :rtype: dict[str, object]
+    """
+    parsed = {}
+    for fields in rows:
+        fields = _trim_trailing_empty_fields(fields)
+        if not fields:
+            continue
+        key = key_transform(fields[0])
+
+        if len(fields) > 1:
+            value = fields[1]
+            if value_transform is not None:
+                value = value_transform(value)
         else:
-            header_value = ""
+            value = ""
+
+        if key != "":
+            parsed[key] = value
+
+    return parsed
+
+
+def _parse_table_rows(header_fields: list[str], rows: list[list[str]]) -> list[dict[str, str]]:
+    """
+    Parse SampleSheet section rows that form a table, with a header row. Rows that are shorter
+    than the header are padded with empty strings. Blank rows are skipped.
+
+    :param header_fields: The (already transformed) keys from the header row
+    :type header_fields: list[str]
+    :param rows: Rows of the table, not including the header row
+    :type rows: list[list[str]]
+    :return: One dict per row, indexed by the header fields
+    :rtype: list[dict[str, str]]
+    """
+    table = []
+    for fields in rows:
+        if _is_blank_row(fields):
+            continue
+        d = {}
+        for idx, key in enumerate(header_fields):
+            if idx < len(fields):
+                d[key] = fields[idx]
+            else:
+                d[key] = ""
+        table.append(d)
+
+    return table
+
+
+def _miseq_key(key: str) -> str:
+    """
+    MiSeq SampleSheet keys are converted to lowercase, with spaces replaced by underscores.
+
+    :param key: Key, as it appears in the SampleSheet
+    :type key: str
+    :return: Converted key
+    :rtype: str
+    """
+    return key.lower().replace(" ", "_")
+
+
+def _parse_header_section_miseq_v1(rows):
+    """
+    """
+    header = {}
+    header['instrument_type'] = 'MiSeq'
+    header.update(_parse_key_value_rows(rows, _miseq_key))
 
-        if header_key != "":
-            header[header_key] = header_value
-              
     return header
 
 
-def _parse_reads_section_miseq_v1(samplesheet_path):
+def _parse_reads_section_miseq_v1(rows):
     """
     """
-    reads_lines = []
     reads = []
-    with open(samplesheet_path, 'r') as f:
-        for line in f:
-            if line.strip().startswith('[Reads]'):
-                break
-        for line in f:
-            if line.strip().startswith('[Settings]'):
-                break
-            reads_lines.append(line.strip().rstrip(','))
-
-    for line in reads_lines:
-        if line != "":
-            read_len = int(line.split(',')[0])
+    for fields in rows:
+        fields = _trim_trailing_empty_fields(fields)
+        if fields:
+            read_len = int(fields[0])
             reads.append(read_len)
 
     return reads
 
 
-def _parse_settings_section_miseq_v1(samplesheet_path):
+def _parse_settings_section_miseq_v1(rows):
     """
     """
-    settings_lines = []
-    settings = {}
-    with open(samplesheet_path, 'r') as f:
-        for line in f:
-            if line.strip().startswith('[Settings]'):
-                break
-        for line in f:
-            if line.strip().startswith('[Data]'):
-                break
-            settings_lines.append(line.strip().rstrip(','))
-
-    for line in settings_lines:
-        settings_key = line.split(',')[0].lower().replace(" ", "_")
+    settings = _parse_key_value_rows(rows, _miseq_key)
 
-        if len(line.split(',')) > 1:
-            settings_value = line.split(',')[1]
-        else:
-            settings_value = ""
-
-        if settings_key != "":
-            settings[settings_key] = settings_value
-              
     return settings
 
 
-def _parse_data_section_miseq_v1(samplesheet_path):
+def _parse_data_section_miseq_v1(rows):
     """
     """
     data = []
-    with open(samplesheet_path, 'r') as f:
-        for line in f:
-            if not line.strip().startswith('[Data]'):
-                continue
-            else:
-                break
-          
-        data_header = [x.lower() for x in next(f).strip().split(',')]
-      
-        for line in f:
-            if not all([x == '' for x in line.strip().split(',')]):
-                data_line = {}
-                for idx, data_element in enumerate(line.strip().split(',')):
-                    try:
-                        data_line[data_header[idx]] = data_element
-                    except IndexError as e:
-                        pass
-                data.append(data_line)
+    if not rows:
+        return data
+
+    data_header = [x.lower() for x in rows[0]]
+    for fields in rows[1:]:
+        if not _is_blank_row(fields):
+            data_line = {}
+            # Fields beyond the end of the header row are dropped
+            for data_key, data_element in zip(data_header, fields):
+                data_line[data_key] = data_element
+            data.append(data_line)
 
     return data
 
@@ -126,6 +308,14 @@ def _determine_samplesheet_version(samplesheet_path, instrument_type):
     return samplesheet_version
 
 
+MISEQ_V1_SECTION_PARSERS = {
+    'header': ('Header', _parse_header_section_miseq_v1),
+    'reads': ('Reads', _parse_reads_section_miseq_v1),
+    'settings': ('Settings', _parse_settings_section_miseq_v1),
+    'data': ('Data', _parse_data_section_miseq_v1),
+}
+
+
 def _parse_samplesheet_miseq_v1(samplesheet_path: str) -> dict[str, object]:
     """
     :param samplesheet_path: Path to SampleSheet to be parsed
@@ -134,242 +324,96 @@ def _parse_samplesheet_miseq_v1(samplesheet_path: str) -> dict[str, object]:
     :rtype: dict[str, object]
     :raises jsonschema.ValidationError: If the parsed samplesheed doesn't conform to the schema.
     """
-    samplesheet = {}
-    samplesheet['header'] = _parse_header_section_miseq_v1(samplesheet_path)
-    samplesheet['reads'] = _parse_reads_section_miseq_v1(samplesheet_path)
-    samplesheet['settings'] = _parse_settings_section_miseq_v1(samplesheet_path)
-    samplesheet['data'] = _parse_data_section_miseq_v1(samplesheet_path)
-    schema_path = os.path.join(os.path.dirname(__file__), "resources", "samplesheet_miseq_v1.schema.json")
-    schema = None
-    with open(schema_path, 'r') as f:
-        schema = json.load(f)
+    samplesheet = _parse_samplesheet_sections(samplesheet_path, MISEQ_V1_SECTION_PARSERS)
 
-    try:
-        jsonschema.validate(instance=samplesheet, schema=schema)
-    except jsonschema.ValidationError as e:
-        logging.error({"event_type": "samplesheet_validation_failed", "samplesheet_path": samplesheet_path, "schema_path": schema_path})
-        raise e
+    _validate_samplesheet(samplesheet, samplesheet_path, "samplesheet_miseq_v1")
 
     return samplesheet
 
 
-def _parse_header_section_nextseq_v1(samplesheet_path):
+def _parse_header_section_nextseq_v1(rows):
     """
     """
-    header_lines = []
     header = {}
     header['instrument_type'] = 'NextSeq2000'
+    header.update(_parse_key_value_rows(_truncate_at_blank_row(rows), util.camel_to_snake))
 
-    with open(samplesheet_path, 'r') as f:
-        for line in f:
-            if line.strip().startswith('[Header]'):
-                continue
-            if line.strip().startswith('[Reads]') or line.strip().rstrip(',') == "":
-                break
-            else:
-                header_lines.append(line.strip().rstrip(','))
-
-    for line in header_lines:
-        header_key = util.camel_to_snake(line.split(',')[0])
-
-        if len(line.split(',')) > 1:
-            header_value = line.split(',')[1]
-        else:
-            header_value = ""
-
-        if header_key != "":
-            header[header_key] = header_value
-              
     return header
 
 
-def _parse_reads_section_nextseq_v1(samplesheet_path):
+def _parse_reads_section_nextseq_v1(rows):
     """
     """
-    reads_lines = []
-    reads = {}
-    with open(samplesheet_path, 'r') as f:
-        for line in f:
-            if line.strip().startswith('[Reads]'):
-                break
-        for line in f:
-            if line.strip().startswith('[Sequencing_Settings]') or line.strip().rstrip(',') == "":
-                break
-            reads_lines.append(line.strip().rstrip(','))
-
-    for line in reads_lines:
-        reads_key = util.camel_to_snake(line.split(',')[0])
-        if len(line.split(',')) > 1:
-            reads_value = int(line.split(',')[1])
-        else:
-            reads_value = ""
-
-        if reads_key != "":
-            reads[reads_key] = reads_value
+    reads = _parse_key_value_rows(_truncate_at_blank_row(rows), util.camel_to_snake, int)
 
     return reads
 
 
-def _parse_sequencing_settings_section_nextseq_v1(samplesheet_path):
+def _parse_sequencing_settings_section_nextseq_v1(rows):
     """
     """
-    sequencing_settings_lines = []
-    sequencing_settings = {}
-    with open(samplesheet_path, 'r') as f:
-        for line in f:
-            if line.strip().startswith('[Sequencing_Settings]'):
-                break
-        for line in f:
-            if line.strip().startswith('[BCLConvert_Settings]') or line.strip().rstrip(',') == "":
-                break
-            sequencing_settings_lines.append(line.strip().rstrip(','))
+    sequencing_settings = _parse_key_value_rows(_truncate_at_blank_row(rows), util.camel_to_snake)
 
-    for line in sequencing_settings_lines:
-        sequencing_settings_key = util.camel_to_snake(line.split(',')[0])
-
-        if len(line.split(',')) > 1:
-            sequencing_settings_value = line.split(',')[1]
-        else:
-            sequencing_settings_value = ""
-
-        if sequencing_settings_key != "":
-            sequencing_settings[sequencing_settings_key] = sequencing_settings_value
-              
     return sequencing_settings
 
 
-def _parse_bclconvert_settings_section_nextseq_v1(samplesheet_path):
+def _parse_bclconvert_settings_section_nextseq_v1(rows):
     """
     """
-    bclconvert_settings_lines = []
-    bclconvert_settings = {}
-    with open(samplesheet_path, 'r') as f:
-        for line in f:
-            if line.strip().startswith('[BCLConvert_Settings]'):
-                break
-        for line in f:
-            if line.strip().startswith('[BCLConvert_Data]') or line.strip().rstrip(',') == "":
-                break
-            bclconvert_settings_lines.append(line.strip().rstrip(','))
-
-    for line in bclconvert_settings_lines:
-        bclconvert_settings_key = util.camel_to_snake(line.split(',')[0])
+    bclconvert_settings = _parse_key_value_rows(_truncate_at_blank_row(rows), util.camel_to_snake)
 
-    if len(line.split(',')) > 1:
-        bclconvert_settings_value = line.split(',')[1]
-    else:
-        bclconvert_settings_value = ""
-
-    if bclconvert_settings_key != "":
-        bclconvert_settings[bclconvert_settings_key] = bclconvert_settings_value
-              
     return bclconvert_settings
 
 
-def _parse_bclconvert_data_section_nextseq_v1(samplesheet_path):
+def _parse_bclconvert_data_section_nextseq_v1(rows):
     """
     """
-    bclconvert_data_lines = []
     bclconvert_data = []
-    with open(samplesheet_path, 'r') as f:
-        for line in f:
-            if line.strip().startswith('[BCLConvert_Data]'):
-                break
-        for line in f:
-            if line.strip().startswith('[Cloud_Settings]') or line.strip().rstrip(',') == "":
-                break
-            bclconvert_data_lines.append(line.strip().rstrip(','))
-
-    bclconvert_data_keys = [util.camel_to_snake(x) for x in bclconvert_data_lines[0].split(',')]
-    for line in bclconvert_data_lines[1:]:
-        d = {}
-        values = line.split(',')
-        for idx, key in enumerate(bclconvert_data_keys):
-            d[key] = values[idx]
-        bclconvert_data.append(d)
+    rows = _truncate_at_blank_row(rows)
+    if rows:
+        bclconvert_data_keys = [util.camel_to_snake(x) for x in _trim_trailing_empty_fields(rows[0])]
+        bclconvert_data = _parse_table_rows(bclconvert_data_keys, rows[1:])
 
     return bclconvert_data
 
 
-def _parse_cloud_settings_section_nextseq_v1(samplesheet_path):
+def _parse_cloud_settings_section_nextseq_v1(rows):
     """
     """
-    cloud_settings_lines = []
-    cloud_settings = {}
-    with open(samplesheet_path, 'r') as f:
-        for line in f:
-            if line.strip().startswith('[Cloud_Settings]'):
-                break
-        for line in f:
-            if line.strip().startswith('[BCLConvert_Settings]') or line.strip().rstrip(',') == "":
-                break
-            cloud_settings_lines.append(line.strip().rstrip(','))
+    cloud_settings = _parse_key_value_rows(_truncate_at_blank_row(rows), util.camel_to_snake)
 
-    for line in cloud_settings_lines:
-        cloud_settings_key = util.camel_to_snake(line.split(',')[0])
-
-        if len(line.split(',')) > 1:
-            cloud_settings_value = line.split(',')[1]
-        else:
-            cloud_settings_value = ""
-
-        if cloud_settings_key != "":
-            cloud_settings[cloud_settings_key] = cloud_settings_value
-              
     return cloud_settings
 
 
-def _parse_cloud_data_section_nextseq_v1(samplesheet_path):
-    cloud_data_lines = []
+def _parse_cloud_data_section_nextseq_v1(rows):
+    """
+    """
     cloud_data = []
-    with open(samplesheet_path, 'r') as f:
-        for line in f:
-            if line.strip().startswith('[Cloud_Data]'):
-                break
-        for line in f:
-            if line.strip().startswith('[Cloud_Settings]') or line.strip().rstrip(',') == "":
-                break
-            cloud_data_lines.append(line.strip().rstrip(','))
-
-    if cloud_data_lines:
-        cloud_data_keys = [util.camel_to_snake(x) for x in cloud_data_lines[0].split(',')]
-        for line in cloud_data_lines[1:]:
-            d = {}
-            values = line.strip().split(',')
-            if not all([x == '' for x in values]):
-                for idx, key in enumerate(cloud_data_keys):
-                    try:
-                        d[key] = values[idx]
-                    except IndexError as e:
-                        d[key] = ""
-                cloud_data.append(d)
-  
+    rows = _truncate_at_blank_row(rows)
+    if rows:
+        cloud_data_keys = [util.camel_to_snake(x) for x in _trim_trailing_empty_fields(rows[0])]
+        cloud_data = _parse_table_rows(cloud_data_keys, rows[1:])
+
     return cloud_data
 
 
+NEXTSEQ_V1_SECTION_PARSERS = {
+    'header': ('Header', _parse_header_section_nextseq_v1),
+    'reads': ('Reads', _parse_reads_section_nextseq_v1),
+    'sequencing_settings': ('Sequencing_Settings', _parse_sequencing_settings_section_nextseq_v1),
+    'bclconvert_settings': ('BCLConvert_Settings', _parse_bclconvert_settings_section_nextseq_v1),
+    'bclconvert_data': ('BCLConvert_Data', _parse_bclconvert_data_section_nextseq_v1),
+    'cloud_settings': ('Cloud_Settings', _parse_cloud_settings_section_nextseq_v1),
+    'cloud_data': ('Cloud_Data', _parse_cloud_data_section_nextseq_v1),
+}
+
 
 def _parse_samplesheet_nextseq_v1(samplesheet_path):
     """
     """
-    samplesheet = {}
-    samplesheet['header'] = _parse_header_section_nextseq_v1(samplesheet_path)
-    samplesheet['reads'] = _parse_reads_section_nextseq_v1(samplesheet_path)
-    samplesheet['sequencing_settings'] = _parse_sequencing_settings_section_nextseq_v1(samplesheet_path)
-    samplesheet['bclconvert_settings'] = _parse_bclconvert_settings_section_nextseq_v1(samplesheet_path)
-    samplesheet['bclconvert_data'] = _parse_bclconvert_data_section_nextseq_v1(samplesheet_path)
-    samplesheet['cloud_settings'] = _parse_cloud_settings_section_nextseq_v1(samplesheet_path)
-    samplesheet['cloud_data'] = _parse_cloud_data_section_nextseq_v1(samplesheet_path)
-
-    schema_path = os.path.join(os.path.dirname(__file__), "resources", "samplesheet_nextseq_v1.schema.json")
-    schema = None
-    with open(schema_path, 'r') as f:
-        schema = json.load(f)
+    samplesheet = _parse_samplesheet_sections(samplesheet_path, NEXTSEQ_V1_SECTION_PARSERS)
 
-    try:
-        jsonschema.validate(instance=samplesheet, schema=schema)
-    except jsonschema.ValidationError as e:
-        logging.error({"event_type": "samplesheet_validation_failed", "samplesheet_path": samplesheet_path, "schema_path": schema_path})
-        raise e
+    _validate_samplesheet(samplesheet, samplesheet_path, "samplesheet_nextseq_v1")
 
     return samplesheet
 
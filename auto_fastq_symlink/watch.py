@@ -0,0 +1,314 @@
+import json
+import logging
+import os
+import time
+from typing import Optional
+
+try:
+    import inotify_simple
+except ImportError as e:
+    inotify_simple = None
+
+# A run is queued for scanning when either of these files has been written to its run directory.
+RUN_MARKER_FILES = [
+    "upload_complete.json",
+    "qc_check_complete.json",
+]
+
+# inotify only sees changes made through the local kernel, so it can't be used
+# to watch directories on these filesystems.
+NETWORK_FILESYSTEM_TYPES = {
+    "nfs",
+    "nfs4",
+    "cifs",
+    "smb3",
+    "smbfs",
+    "fuse.sshfs",
+    "lustre",
+    "gpfs",
+    "beegfs",
+    "ceph",
+    "glusterfs",
+    "fuse.glusterfs",
+}
+
+DEFAULT_POLL_INTERVAL_SECONDS = 10.0
+
+
+def _get_filesystem_type(path: str) -> Optional[str]:
+    """
+    Find the type of the filesystem that a path is on, from the longest matching mount point in `/proc/mounts`.
+
+    :param path: Path to a file or directory
+    :type path: str
+    :return: Filesystem type (eg. `ext4`, `nfs4`), or None if it can't be determined.
+    :rtype: str | None
+    """
+    real_path = os.path.realpath(path)
+    filesystem_type = None
+    longest_mount_point = ""
+    try:
+        with open("/proc/mounts", 'r') as f:
+            for line in f:
+                fields = line.split()
+                if len(fields) < 3:
+                    continue
+                mount_point, mount_filesystem_type = fields[1], fields[2]
+                mount_point_matches = real_path == mount_point or real_path.startswith(mount_point.rstrip('/') + '/')
+                if mount_point_matches and len(mount_point) > len(longest_mount_point):
+                    longest_mount_point = mount_point
+                    filesystem_type = mount_filesystem_type
+    except OSError as e:
+        pass
+
+    return filesystem_type
+
+
+def _has_marker_files(run_dir_path: str) -> tuple[bool, bool]:
+    """
+    :param run_dir_path: Path to a run directory
+    :type run_dir_path: str
+    :return: Tuple of (any marker file exists, all marker files exist)
+    :rtype: tuple[bool, bool]
+    """
+    marker_files_exist = [os.path.exists(os.path.join(run_dir_path, f)) for f in RUN_MARKER_FILES]
+
+    return any(marker_files_exist), all(marker_files_exist)
+
+
+def _get_marker_file_stats(run_dir_path: str) -> dict[str, tuple[int, int]]:
+    """
+    :param run_dir_path: Path to a run directory
+    :type run_dir_path: str
+    :return: The (size, mtime_ns) of each marker file that exists in the run directory, indexed by file name
+    :rtype: dict[str, tuple[int, int]]
+    """
+    marker_file_stats = {}
+    for f in RUN_MARKER_FILES:
+        try:
+            marker_file_stat = os.stat(os.path.join(run_dir_path, f))
+        except OSError as e:
+            continue
+        marker_file_stats[f] = (marker_file_stat.st_size, marker_file_stat.st_mtime_ns)
+
+    return marker_file_stats
+
+
+class PollingRunWatcher:
+    """
+    Watch for new marker files in run directories by polling directory modification times.
+    Creating a file in a directory updates the directory's modification time, so only one `stat` is needed
+    per `run_parent_dir` and per run directory that doesn't have any marker files yet. Writing to a file doesn't
+    update the directory's modification time, so the marker files that do exist are checked on every poll, and
+    the run is reported again if any of them change. This way, a run that is reported while a marker file is
+    only partially written is reported again once the write has finished. A run directory stops being watched
+    once all of its marker files exist and haven't changed since the previous poll.
+    Works on any filesystem, including network filesystems.
+    """
+    def __init__(self, run_parent_dirs: list[str], poll_interval_seconds: float = DEFAULT_POLL_INTERVAL_SECONDS):
+        self.run_parent_dirs = list(run_parent_dirs)
+        self.poll_interval_seconds = poll_interval_seconds
+        self._run_parent_dir_mtimes = {}
+        # Run directories that are still being watched, with their last-seen (mtime, marker file stats).
+        self._pending_run_dir_states = {}
+        self._known_run_dirs = set()
+        for run_parent_dir in self.run_parent_dirs:
+            self._check_run_parent_dir(run_parent_dir)
+        # Anything that exists before the watcher starts is left to the full scan.
+        self._poll_pending_run_dirs(report_new_run_dirs=False)
+
+    @staticmethod
+    def _get_mtime(path: str) -> Optional[float]:
+        try:
+            return os.stat(path).st_mtime
+        except OSError as e:
+            return None
+
+    def _check_run_parent_dir(self, run_parent_dir: str):
+        """
+        If the run parent dir has changed, look for new run directories in it.
+        """
+        mtime = self._get_mtime(run_parent_dir)
+        if mtime is None or mtime == self._run_parent_dir_mtimes.get(run_parent_dir, None):
+            return
+        self._run_parent_dir_mtimes[run_parent_dir] = mtime
+        with os.scandir(run_parent_dir) as subdirs:
+            for subdir in subdirs:
+                if subdir.path not in self._known_run_dirs and subdir.is_dir():
+                    self._known_run_dirs.add(subdir.path)
+                    self._pending_run_dir_states[subdir.path] = None
+
+    def _poll_pending_run_dirs(self, report_new_run_dirs: bool = True) -> list[str]:
+        """
+        :param report_new_run_dirs: Whether run directories that haven't been polled before (ie. that were found since the last poll) are reported if they already have a marker file, eg. when a finished run is moved into place.
+        :type report_new_run_dirs: bool
+        :return: Run directories where a marker file has been created or changed since the last poll.
+        :rtype: list[str]
+        """
+        ready_run_dirs = []
+        for run_dir_path, last_state in list(self._pending_run_dir_states.items()):
+            mtime = self._get_mtime(run_dir_path)
+            if mtime is None:
+                del self._pending_run_dir_states[run_dir_path]
+                self._known_run_dirs.discard(run_dir_path)
+                continue
+            if last_state is not None and mtime == last_state[0] and not last_state[1]:
+                # No marker files yet, and none have been created since the last poll
+                continue
+            marker_file_stats = _get_marker_file_stats(run_dir_path)
+            self._pending_run_dir_states[run_dir_path] = (mtime, marker_file_stats)
+            if last_state is not None and marker_file_stats == last_state[1]:
+                if len(marker_file_stats) == len(RUN_MARKER_FILES):
+                    del self._pending_run_dir_states[run_dir_path]
+                continue
+            if marker_file_stats and (last_state is not None or report_new_run_dirs):
+                ready_run_dirs.append(run_dir_path)
+
+        return ready_run_dirs
+
+    def poll(self) -> list[str]:
+        """
+        Check once for run directories where marker files have been created since the last poll.
+
+        :return: Paths to run directories
+        :rtype: list[str]
+        """
+        for run_parent_dir in self.run_parent_dirs:
+            self._check_run_parent_dir(run_parent_dir)
+
+        return self._poll_pending_run_dirs()
+
+    def wait_for_runs(self, timeout_seconds: float) -> list[str]:
+        """
+        Poll until at least one run directory is ready, or until the timeout expires.
+
+        :param timeout_seconds: Maximum time to wait
+        :type timeout_seconds: float
+        :return: Paths to run directories (empty if the timeout expired)
+        :rtype: list[str]
+        """
+        deadline = time.monotonic() + timeout_seconds
+        while True:
+            ready_run_dirs = self.poll()
+            remaining_seconds = deadline - time.monotonic()
+            if ready_run_dirs or remaining_seconds <= 0:
+                return ready_run_dirs
+            time.sleep(min(self.poll_interval_seconds, remaining_seconds))
+
+    def close(self):
+        pass
+
+
+class InotifyRunWatcher:
+    """
+    Watch for new marker files in run directories using inotify (requires the `inotify_simple` package).
+    Each `run_parent_dir` is watched for new run directories, and each run directory that doesn't have
+    all of its marker files yet is watched for new files. A marker file is only counted once it has been
+    closed after writing (or moved into place), so that runs are never scanned while a marker file is
+    only partially written.
+    """
+    def __init__(self, run_parent_dirs: list[str]):
+        self.run_parent_dirs = list(run_parent_dirs)
+        self._inotify = inotify_simple.INotify()
+        self._dir_flags = inotify_simple.flags.CREATE | inotify_simple.flags.MOVED_TO | inotify_simple.flags.ONLYDIR
+        self._file_flags = inotify_simple.flags.MOVED_TO | inotify_simple.flags.CLOSE_WRITE
+        self._run_parent_dirs_by_wd = {}
+        self._run_dirs_by_wd = {}
+        # The marker files in each watched run directory that have been completely written.
+        self._written_marker_files_by_wd = {}
+        for run_parent_dir in self.run_parent_dirs:
+            if not os.path.isdir(run_parent_dir):
+                continue
+            wd = self._inotify.add_watch(run_parent_dir, self._dir_flags)
+            self._run_parent_dirs_by_wd[wd] = run_parent_dir
+            with os.scandir(run_parent_dir) as subdirs:
+                for subdir in subdirs:
+                    if subdir.is_dir() and not _has_marker_files(subdir.path)[1]:
+                        self._watch_run_dir(subdir.path)
+
+    def _watch_run_dir(self, run_dir_path: str):
+        try:
+            wd = self._inotify.add_watch(run_dir_path, self._file_flags)
+            self._run_dirs_by_wd[wd] = run_dir_path
+            # Marker files that already exist when the watch is added are assumed to have been written.
+            self._written_marker_files_by_wd[wd] = set([f for f in RUN_MARKER_FILES if os.path.exists(os.path.join(run_dir_path, f))])
+        except OSError as e:
+            logging.warning(json.dumps({"event_type": "watch_run_dir_failed", "run_directory": run_dir_path, "error": str(e)}))
+
+    def _unwatch_run_dir(self, wd: int):
+        try:
+            self._inotify.rm_watch(wd)
+        except OSError as e:
+            pass
+        del self._run_dirs_by_wd[wd]
+        del self._written_marker_files_by_wd[wd]
+
+    def wait_for_runs(self, timeout_seconds: float) -> list[str]:
+        """
+        Wait until at least one run directory is ready, or until the timeout expires.
+
+        :param timeout_seconds: Maximum time to wait
+        :type timeout_seconds: float
+        :return: Paths to run directories (empty if the timeout expired)
+        :rtype: list[str]
+        """
+        ready_run_dirs = []
+        for event in self._inotify.read(timeout=max(int(timeout_seconds * 1000), 0)):
+            if event.wd in self._run_parent_dirs_by_wd:
+                # ONLYDIR only applies to the watched directory itself, so files created in a
+                # `run_parent_dir` still generate events.
+                if not event.mask & inotify_simple.flags.ISDIR:
+                    continue
+                run_dir_path = os.path.join(self._run_parent_dirs_by_wd[event.wd], event.name)
+                self._watch_run_dir(run_dir_path)
+                # Marker files might have been created before the watch was added
+                if _has_marker_files(run_dir_path)[0]:
+                    ready_run_dirs.append(run_dir_path)
+            elif event.wd in self._run_dirs_by_wd and event.name in RUN_MARKER_FILES:
+                run_dir_path = self._run_dirs_by_wd[event.wd]
+                ready_run_dirs.append(run_dir_path)
+                # Only stop watching once every marker file has been written, so that the event for
+                # a marker file that is still being written isn't missed.
+                self._written_marker_files_by_wd[event.wd].add(event.name)
+                if self._written_marker_files_by_wd[event.wd] == set(RUN_MARKER_FILES):
+                    self._unwatch_run_dir(event.wd)
+
+        # Preserve the order that the runs became ready, without duplicates
+        return list(dict.fromkeys(ready_run_dirs))
+
+    def close(self):
+        self._inotify.close()
+
+
+def make_run_watcher(config: dict[str, object]):
+    """
+    Create a run watcher for the `run_parent_dirs` in the config. The `watch_method` config entry can be
+    `inotify`, `poll` or `auto` (the default). With `auto`, inotify is used if the `inotify_simple` package
+    is installed and none of the `run_parent_dirs` are on network filesystems. Otherwise, polling is used.
+
+    :param config: Application config.
+    :type config: dict[str, object]
+    :return: A run watcher, with a `wait_for_runs(timeout_seconds)` method.
+    :rtype: InotifyRunWatcher | PollingRunWatcher
+    """
+    run_parent_dirs = config['run_parent_dirs']
+    watch_method = config.get('watch_method', 'auto')
+    poll_interval_seconds = float(config.get('watch_poll_interval_seconds', DEFAULT_POLL_INTERVAL_SECONDS))
+    if watch_method == 'auto':
+        on_network_filesystem = any([_get_filesystem_type(d) in NETWORK_FILESYSTEM_TYPES for d in run_parent_dirs])
+        if inotify_simple is not None and not on_network_filesystem:
+            watch_method = 'inotify'
+        else:
+            watch_method = 'poll'
+
+    if watch_method == 'inotify' and inotify_simple is None:
+        logging.warning(json.dumps({"event_type": "inotify_unavailable", "message": "inotify_simple is not installed. Falling back to polling."}))
+        watch_method = 'poll'
+
+    if watch_method == 'inotify':
+        watcher = InotifyRunWatcher(run_parent_dirs)
+    else:
+        watcher = PollingRunWatcher(run_parent_dirs, poll_interval_seconds)
+    logging.info(json.dumps({"event_type": "run_watcher_started", "watch_method": watch_method, "run_parent_dirs": run_parent_dirs}))
+
+    return watcher
@@ -0,0 +1,116 @@
+#!/usr/bin/env python
+
+import argparse
+import json
+import logging
+import os
+import random
+import tempfile
+import time
+
+from sqlalchemy import text
+
+import auto_fastq_symlink.db as db
+from auto_fastq_symlink.model import Base, Library, Symlink
+
+from bench_store_run import make_synthetic_run
+
+
+def make_synthetic_symlinks(run):
+    """
+    Make one symlink per fastq file in the run, in the form that `core.iter_symlinks` produces.
+    """
+    for library in run['libraries']:
+        symlink_dir = os.path.join("/symlinks", library['project_id'], run['run_id'])
+        for fastq_path in [library['fastq_path_r1'], library['fastq_path_r2']]:
+            symlink = {
+                "sequencing_run_id": run['run_id'],
+                "path": os.path.join(symlink_dir, os.path.basename(fastq_path)),
+                "target": fastq_path,
+            }
+            yield library['project_id'], symlink
+
+
+def get_hot_queries(run_ids, project_id, run_id):
+    """
+    The queries that are run once per run (or per chunk of runs) during a scan.
+
+    :return: Query name -> SQLAlchemy query
+    :rtype: dict[str, object]
+    """
+    symlink_path = os.path.join("/symlinks", project_id, run_id, "x.fastq.gz")
+    queries = {
+        "libraries_by_run_id": Library.__table__.select().where(Library.sequencing_run_id == run_id),
+        "libraries_by_run_ids": Library.__table__.select().where(Library.sequencing_run_id.in_(run_ids)),
+        "libraries_by_project_id_and_run_id": Library.__table__.select().where(Library.project_id == project_id, Library.sequencing_run_id == run_id),
+        "symlinks_by_run_ids": Symlink.__table__.select().where(Symlink.sequencing_run_id.in_(run_ids)),
+        "symlinks_in_directory": Symlink.__table__.select().where(Symlink.project_id == project_id, Symlink.sequencing_run_id == run_id),
+        "symlinks_by_project_id_and_target": Symlink.__table__.select().where(Symlink.project_id == project_id, Symlink.target.like("/sequencers/%")),
+        "symlinks_by_path": Symlink.__table__.select().where(Symlink.path.in_([symlink_path])),
+    }
+
+    return queries
+
+
+def explain_and_time(connection, query, repeats):
+    """
+    :return: The query plan (as reported by `EXPLAIN QUERY PLAN`), whether every table access uses an index, and the mean query time.
+    :rtype: dict[str, object]
+    """
+    compiled = str(query.compile(connection, compile_kwargs={"literal_binds": True}))
+    plan = [row[-1] for row in connection.execute(text("EXPLAIN QUERY PLAN " + compiled))]
+    start = time.perf_counter()
+    for _ in range(repeats):
+        connection.execute(query).fetchall()
+    mean_seconds = (time.perf_counter() - start) / repeats
+
+    return {
+        "plan": plan,
+        "uses_index": not any([step.startswith("SCAN") for step in plan]),
+        "mean_seconds": round(mean_seconds, 6),
+    }
+
+
+def main(args):
+    logging.disable(logging.CRITICAL)
+    random.seed(args.seed)
+    projects = ["project_" + str(n) for n in range(args.projects)]
+    results = {"num_runs": args.runs, "num_libraries_per_run": args.libraries_per_run, "with_indexes": {}, "without_indexes": {}}
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        config = {"database_connection_uri": "sqlite:///" + os.path.join(tmp_dir, "bench.db")}
+        engine = db.init_db(config)
+        Base.metadata.create_all(engine)
+        runs = [make_synthetic_run(run_num, args.libraries_per_run, projects) for run_num in range(args.runs)]
+        for run in runs:
+            db.store_run(config, run)
+            db.store_symlinks_in_chunks(config, make_synthetic_symlinks(run))
+
+        run_ids = [run['run_id'] for run in random.sample(runs, min(10, len(runs)))]
+        queries = get_hot_queries(run_ids, projects[0], run_ids[0])
+        with engine.connect() as connection:
+            connection.execute(text("ANALYZE"))
+            for query_name, query in queries.items():
+                results["with_indexes"][query_name] = explain_and_time(connection, query, args.repeats)
+            for table in [Library.__table__, Symlink.__table__]:
+                for index in table.indexes:
+                    index.drop(connection)
+        # The sqlite3 module caches prepared statements per connection, and a cached
+        # `EXPLAIN QUERY PLAN` statement keeps reporting the old plan, so use new connections.
+        engine.dispose()
+        with engine.connect() as connection:
+            for query_name, query in queries.items():
+                results["without_indexes"][query_name] = explain_and_time(connection, query, args.repeats)
+        db.dispose_db()
+
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Show the SQLite query plans and timings of the per-run queries, with and without the secondary indexes, using a temporary database.")
+    parser.add_argument('--runs', default=500, type=int)
+    parser.add_argument('--libraries-per-run', default=96, type=int)
+    parser.add_argument('--projects', default=10, type=int)
+    parser.add_argument('--repeats', default=20, type=int)
+    parser.add_argument('--seed', default=0, type=int)
+    args = parser.parse_args()
+    main(args)
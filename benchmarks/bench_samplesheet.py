@@ -0,0 +1,66 @@
+#!/usr/bin/env python
+
+import argparse
+import glob
+import json
+import logging
+import os
+import timeit
+
+import jsonschema
+
+import auto_fastq_symlink.samplesheet as ss
+
+THIS_DIR = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_SAMPLESHEETS_DIR = os.path.join(THIS_DIR, "..", "test", "data", "samplesheets")
+
+
+def _instrument_type_from_filename(samplesheet_path):
+    """
+    The test samplesheets are named like: `SampleSheet_<instrument_type>_v1_<valid|invalid>_01.csv`
+    """
+    if 'nextseq' in os.path.basename(samplesheet_path).lower():
+        return 'nextseq'
+    return 'miseq'
+
+
+def _time_per_call_microseconds(f, num_iterations):
+    """
+    """
+    total_seconds = timeit.timeit(f, number=num_iterations)
+    return total_seconds / num_iterations * 1_000_000
+
+
+def main(args):
+    logging.disable(logging.CRITICAL)
+    section_parsers = {
+        'miseq': ss.MISEQ_V1_SECTION_PARSERS,
+        'nextseq': ss.NEXTSEQ_V1_SECTION_PARSERS,
+    }
+    samplesheet_paths = sorted(glob.glob(os.path.join(args.samplesheets_dir, "*.csv")))
+    for samplesheet_path in samplesheet_paths:
+        instrument_type = _instrument_type_from_filename(samplesheet_path)
+        parse_only = lambda: ss._parse_samplesheet_sections(samplesheet_path, section_parsers[instrument_type])
+        result = {
+            "samplesheet": os.path.basename(samplesheet_path),
+            "instrument_type": instrument_type,
+            "num_iterations": args.iterations,
+            "parse_microseconds_per_samplesheet": round(_time_per_call_microseconds(parse_only, args.iterations), 1),
+        }
+        try:
+            ss.parse_samplesheet(samplesheet_path, instrument_type)
+            parse_and_validate = lambda: ss.parse_samplesheet(samplesheet_path, instrument_type)
+            result["parse_and_validate_microseconds_per_samplesheet"] = round(_time_per_call_microseconds(parse_and_validate, args.iterations), 1)
+        except jsonschema.ValidationError as e:
+            # Invalid samplesheets can only be timed up to the point of validation.
+            result["parse_and_validate_microseconds_per_samplesheet"] = None
+
+        print(json.dumps(result))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Time SampleSheet parsing for every SampleSheet in a directory.")
+    parser.add_argument('--samplesheets-dir', default=DEFAULT_SAMPLESHEETS_DIR)
+    parser.add_argument('-n', '--iterations', default=1000, type=int)
+    args = parser.parse_args()
+    main(args)
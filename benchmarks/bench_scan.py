@@ -0,0 +1,130 @@
+#!/usr/bin/env python
+
+import argparse
+import datetime
+import json
+import logging
+import os
+import platform
+import random
+import subprocess
+import tempfile
+import time
+
+import auto_fastq_symlink.config
+import auto_fastq_symlink.core as core
+import auto_fastq_symlink.db as db
+import auto_fastq_symlink.metrics as metrics
+from auto_fastq_symlink.model import Base
+
+import generate_run_tree
+
+THIS_DIR = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_RESULTS_FILE = os.path.join(THIS_DIR, "results", "bench_scan.jsonl")
+
+
+def _get_git_revision():
+    """
+    :return: Short hash of the current commit (with `-dirty` appended if there are uncommitted changes), or None if not in a git repo.
+    """
+    try:
+        revision = subprocess.check_output(["git", "describe", "--always", "--dirty"], cwd=THIS_DIR, stderr=subprocess.DEVNULL)
+        return revision.decode().strip()
+    except (OSError, subprocess.CalledProcessError) as e:
+        return None
+
+
+def time_scan_cycle(config):
+    """
+    Time one full cycle of the main loop: `core.scan`, then `core.symlink_run` for each run that is found.
+
+    :return: Scan duration and the metrics that were collected during the scan.
+    """
+    metrics.reset()
+    start = time.perf_counter()
+    for run in core.scan(config):
+        if run is not None:
+            core.symlink_run(config, run)
+    elapsed_seconds = time.perf_counter() - start
+    summary = metrics.get_summary()
+    result = {
+        "scan_seconds": round(elapsed_seconds, 3),
+        "counters": summary['counters'],
+        "phase_seconds": {name: histogram['sum'] for name, histogram in summary['histograms'].items()},
+    }
+
+    return result
+
+
+def main(args):
+    logging.disable(logging.CRITICAL)
+    with tempfile.TemporaryDirectory(dir=args.tmp_dir) as tmp_dir:
+        generate_start = time.perf_counter()
+        config_path = generate_run_tree.generate_run_tree(
+            tmp_dir,
+            num_miseq_runs=args.miseq_runs,
+            num_nextseq_runs=args.nextseq_runs,
+            libraries_per_run=args.libraries_per_run,
+            num_lanes=args.lanes,
+            num_projects=args.projects,
+            proportion_qc_failed=args.proportion_qc_failed,
+            proportion_alignment_layout=args.proportion_alignment_layout,
+            seed=args.seed,
+        )
+        generate_seconds = time.perf_counter() - generate_start
+        config = auto_fastq_symlink.config.load_config(config_path)
+        config['scan_num_workers'] = args.scan_num_workers
+        Base.metadata.create_all(db.init_db(config))
+
+        cycles = {}
+        # Full (non-incremental) scans: everything is re-parsed and re-walked every time.
+        config['incremental_scan'] = False
+        cycles["full_initial"] = time_scan_cycle(config)
+        cycles["full_rescan"] = time_scan_cycle(config)
+        # Incremental scans: the first one stores fingerprints and symlink directory mtimes, later ones can skip unchanged runs.
+        config['incremental_scan'] = True
+        cycles["incremental_initial"] = time_scan_cycle(config)
+        cycles["incremental_rescan"] = time_scan_cycle(config)
+        rng = random.Random(args.seed + 1)
+        run_parent_dir = config['run_parent_dirs'][0]
+        for run_num in range(args.miseq_runs, args.miseq_runs + args.new_runs):
+            generate_run_tree.generate_run(run_parent_dir, "miseq", run_num, list(config['projects']), rng, args.libraries_per_run, args.lanes, 0.0, args.proportion_alignment_layout)
+        cycles["incremental_rescan_with_new_runs"] = time_scan_cycle(config)
+        db.dispose_db()
+
+    result = {
+        "timestamp": datetime.datetime.now().isoformat(),
+        "git_revision": _get_git_revision(),
+        "python_version": platform.python_version(),
+        "parameters": {
+            "num_miseq_runs": args.miseq_runs,
+            "num_nextseq_runs": args.nextseq_runs,
+            "num_libraries_per_run": args.libraries_per_run,
+            "num_lanes": args.lanes,
+            "num_projects": args.projects,
+            "proportion_qc_failed": args.proportion_qc_failed,
+            "proportion_alignment_layout": args.proportion_alignment_layout,
+            "num_new_runs": args.new_runs,
+            "scan_num_workers": args.scan_num_workers,
+            "seed": args.seed,
+        },
+        "generate_run_tree_seconds": round(generate_seconds, 3),
+        "cycles": cycles,
+    }
+    print(json.dumps(result, indent=2))
+
+    if args.results_file:
+        os.makedirs(os.path.dirname(os.path.abspath(args.results_file)), exist_ok=True)
+        with open(args.results_file, 'a') as f:
+            f.write(json.dumps(result) + '\n')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Time full and incremental scan + symlink cycles over a generated run tree, using a temporary SQLite database.")
+    generate_run_tree.add_run_tree_arguments(parser)
+    parser.add_argument('--new-runs', default=5, type=int, help="Number of runs added before the last incremental scan")
+    parser.add_argument('--scan-num-workers', default=1, type=int)
+    parser.add_argument('--tmp-dir', help="Where to generate the run tree (eg. a network filesystem mount). Default: the system temp dir")
+    parser.add_argument('--results-file', default=DEFAULT_RESULTS_FILE, help="Results are appended to this file, one JSON object per line. Set to an empty string to disable.")
+    args = parser.parse_args()
+    main(args)
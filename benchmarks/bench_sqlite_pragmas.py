@@ -0,0 +1,77 @@
+#!/usr/bin/env python
+
+import argparse
+import json
+import logging
+import os
+import shutil
+import tempfile
+
+import auto_fastq_symlink.config
+import auto_fastq_symlink.db as db
+from auto_fastq_symlink.model import Base
+
+import generate_run_tree
+from bench_scan import time_scan_cycle
+
+
+def time_full_scans(config, database_path, sqlite_performance_mode):
+    """
+    Time an initial full scan and a full rescan against a new SQLite database.
+
+    :return: Results of `time_scan_cycle` for each scan, along with the journal mode that was in effect.
+    :rtype: dict[str, object]
+    """
+    config = dict(config)
+    config['database_connection_uri'] = "sqlite:///" + database_path
+    config['sqlite_performance_mode'] = sqlite_performance_mode
+    config['incremental_scan'] = False
+    Base.metadata.create_all(db.init_db(config))
+    with db.session_scope(config) as session:
+        journal_mode = session.connection().exec_driver_sql("PRAGMA journal_mode").scalar()
+
+    result = {
+        "journal_mode": journal_mode,
+        "full_initial": time_scan_cycle(config),
+        "full_rescan": time_scan_cycle(config),
+    }
+    db.dispose_db()
+
+    return result
+
+
+def main(args):
+    logging.disable(logging.CRITICAL)
+    with tempfile.TemporaryDirectory(dir=args.tmp_dir) as tmp_dir:
+        config_path = generate_run_tree.generate_run_tree(
+            tmp_dir,
+            num_miseq_runs=args.miseq_runs,
+            num_nextseq_runs=args.nextseq_runs,
+            libraries_per_run=args.libraries_per_run,
+            num_lanes=args.lanes,
+            num_projects=args.projects,
+            proportion_qc_failed=args.proportion_qc_failed,
+            proportion_alignment_layout=args.proportion_alignment_layout,
+            seed=args.seed,
+        )
+        config = auto_fastq_symlink.config.load_config(config_path)
+
+        results = {}
+        for profile_name, sqlite_performance_mode in [("default", False), ("performance", True)]:
+            # Symlinks created by the first profile's scans would make the second profile's initial scan cheaper.
+            for project in config['projects'].values():
+                shutil.rmtree(project['fastq_symlinks_dir'], ignore_errors=True)
+            database_path = os.path.join(tmp_dir, "symlinks_" + profile_name + ".db")
+            results[profile_name] = time_full_scans(config, database_path, sqlite_performance_mode)
+
+    speedup = results["default"]["full_rescan"]["scan_seconds"] / max(results["performance"]["full_rescan"]["scan_seconds"], 0.001)
+    results["full_rescan_speedup"] = round(speedup, 2)
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Compare full scans against SQLite with the default settings and with `sqlite_performance_mode` enabled.")
+    generate_run_tree.add_run_tree_arguments(parser)
+    parser.add_argument('--tmp-dir', help="Where to generate the run tree and databases (eg. the filesystem the database would live on). Default: the system temp dir")
+    args = parser.parse_args()
+    main(args)
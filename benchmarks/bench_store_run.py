@@ -0,0 +1,87 @@
+#!/usr/bin/env python
+
+import argparse
+import datetime
+import json
+import logging
+import os
+import random
+import tempfile
+import time
+
+import auto_fastq_symlink.db as db
+from auto_fastq_symlink.model import Base
+
+
+def make_synthetic_run(run_num, num_libraries, projects):
+    """
+    Make a run (in the same form that `core.find_runs` produces) with a valid MiSeq run ID.
+    """
+    run_date = datetime.date(2020, 1, 1) + datetime.timedelta(days=run_num // 3)
+    run_id = run_date.strftime("%y%m%d") + "_M00123_" + str(run_num).zfill(4) + "_000000000-" + str(run_num).zfill(5)
+    run_dir = os.path.join("/sequencers/M00123/runs", run_id)
+    fastq_dir = os.path.join(run_dir, "Data", "Intensities", "BaseCalls")
+    run = {
+        "run_id": run_id,
+        "instrument_type": "miseq",
+        "parsed_samplesheet": os.path.join(run_dir, "SampleSheet.csv"),
+        "run_directory": run_dir,
+        "fastq_directory": fastq_dir,
+        "libraries": [],
+    }
+    for library_num in range(num_libraries):
+        library_id = "R" + str(run_num).zfill(5) + str(library_num).zfill(4)
+        run['libraries'].append({
+            "library_id": library_id,
+            "project_id": random.choice(projects),
+            "fastq_path_r1": os.path.join(fastq_dir, library_id + "_S" + str(library_num + 1) + "_L001_R1_001.fastq.gz"),
+            "fastq_path_r2": os.path.join(fastq_dir, library_id + "_S" + str(library_num + 1) + "_L001_R2_001.fastq.gz"),
+        })
+
+    return run
+
+
+def time_store_runs(config, runs):
+    """
+    :return: Rows (runs + libraries) stored per second.
+    """
+    num_rows = sum([1 + len(run['libraries']) for run in runs])
+    start = time.perf_counter()
+    for run in runs:
+        db.store_run(config, run)
+    elapsed_seconds = time.perf_counter() - start
+
+    return {"num_rows": num_rows, "seconds": round(elapsed_seconds, 3), "rows_per_second": round(num_rows / elapsed_seconds, 1)}
+
+
+def main(args):
+    logging.disable(logging.CRITICAL)
+    random.seed(args.seed)
+    projects = ["project_" + str(n) for n in range(args.projects)]
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        config = {"database_connection_uri": "sqlite:///" + os.path.join(tmp_dir, "bench.db")}
+        Base.metadata.create_all(db.init_db(config))
+        runs = [make_synthetic_run(run_num, args.libraries_per_run, projects) for run_num in range(args.runs)]
+
+        results = {"num_runs": args.runs, "num_libraries_per_run": args.libraries_per_run}
+        results["initial_store"] = time_store_runs(config, runs)
+        results["restore_unchanged"] = time_store_runs(config, runs)
+        for run in runs:
+            for library in run['libraries']:
+                if random.random() < args.proportion_changed:
+                    library['project_id'] = random.choice(projects)
+        results["restore_partially_changed"] = time_store_runs(config, runs)
+        db.dispose_db()
+
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Time db.store_run over a synthetic run history, using a temporary SQLite database.")
+    parser.add_argument('--runs', default=1000, type=int)
+    parser.add_argument('--libraries-per-run', default=96, type=int)
+    parser.add_argument('--projects', default=10, type=int)
+    parser.add_argument('--proportion-changed', default=0.1, type=float)
+    parser.add_argument('--seed', default=0, type=int)
+    args = parser.parse_args()
+    main(args)
@@ -0,0 +1,241 @@
+#!/usr/bin/env python
+
+import argparse
+import csv
+import datetime
+import json
+import os
+import random
+
+THIS_DIR = os.path.dirname(os.path.abspath(__file__))
+TEMPLATE_SAMPLESHEETS_DIR = os.path.join(THIS_DIR, "..", "test", "data", "samplesheets")
+TEMPLATE_SAMPLESHEETS = {
+    "miseq": os.path.join(TEMPLATE_SAMPLESHEETS_DIR, "SampleSheet_miseq_v1_valid_01.csv"),
+    "nextseq": os.path.join(TEMPLATE_SAMPLESHEETS_DIR, "SampleSheet_nextseq_v1_valid_01.csv"),
+}
+MISEQ_INSTRUMENT_ID = "M00123"
+NEXTSEQ_INSTRUMENT_ID = "VH00123"
+INDEX_BASES = "ACGT"
+
+
+def _read_template_sections(template_path):
+    """
+    Split a template samplesheet into sections, keeping the lines of each section as-is.
+
+    :return: List of (section header line, lines in section)
+    """
+    sections = []
+    with open(template_path, 'r') as f:
+        for line in f:
+            line = line.rstrip('\r\n')
+            if line.startswith('['):
+                sections.append((line, []))
+            elif sections:
+                sections[-1][1].append(line)
+
+    return sections
+
+
+def _random_index(rng):
+    return "".join([rng.choice(INDEX_BASES) for _ in range(10)])
+
+
+def _make_library_id(rng, library_num):
+    """
+    Library IDs look like the ones in the test samplesheets: `R1234567890-100-A-A01`
+    """
+    well = "ABCDEFGH"[library_num % 8] + str(library_num // 8 + 1).zfill(2)
+    return "R" + str(rng.randrange(10**9, 10**10)) + "-100-A-" + well
+
+
+def _write_samplesheet(path, instrument_type, libraries, rng):
+    """
+    Write a samplesheet for the libraries, using the header sections from the test samplesheets.
+    Only the library tables are replaced.
+    """
+    lines = []
+    for section_header, section_lines in _read_template_sections(TEMPLATE_SAMPLESHEETS[instrument_type]):
+        lines.append(section_header)
+        if section_header == "[Data]":
+            lines.append(section_lines[0])
+            for idx, library in enumerate(libraries):
+                index_num = str(idx + 1).zfill(4)
+                lines.append(",".join([library['library_id'], "", "", "", "", "UDP" + index_num, _random_index(rng), "UDP" + index_num, _random_index(rng), library['project_id'], ""]))
+        elif section_header == "[BCLConvert_Data]":
+            lines.append(section_lines[0])
+            for library in libraries:
+                lines.append(",".join([library['library_id'], _random_index(rng), _random_index(rng)]))
+        elif section_header == "[Cloud_Data]":
+            lines.append(section_lines[0])
+            for library in libraries:
+                lines.append(",".join([library['library_id'], library['project_id'], "", "", "", "", ""]))
+        else:
+            lines += section_lines
+
+    with open(path, 'w') as f:
+        f.write("\n".join(lines) + "\n")
+
+
+def _make_run_id(instrument_type, run_num, run_date, rng):
+    """
+    MiSeq run IDs look like: `220602_M00123_0300_000000000-Q5539`
+    NextSeq run IDs look like: `220602_VH00123_300_AAAW3JMM5`
+    """
+    flowcell_chars = "ABCDEFGHJKLMNPQRSTUVWXYZ0123456789"
+    if instrument_type == "miseq":
+        flowcell_id = "000000000-" + "".join([rng.choice(flowcell_chars) for _ in range(5)])
+        return "_".join([run_date.strftime("%y%m%d"), MISEQ_INSTRUMENT_ID, str(run_num).zfill(4), flowcell_id])
+    else:
+        flowcell_id = "".join([rng.choice(flowcell_chars) for _ in range(9)])
+        return "_".join([run_date.strftime("%y%m%d"), NEXTSEQ_INSTRUMENT_ID, str(run_num), flowcell_id])
+
+
+def generate_run(run_parent_dir, instrument_type, run_num, project_ids, rng, libraries_per_run=96, num_lanes=1, proportion_qc_failed=0.0, proportion_alignment_layout=0.5):
+    """
+    Generate a single run directory. Fastq files are empty.
+
+    MiSeq runs use either the v1 layout (`Data/Intensities/BaseCalls`) or, with probability `proportion_alignment_layout`,
+    the v2 layout (`Alignment_N/<timestamp>/Fastq`). NextSeq runs use the `Analysis/N/Data/fastq` layout.
+    Some runs have more than one `Alignment_N` or `Analysis/N` directory, as happens when a run is re-analyzed.
+
+    :return: Path to the run directory
+    :rtype: str
+    """
+    run_date = datetime.date(2020, 1, 1) + datetime.timedelta(days=run_num // 3)
+    run_id = _make_run_id(instrument_type, run_num, run_date, rng)
+    run_dir = os.path.join(run_parent_dir, run_id)
+    num_analyses = rng.choice([1, 1, 1, 2])
+    samplesheet_path = os.path.join(run_dir, "SampleSheet.csv")
+    if instrument_type == "miseq" and rng.random() < proportion_alignment_layout:
+        for analysis_num in range(1, num_analyses + 1):
+            analysis_timestamp = run_date.strftime("%Y%m%d") + "_" + str(120000 + analysis_num).zfill(6)
+            fastq_dir = os.path.join(run_dir, "Alignment_" + str(analysis_num), analysis_timestamp, "Fastq")
+            os.makedirs(fastq_dir)
+    elif instrument_type == "miseq":
+        fastq_dir = os.path.join(run_dir, "Data", "Intensities", "BaseCalls")
+        os.makedirs(fastq_dir)
+    else:
+        for analysis_num in range(1, num_analyses + 1):
+            fastq_dir = os.path.join(run_dir, "Analysis", str(analysis_num), "Data", "fastq")
+            os.makedirs(fastq_dir)
+        samplesheet_path = os.path.join(run_dir, "Analysis", str(num_analyses), "Data", "SampleSheet.csv")
+
+    libraries = []
+    for library_num in range(libraries_per_run):
+        libraries.append({
+            "library_id": _make_library_id(rng, library_num),
+            "project_id": rng.choice(project_ids),
+        })
+    _write_samplesheet(samplesheet_path, instrument_type, libraries, rng)
+
+    # Only the fastq directory of the latest analysis is filled in. That's the one that will be symlinked.
+    for library_num, library in enumerate(libraries):
+        for lane_num in range(1, num_lanes + 1):
+            for read_type in ["R1", "R2"]:
+                fastq_filename = "_".join([library['library_id'], "S" + str(library_num + 1), "L" + str(lane_num).zfill(3), read_type, "001.fastq.gz"])
+                open(os.path.join(fastq_dir, fastq_filename), 'w').close()
+
+    with open(os.path.join(run_dir, "upload_complete.json"), 'w') as f:
+        f.write(json.dumps({"timestamp_upload_complete": run_date.isoformat()}, indent=2) + '\n')
+    with open(os.path.join(run_dir, "qc_check_complete.json"), 'w') as f:
+        overall_pass_fail = "FAIL" if rng.random() < proportion_qc_failed else "PASS"
+        f.write(json.dumps({"overall_pass_fail": overall_pass_fail}, indent=2) + '\n')
+
+    return run_dir
+
+
+def generate_projects(output_dir, num_projects):
+    """
+    Write a projects definition file (and empty exclusion lists) for `num_projects` projects.
+
+    :return: Path to the projects definition file, and the project IDs.
+    :rtype: tuple[str, list[str]]
+    """
+    config_dir = os.path.join(output_dir, "config")
+    os.makedirs(config_dir, exist_ok=True)
+    project_ids = ["project_" + str(project_num).zfill(3) for project_num in range(num_projects)]
+    projects_definition_file = os.path.join(config_dir, "projects.csv")
+    excluded_runs_list = os.path.join(config_dir, "excluded_runs_empty.csv")
+    excluded_libraries_list = os.path.join(config_dir, "excluded_libraries_empty.csv")
+    for exclusion_list in [excluded_runs_list, excluded_libraries_list]:
+        open(exclusion_list, 'w').close()
+    with open(projects_definition_file, 'w') as f:
+        fieldnames = ['project_id', 'fastq_symlinks_dir', 'excluded_runs_list', 'excluded_libraries_list', 'simplify_symlink_filenames']
+        writer = csv.DictWriter(f, fieldnames=fieldnames, lineterminator='\n')
+        writer.writeheader()
+        for project_num, project_id in enumerate(project_ids):
+            writer.writerow({
+                'project_id': project_id,
+                'fastq_symlinks_dir': os.path.join(output_dir, "symlinks", project_id, "fastq_symlinks_by_run"),
+                'excluded_runs_list': excluded_runs_list,
+                'excluded_libraries_list': excluded_libraries_list,
+                'simplify_symlink_filenames': str(project_num % 2 == 0),
+            })
+
+    return projects_definition_file, project_ids
+
+
+def generate_run_tree(output_dir, num_miseq_runs=100, num_nextseq_runs=100, libraries_per_run=96, num_lanes=1, num_projects=10, proportion_qc_failed=0.1, proportion_alignment_layout=0.5, seed=0):
+    """
+    Generate a tree of simulated MiSeq and NextSeq runs, a projects definition file and an application config.
+
+    :return: Path to the application config file
+    :rtype: str
+    """
+    rng = random.Random(seed)
+    projects_definition_file, project_ids = generate_projects(output_dir, num_projects)
+    run_parent_dirs = {
+        "miseq": os.path.join(output_dir, "sequencers", MISEQ_INSTRUMENT_ID, "runs"),
+        "nextseq": os.path.join(output_dir, "sequencers", NEXTSEQ_INSTRUMENT_ID, "runs"),
+    }
+    for instrument_type, num_runs in [("miseq", num_miseq_runs), ("nextseq", num_nextseq_runs)]:
+        os.makedirs(run_parent_dirs[instrument_type], exist_ok=True)
+        for run_num in range(num_runs):
+            generate_run(run_parent_dirs[instrument_type], instrument_type, run_num, project_ids, rng, libraries_per_run, num_lanes, proportion_qc_failed, proportion_alignment_layout)
+
+    config = {
+        "run_parent_dirs": list(run_parent_dirs.values()),
+        "projects_definition_file": projects_definition_file,
+        "scan_interval_seconds": 3600,
+        "database_connection_uri": "sqlite:///" + os.path.join(output_dir, "symlinks.db"),
+        "fastq_extensions": [".fastq.gz"],
+    }
+    config_path = os.path.join(output_dir, "config", "config.json")
+    with open(config_path, 'w') as f:
+        f.write(json.dumps(config, indent=2) + '\n')
+
+    return config_path
+
+
+def main(args):
+    config_path = generate_run_tree(
+        args.output_dir,
+        num_miseq_runs=args.miseq_runs,
+        num_nextseq_runs=args.nextseq_runs,
+        libraries_per_run=args.libraries_per_run,
+        num_lanes=args.lanes,
+        num_projects=args.projects,
+        proportion_qc_failed=args.proportion_qc_failed,
+        proportion_alignment_layout=args.proportion_alignment_layout,
+        seed=args.seed,
+    )
+    print(config_path)
+
+
+def add_run_tree_arguments(parser):
+    parser.add_argument('--miseq-runs', default=100, type=int)
+    parser.add_argument('--nextseq-runs', default=100, type=int)
+    parser.add_argument('--libraries-per-run', default=96, type=int)
+    parser.add_argument('--lanes', default=1, type=int)
+    parser.add_argument('--projects', default=10, type=int)
+    parser.add_argument('--proportion-qc-failed', default=0.1, type=float)
+    parser.add_argument('--proportion-alignment-layout', default=0.5, type=float, help="Proportion of MiSeq runs with the Alignment_N layout (the rest use Data/Intensities/BaseCalls)")
+    parser.add_argument('--seed', default=0, type=int)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Generate a tree of simulated sequencing runs, a projects definition file and a config file.")
+    parser.add_argument('-o', '--output-dir', required=True)
+    add_run_tree_arguments(parser)
+    args = parser.parse_args()
+    main(args)
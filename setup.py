@@ -8,6 +8,7 @@ setup(
     entry_points={
         "console_scripts": [
             "auto-fastq-symlink = auto_fastq_symlink.__main__:main",
+            "auto-fastq-symlink-api = auto_fastq_symlink.api:main",
         ]
     },
     scripts=[],
@@ -21,6 +22,12 @@ setup(
         "uvicorn",
         "fastapi",
     ],
+    extras_require={
+        "inotify": ["inotify_simple"],
+        "postgres": ["psycopg2-binary"],
+        "parquet": ["pyarrow"],
+        "async": ["aiosqlite", "asyncpg"],
+    },
     description=' Automated symlinking of sequence data',
     url='https://github.com/BCCDC-PHL/auto-fastq-symlink',
     author='Dan Fornika',
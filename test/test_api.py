@@ -0,0 +1,145 @@
+import base64
+import datetime
+import importlib.util
+import json
+import logging
+import os
+import shutil
+import tempfile
+import unittest
+import unittest.mock
+
+import auto_fastq_symlink.db as db
+from auto_fastq_symlink.model import Base
+
+logging.disable(logging.CRITICAL)
+
+RUN_ID = "220602_M00123_300_000000000-Q5539"
+
+# The test client needs httpx, which isn't a dependency of the service itself.
+HAS_TEST_CLIENT = importlib.util.find_spec("fastapi") is not None and importlib.util.find_spec("httpx") is not None
+
+if HAS_TEST_CLIENT:
+    from fastapi.testclient import TestClient
+    import auto_fastq_symlink.api as api
+
+
+def _make_run(run_id, library_ids, project_id="routine_testing"):
+    run = {
+        "run_id": run_id,
+        "instrument_type": "miseq",
+        "parsed_samplesheet": "/runs/" + run_id + "/SampleSheet.csv",
+        "run_directory": "/runs/" + run_id,
+        "fastq_directory": "/runs/" + run_id + "/Data/Intensities/BaseCalls",
+        "libraries": [],
+    }
+    for idx, library_id in enumerate(library_ids):
+        run['libraries'].append({
+            "library_id": library_id,
+            "project_id": project_id,
+            "fastq_path_r1": os.path.join(run['fastq_directory'], library_id + "_S" + str(idx) + "_L001_R1_001.fastq.gz"),
+            "fastq_path_r2": os.path.join(run['fastq_directory'], library_id + "_S" + str(idx) + "_L001_R2_001.fastq.gz"),
+        })
+
+    return run
+
+@unittest.skipUnless(HAS_TEST_CLIENT, "fastapi and httpx are not installed")
+class Test(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.config = {
+            "database_connection_uri": "sqlite:///" + os.path.join(self.tmp_dir, "symlinks.db"),
+        }
+        Base.metadata.create_all(db.init_db(self.config))
+        self.library_ids = ["lib-" + str(idx).zfill(2) for idx in range(7)]
+        db.store_run(self.config, _make_run(RUN_ID, self.library_ids))
+        self.client = TestClient(api.create_app(self.config))
+
+    def tearDown(self):
+        db.dispose_db()
+        shutil.rmtree(self.tmp_dir)
+
+    def _get_all_pages(self, url, limit):
+        items = []
+        cursor = None
+        while True:
+            params = {"limit": limit}
+            if cursor is not None:
+                params['cursor'] = cursor
+            response = self.client.get(url, params=params)
+            self.assertEqual(200, response.status_code)
+            items += response.json()['items']
+            cursor = response.json()['next_cursor']
+            if cursor is None:
+                return items
+
+    def test_libraries_by_project_paginated(self):
+        db.store_run(self.config, _make_run(RUN_ID[:-1] + "0", self.library_ids[:2]))
+        libraries = self._get_all_pages("/projects/routine_testing/libraries", 3)
+
+        self.assertEqual(9, len(libraries))
+        self.assertEqual(sorted([(library['sequencing_run_id'], library['library_id']) for library in libraries]), [(library['sequencing_run_id'], library['library_id']) for library in libraries])
+
+    def test_libraries_by_run_and_library_id(self):
+        run_libraries = self._get_all_pages("/runs/" + RUN_ID + "/libraries", 100)
+        library_response = self.client.get("/libraries/lib-03")
+
+        self.assertEqual(self.library_ids, [library['library_id'] for library in run_libraries])
+        self.assertEqual([RUN_ID], [library['sequencing_run_id'] for library in library_response.json()['items']])
+
+    def test_symlinks_by_run(self):
+        symlinks = [{"sequencing_run_id": RUN_ID, "path": "/symlinks/" + RUN_ID + "/" + library_id + "_R1.fastq.gz", "target": "/runs/" + RUN_ID + "/" + library_id + "_S1_L001_R1_001.fastq.gz"} for library_id in self.library_ids]
+        db.store_symlinks(self.config, {"routine_testing": symlinks})
+        stored_symlinks = self._get_all_pages("/runs/" + RUN_ID + "/symlinks", 2)
+
+        self.assertEqual(sorted([symlink['path'] for symlink in symlinks]), [symlink['path'] for symlink in stored_symlinks])
+
+    def test_runs_since(self):
+        since = datetime.datetime.now()
+        db.store_run(self.config, _make_run(RUN_ID[:-1] + "0", self.library_ids[:2]))
+        all_runs = self._get_all_pages("/runs", 1)
+        new_runs = self.client.get("/runs", params={"since": since.isoformat()}).json()['items']
+
+        self.assertEqual(2, len(all_runs))
+        self.assertEqual([RUN_ID[:-1] + "0"], [run['sequencing_run_id'] for run in new_runs])
+
+    def test_not_modified_until_libraries_change(self):
+        url = "/runs/" + RUN_ID + "/libraries"
+        first_response = self.client.get(url)
+        etag = first_response.headers['etag']
+        with unittest.mock.patch.object(api.db, 'get_page', wraps=db.get_page) as get_page:
+            not_modified_response = self.client.get(url, headers={"If-None-Match": etag})
+            cached_response = self.client.get(url)
+            modified_run = _make_run(RUN_ID, self.library_ids)
+            modified_run['libraries'][0]['fastq_path_r1'] = "/moved/" + os.path.basename(modified_run['libraries'][0]['fastq_path_r1'])
+            db.store_run(self.config, modified_run)
+            modified_response = self.client.get(url, headers={"If-None-Match": etag})
+
+        self.assertEqual(304, not_modified_response.status_code)
+        self.assertEqual(first_response.content, cached_response.content)
+        self.assertEqual(1, get_page.call_count)
+        self.assertEqual(200, modified_response.status_code)
+        self.assertNotEqual(etag, modified_response.headers['etag'])
+        self.assertEqual(modified_run['libraries'][0]['fastq_path_r1'], modified_response.json()['items'][0]['fastq_path_r1'])
+
+    def test_invalid_cursor_rejected(self):
+        response = self.client.get("/runs/" + RUN_ID + "/libraries", params={"cursor": "not a cursor"})
+
+        self.assertEqual(400, response.status_code)
+
+    def test_cursor_with_non_string_timestamp_rejected(self):
+        cursor = base64.urlsafe_b64encode(json.dumps([1, RUN_ID]).encode('ascii')).decode('ascii')
+        response = self.client.get("/runs", params={"cursor": cursor})
+
+        self.assertEqual(400, response.status_code)
+        self.assertIn("Invalid cursor", response.text)
+
+    def test_cursor_with_malformed_timestamp_rejected(self):
+        cursor = base64.urlsafe_b64encode(json.dumps(["2022-13-45T99:00:00", RUN_ID]).encode('ascii')).decode('ascii')
+        response = self.client.get("/runs", params={"cursor": cursor})
+
+        self.assertEqual(400, response.status_code)
+        self.assertIn("Invalid cursor", response.text)
+
+if __name__ == '__main__':
+    unittest.main()
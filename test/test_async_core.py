@@ -0,0 +1,159 @@
+import importlib.util
+import json
+import logging
+import os
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+import unittest.mock
+
+from sqlalchemy import create_engine
+
+import auto_fastq_symlink.async_core as async_core
+import auto_fastq_symlink.core as core
+import auto_fastq_symlink.db as db
+import auto_fastq_symlink.manifest as manifest
+import auto_fastq_symlink.metrics as metrics
+from auto_fastq_symlink.model import Base
+
+logging.disable(logging.CRITICAL)
+
+THIS_DIR = os.path.dirname(os.path.abspath(__file__))
+SIMULATED_RUN_ID = "220602_M00123_300_000000000-Q5539"
+
+
+@unittest.skipIf(importlib.util.find_spec("aiosqlite") is None, "aiosqlite is not installed")
+class Test(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.run_parent_dir = os.path.join(self.tmp_dir, "runs")
+        self.run_ids = [SIMULATED_RUN_ID] + [SIMULATED_RUN_ID[:-1] + str(run_num) for run_num in range(1, 6)]
+        for run_id in self.run_ids:
+            run_dir = os.path.join(self.run_parent_dir, run_id)
+            shutil.copytree(os.path.join(THIS_DIR, "data", "simulated_runs", SIMULATED_RUN_ID), run_dir)
+            with open(os.path.join(run_dir, "qc_check_complete.json"), 'w') as f:
+                f.write(json.dumps({"overall_pass_fail": "PASS"}) + '\n')
+        self.sync_config = self._make_config("sync")
+        self.async_config = self._make_config("async")
+
+        core._runs_with_failed_symlinks.clear()
+        core._last_symlink_audit_time = None
+        metrics.reset()
+
+    def tearDown(self):
+        db.dispose_db()
+        shutil.rmtree(self.tmp_dir)
+
+    def _make_config(self, name):
+        connection_uri = "sqlite:///" + os.path.join(self.tmp_dir, name + ".db")
+        Base.metadata.create_all(create_engine(connection_uri))
+
+        return {
+            "run_parent_dirs": [self.run_parent_dir],
+            "database_connection_uri": connection_uri,
+            "fastq_extensions": [".fastq.gz"],
+            "incremental_scan": True,
+            "async_scan_concurrency": 4,
+            "project_id_translation": {},
+            "projects": {
+                "routine_testing": {
+                    "project_id": "routine_testing",
+                    "fastq_symlinks_dir": os.path.join(self.tmp_dir, name, "routine_testing"),
+                    "simplify_symlink_filenames": True,
+                    "excluded_runs": set(),
+                    "excluded_libraries": set(),
+                },
+            },
+        }
+
+    def _get_symlinks(self, config):
+        symlinks_dir = config['projects']['routine_testing']['fastq_symlinks_dir']
+        return sorted([(os.path.relpath(symlink['path'], symlinks_dir), symlink['target']) for symlink in db.get_symlinks(config)])
+
+    def test_async_scan_same_symlinks_as_sync_scan(self):
+        for run in core.scan(self.sync_config):
+            if run is not None:
+                core.symlink_run(self.sync_config, run)
+        core._last_symlink_audit_time = None
+        runs = async_core.scan(self.async_config)
+
+        self.assertEqual(sorted(self.run_ids), sorted([run['run_id'] for run in runs]))
+        self.assertEqual(self._get_symlinks(self.sync_config), self._get_symlinks(self.async_config))
+        self.assertEqual(len(self.run_ids) * 8, len(self._get_symlinks(self.async_config)))
+        self.assertEqual(db.get_run_fingerprints(self.sync_config).keys(), db.get_run_fingerprints(self.async_config).keys())
+
+    def test_async_rescan_unchanged_runs_not_replanned(self):
+        async_core.scan(self.async_config)
+        metrics.reset()
+        runs = async_core.scan(self.async_config, changed_project_ids=set())
+        counters = metrics.get_summary()['counters']
+
+        self.assertTrue(all([run['unchanged'] for run in runs]))
+        self.assertEqual(len(self.run_ids), counters['runs_not_replanned'])
+        self.assertNotIn('symlinks_created', counters)
+
+    def test_async_scan_runs_checked_concurrently(self):
+        lock = threading.Lock()
+        num_runs_in_progress = [0]
+        max_num_runs_in_progress = [0]
+        find_run = core._find_run
+
+        def slow_find_run(*args):
+            with lock:
+                num_runs_in_progress[0] += 1
+                max_num_runs_in_progress[0] = max(max_num_runs_in_progress[0], num_runs_in_progress[0])
+            time.sleep(0.1)
+            with lock:
+                num_runs_in_progress[0] -= 1
+            return find_run(*args)
+
+        with unittest.mock.patch.object(core, '_find_run', side_effect=slow_find_run):
+            runs = async_core.scan(self.async_config)
+
+        self.assertEqual(len(self.run_ids), len(runs))
+        self.assertEqual(4, max_num_runs_in_progress[0])
+
+    def test_async_scan_runs_only_scans_listed_runs(self):
+        async_core.scan(self.async_config)
+        shutil.rmtree(self.async_config['projects']['routine_testing']['fastq_symlinks_dir'])
+        db.delete_nonexistent_symlinks(self.async_config)
+        runs = async_core.scan(self.async_config, run_dir_paths=[os.path.join(self.run_parent_dir, SIMULATED_RUN_ID)])
+
+        self.assertEqual([SIMULATED_RUN_ID], [run['run_id'] for run in runs])
+        self.assertEqual({SIMULATED_RUN_ID}, {symlink['sequencing_run_id'] for symlink in db.get_symlinks(self.async_config)})
+
+    def test_async_symlink_audit_filesystem_calls_not_on_event_loop_thread(self):
+        self.async_config['write_manifests'] = True
+        audit_functions = [(core, '_find_changed_symlink_dirs'), (core, 'find_symlinks_in_dir'), (db, '_find_nonexistent_symlinks'), (manifest, 'compact_manifests')]
+        for incremental_scan in [True, False]:
+            with self.subTest(incremental_scan=incremental_scan):
+                self.async_config['incremental_scan'] = incremental_scan
+                async_core.scan(self.async_config)
+                core._last_symlink_audit_time = None
+                thread_names_by_function_name = {function_name: set() for module, function_name in audit_functions}
+                patchers = []
+                for module, function_name in audit_functions:
+                    def record_thread(*args, function=getattr(module, function_name), function_name=function_name):
+                        thread_names_by_function_name[function_name].add(threading.current_thread().name)
+                        return function(*args)
+                    patchers.append(unittest.mock.patch.object(module, function_name, side_effect=record_thread))
+                for patcher in patchers:
+                    patcher.start()
+                try:
+                    async_core.scan(self.async_config)
+                finally:
+                    for patcher in patchers:
+                        patcher.stop()
+
+                # Incremental audits only walk the symlink directories that have changed
+                self.assertTrue(thread_names_by_function_name['_find_changed_symlink_dirs' if incremental_scan else 'find_symlinks_in_dir'])
+                self.assertTrue(thread_names_by_function_name['_find_nonexistent_symlinks'])
+                self.assertTrue(thread_names_by_function_name['compact_manifests'])
+                for thread_names in thread_names_by_function_name.values():
+                    self.assertNotIn(threading.current_thread().name, thread_names)
+                self.assertEqual(self._get_symlinks(self.async_config), sorted([(os.path.relpath(symlink['path'], self.async_config['projects']['routine_testing']['fastq_symlinks_dir']), os.path.realpath(symlink['path'])) for symlink in core.find_symlinks(self.async_config['projects'])['routine_testing']]))
+
+if __name__ == '__main__':
+    unittest.main()
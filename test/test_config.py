@@ -0,0 +1,86 @@
+import json
+import logging
+import os
+import shutil
+import tempfile
+import unittest
+
+import auto_fastq_symlink.config
+
+logging.disable(logging.CRITICAL)
+
+RUN_ID = "220602_M00123_300_000000000-Q5539"
+
+class Test(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.excluded_runs_list = os.path.join(self.tmp_dir, "routine_testing_excluded_runs.csv")
+        self.excluded_libraries_list = os.path.join(self.tmp_dir, "routine_testing_excluded_libraries.csv")
+        for exclusion_list in [self.excluded_runs_list, self.excluded_libraries_list]:
+            open(exclusion_list, 'w').close()
+        self.projects_definition_file = os.path.join(self.tmp_dir, "projects.csv")
+        self._write_projects(["routine_testing"])
+        self.config_path = os.path.join(self.tmp_dir, "config.json")
+        with open(self.config_path, 'w') as f:
+            f.write(json.dumps({
+                "run_parent_dirs": [os.path.join(self.tmp_dir, "runs")],
+                "projects_definition_file": self.projects_definition_file,
+                "database_connection_uri": "sqlite:///" + os.path.join(self.tmp_dir, "symlinks.db"),
+                "fastq_extensions": [".fastq.gz"],
+            }) + '\n')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def _write_projects(self, project_ids):
+        with open(self.projects_definition_file, 'w') as f:
+            f.write("project_id,fastq_symlinks_dir,excluded_runs_list,excluded_libraries_list,simplify_symlink_filenames\n")
+            for project_id in project_ids:
+                f.write(",".join([project_id, os.path.join(self.tmp_dir, "symlinks", project_id), self.excluded_runs_list, self.excluded_libraries_list, "True"]) + "\n")
+
+    def _bump_mtime(self, path):
+        path_stat = os.stat(path)
+        os.utime(path, (path_stat.st_atime, path_stat.st_mtime + 60))
+
+    def test_config_file_stats_include_referenced_files(self):
+        config = auto_fastq_symlink.config.load_config(self.config_path)
+        config_file_stats = auto_fastq_symlink.config.get_config_file_stats(self.config_path, config)
+
+        self.assertEqual({self.config_path, self.projects_definition_file, self.excluded_runs_list, self.excluded_libraries_list}, set(config_file_stats))
+
+    def test_config_file_stats_unchanged_until_exclusion_list_changes(self):
+        config = auto_fastq_symlink.config.load_config(self.config_path)
+        first_stats = auto_fastq_symlink.config.get_config_file_stats(self.config_path, config)
+        second_stats = auto_fastq_symlink.config.get_config_file_stats(self.config_path, config)
+        with open(self.excluded_runs_list, 'w') as f:
+            f.write(RUN_ID + "\n")
+        self._bump_mtime(self.excluded_runs_list)
+        third_stats = auto_fastq_symlink.config.get_config_file_stats(self.config_path, config)
+
+        self.assertEqual(first_stats, second_stats)
+        self.assertNotEqual(first_stats, third_stats)
+
+    def test_diff_configs_exclusions_and_projects(self):
+        old_config = auto_fastq_symlink.config.load_config(self.config_path)
+        with open(self.excluded_runs_list, 'w') as f:
+            f.write(RUN_ID + "\n")
+        self._write_projects(["routine_testing", "assay_development"])
+        new_config = auto_fastq_symlink.config.load_config(self.config_path)
+        config_diff = auto_fastq_symlink.config.diff_configs(old_config, new_config)
+
+        self.assertEqual(["assay_development"], config_diff['projects_added'])
+        self.assertEqual({"routine_testing": [RUN_ID]}, config_diff['excluded_runs_added'])
+        self.assertEqual([], config_diff['settings_changed'])
+        self.assertEqual({"routine_testing", "assay_development"}, auto_fastq_symlink.config.get_changed_project_ids(config_diff))
+
+    def test_diff_configs_settings_and_translation(self):
+        old_config = auto_fastq_symlink.config.load_config(self.config_path)
+        new_config = dict(old_config, fastq_extensions=[".fastq.gz", ".fq.gz"], project_id_translation={"rt": "routine_testing"})
+        config_diff = auto_fastq_symlink.config.diff_configs(old_config, new_config)
+
+        self.assertEqual(["fastq_extensions"], config_diff['settings_changed'])
+        self.assertEqual(["rt"], config_diff['project_id_translation_changed'])
+        self.assertEqual(set(), auto_fastq_symlink.config.get_changed_project_ids(config_diff))
+
+if __name__ == '__main__':
+    unittest.main()
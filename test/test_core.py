@@ -0,0 +1,356 @@
+import json
+import logging
+import multiprocessing
+import os
+import shutil
+import tempfile
+import unittest
+
+from sqlalchemy import create_engine
+
+import auto_fastq_symlink.core as core
+import auto_fastq_symlink.db as db
+import auto_fastq_symlink.metrics as metrics
+from auto_fastq_symlink.model import Base, SequencingRunFingerprint
+
+logging.disable(logging.CRITICAL)
+
+THIS_DIR = os.path.dirname(os.path.abspath(__file__))
+SIMULATED_RUN_ID = "220602_M00123_300_000000000-Q5539"
+
+def _scan_with_scan_leases(config, barrier, results):
+    """
+    Run a scan in a separate process, as one of several scan workers sharing a database.
+    All of the workers send a heartbeat before any of them scans, so that they all know about each other.
+    """
+    logging.disable(logging.CRITICAL)
+    core.heartbeat_scan_worker(config, force=True)
+    barrier.wait()
+    run_ids = [run['run_id'] for run in core.scan(config) if run is not None]
+    results.put((config['scan_worker_id'], run_ids))
+
+class Test(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.run_parent_dir = os.path.join(self.tmp_dir, "runs")
+        self.run_dir = os.path.join(self.run_parent_dir, SIMULATED_RUN_ID)
+        shutil.copytree(os.path.join(THIS_DIR, "data", "simulated_runs", SIMULATED_RUN_ID), self.run_dir)
+        with open(os.path.join(self.run_dir, "qc_check_complete.json"), 'w') as f:
+            f.write(json.dumps({"overall_pass_fail": "PASS"}) + '\n')
+
+        connection_uri = "sqlite:///" + os.path.join(self.tmp_dir, "symlinks.db")
+        Base.metadata.create_all(create_engine(connection_uri))
+        self.config = {
+            "run_parent_dirs": [self.run_parent_dir],
+            "database_connection_uri": connection_uri,
+            "fastq_extensions": [".fastq.gz"],
+            "incremental_scan": True,
+            "project_id_translation": {},
+            "projects": {
+                "routine_testing": {
+                    "project_id": "routine_testing",
+                    "fastq_symlinks_dir": os.path.join(self.tmp_dir, "symlinks", "routine_testing"),
+                    "simplify_symlink_filenames": True,
+                    "excluded_runs": set(),
+                    "excluded_libraries": set(),
+                },
+            },
+        }
+
+        core._runs_with_failed_symlinks.clear()
+        core._last_symlink_audit_time = None
+        core._last_scan_worker_heartbeat_time = None
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def _scan_runs(self):
+        return [run for run in core.scan(self.config) if run is not None]
+
+    def test_find_runs_simulated_run_correct_num_libraries(self):
+        runs = self._scan_runs()
+
+        self.assertEqual(21, len(runs[0]['libraries']))
+
+    def test_incremental_scan_unchanged_run_not_reparsed(self):
+        self._scan_runs()
+        runs = self._scan_runs()
+
+        self.assertTrue(runs[0]['unchanged'])
+        self.assertNotIn('libraries', runs[0])
+
+    def test_incremental_scan_modified_samplesheet_reparsed(self):
+        self._scan_runs()
+        samplesheet_path = os.path.join(self.run_dir, "SampleSheet.csv")
+        samplesheet_stat = os.stat(samplesheet_path)
+        os.utime(samplesheet_path, (samplesheet_stat.st_atime, samplesheet_stat.st_mtime + 60))
+        runs = self._scan_runs()
+
+        self.assertFalse(runs[0].get('unchanged', False))
+        self.assertEqual(21, len(runs[0]['libraries']))
+
+    def test_incremental_scan_fingerprint_without_layout_reparsed_once(self):
+        self._scan_runs()
+        # A fingerprint stored before run layouts were stored
+        with db.session_scope(self.config) as session:
+            session.query(SequencingRunFingerprint).update({"layout": None, "layout_directory_mtimes": None})
+            session.commit()
+        reparsed_runs = self._scan_runs()
+        unchanged_runs = self._scan_runs()
+
+        self.assertFalse(reparsed_runs[0].get('unchanged', False))
+        self.assertEqual({}, db.get_run_fingerprints(self.config)[SIMULATED_RUN_ID]['fingerprint']['layout_directory_mtimes'])
+        self.assertTrue(unchanged_runs[0]['unchanged'])
+
+    def test_incremental_scan_stored_libraries_unchanged(self):
+        self._scan_runs()
+        self._scan_runs()
+        libraries = db.get_libraries(self.config)
+
+        self.assertEqual(21, len(libraries))
+
+    def test_find_runs_with_workers_same_order_as_sequential(self):
+        for run_num in range(1, 6):
+            run_id = SIMULATED_RUN_ID[:-1] + str(run_num)
+            shutil.copytree(self.run_dir, os.path.join(self.run_parent_dir, run_id))
+        os.makedirs(os.path.join(self.run_parent_dir, "not_a_run"))
+        sequential_runs = list(core.find_runs(self.config))
+        self.config['scan_num_workers'] = 3
+        concurrent_runs = list(core.find_runs(self.config))
+
+        self.assertEqual(7, len(concurrent_runs))
+        self.assertEqual(sequential_runs, concurrent_runs)
+        self.assertEqual(sorted(os.listdir(self.run_parent_dir)), [os.path.basename(run['run_directory']) if run else "not_a_run" for run in concurrent_runs])
+
+    def test_determine_symlinks_to_create_for_run_grouped_by_project(self):
+        self.config['projects']['assay_development'] = dict(self.config['projects']['routine_testing'], project_id="assay_development", excluded_libraries={"R4439136513-100-A-C02"})
+        self._scan_runs()
+        symlinks_to_create = core.determine_symlinks_to_create_for_run(self.config, SIMULATED_RUN_ID)
+
+        self.assertEqual(["routine_testing", "assay_development"], list(symlinks_to_create))
+        self.assertEqual(8, len(symlinks_to_create["routine_testing"]))
+        self.assertEqual(4, len(symlinks_to_create["assay_development"]))
+        self.assertEqual({"routine_testing"}, {symlink['project_id'] for symlink in symlinks_to_create["routine_testing"]})
+
+    def test_determine_symlinks_to_create_for_runs_batch(self):
+        other_run_id = SIMULATED_RUN_ID[:-1] + "1"
+        shutil.copytree(self.run_dir, os.path.join(self.run_parent_dir, other_run_id))
+        self._scan_runs()
+        symlinks_to_create_by_run_id = core.determine_symlinks_to_create_for_runs(self.config, [SIMULATED_RUN_ID, other_run_id, "unknown_run"])
+
+        self.assertEqual(8, len(symlinks_to_create_by_run_id[other_run_id]["routine_testing"]))
+        self.assertEqual(symlinks_to_create_by_run_id[SIMULATED_RUN_ID], core.determine_symlinks_to_create_for_run(self.config, SIMULATED_RUN_ID))
+        self.assertEqual({"routine_testing": []}, symlinks_to_create_by_run_id["unknown_run"])
+
+    def _make_symlinks(self, run_id, library_ids):
+        symlinks_dir = os.path.join(self.config['projects']['routine_testing']['fastq_symlinks_dir'], run_id)
+        os.makedirs(symlinks_dir, exist_ok=True)
+        for library_id in library_ids:
+            for read in ["R1", "R2"]:
+                target = os.path.join(self.run_dir, "Data", "Intensities", "BaseCalls", library_id + "_S1_L001_" + read + "_001.fastq.gz")
+                os.symlink(target, os.path.join(symlinks_dir, library_id + "_" + read + ".fastq.gz"))
+        # Make sure the directory's mtime changes, even on filesystems with coarse timestamps
+        symlinks_dir_stat = os.stat(symlinks_dir)
+        os.utime(symlinks_dir, (symlinks_dir_stat.st_atime, symlinks_dir_stat.st_mtime + 1))
+        return symlinks_dir
+
+    def _scan_and_symlink_runs(self, changed_project_ids=None):
+        runs = [run for run in core.scan(self.config, changed_project_ids) if run is not None]
+        for run in runs:
+            core.symlink_run(self.config, run)
+        return runs
+
+    def test_scan_unchanged_run_not_replanned_when_config_and_symlinks_unchanged(self):
+        self._scan_and_symlink_runs()
+        metrics.reset()
+        runs = self._scan_and_symlink_runs(changed_project_ids=set())
+
+        self.assertEqual(set(), runs[0]['replan_project_ids'])
+        self.assertEqual(1, metrics.get_summary()['counters'].get('runs_not_replanned', 0))
+
+    def test_scan_unchanged_run_with_single_ended_library_not_replanned(self):
+        # A library without an R2 fastq file has an R2 symlink planned, but with no target
+        for fastq_filename in os.listdir(os.path.join(self.run_dir, "Data", "Intensities", "BaseCalls")):
+            if fastq_filename.startswith("R4204987686-100-A-B01") and "_R2_" in fastq_filename:
+                os.remove(os.path.join(self.run_dir, "Data", "Intensities", "BaseCalls", fastq_filename))
+        self._scan_and_symlink_runs()
+        metrics.reset()
+        runs = self._scan_and_symlink_runs(changed_project_ids=set())
+
+        self.assertNotIn(SIMULATED_RUN_ID, core._runs_with_failed_symlinks)
+        self.assertEqual(set(), runs[0]['replan_project_ids'])
+        self.assertEqual(1, metrics.get_summary()['counters'].get('runs_not_replanned', 0))
+
+    def test_scan_unchanged_run_replanned_for_project_with_removed_symlink(self):
+        self._scan_and_symlink_runs()
+        symlinks_dir = os.path.join(self.config['projects']['routine_testing']['fastq_symlinks_dir'], SIMULATED_RUN_ID)
+        os.remove(os.path.join(symlinks_dir, sorted(os.listdir(symlinks_dir))[0]))
+        self._bump_mtime(symlinks_dir)
+        metrics.reset()
+        runs = self._scan_and_symlink_runs(changed_project_ids=set())
+
+        self.assertEqual({"routine_testing"}, runs[0]['replan_project_ids'])
+        self.assertEqual(1, metrics.get_summary()['counters'].get('symlinks_created', 0))
+
+    def test_created_symlinks_registered_without_audit(self):
+        self.config['symlink_audit_interval_seconds'] = 3600
+        self._scan_and_symlink_runs()
+        metrics.reset()
+        runs = self._scan_and_symlink_runs()
+        stored_symlinks = db.get_symlinks(self.config)
+        symlinks_dir = os.path.join(self.config['projects']['routine_testing']['fastq_symlinks_dir'], SIMULATED_RUN_ID)
+
+        self.assertEqual(sorted(core.find_symlinks_in_dir(symlinks_dir), key=lambda symlink: symlink['path']), sorted([{key: symlink[key] for key in ['sequencing_run_id', 'path', 'target']} for symlink in stored_symlinks], key=lambda symlink: symlink['path']))
+        self.assertEqual({os.path.basename(symlink['target']).split('_')[0] for symlink in stored_symlinks}, {symlink['library_id'] for symlink in stored_symlinks})
+        self.assertEqual(1, metrics.get_summary()['counters'].get('symlink_audits_skipped', 0))
+        self.assertEqual(0, metrics.get_summary()['counters'].get('symlinks_created', 0))
+
+    def _copy_run(self, run_num):
+        run_id = SIMULATED_RUN_ID[:-1] + str(run_num)
+        shutil.copytree(self.run_dir, os.path.join(self.run_parent_dir, run_id))
+        return run_id
+
+    def test_scan_leases_taken_over_after_release(self):
+        other_run_id = self._copy_run(1)
+        worker_a_config = dict(self.config, scan_leases=True, scan_worker_id="worker_a")
+        worker_b_config = dict(self.config, scan_leases=True, scan_worker_id="worker_b")
+        worker_a_run_ids = [run['run_id'] for run in core.scan(worker_a_config) if run is not None]
+        core._last_scan_worker_heartbeat_time = None
+        worker_b_run_ids_before_release = [run['run_id'] for run in core.scan(worker_b_config) if run is not None]
+        core.release_scan_leases(worker_a_config)
+        worker_b_run_ids_after_release = [run['run_id'] for run in core.scan(worker_b_config) if run is not None]
+
+        self.assertEqual(sorted([SIMULATED_RUN_ID, other_run_id]), sorted(worker_a_run_ids))
+        self.assertEqual([], worker_b_run_ids_before_release)
+        self.assertEqual(sorted(worker_a_run_ids), sorted(worker_b_run_ids_after_release))
+
+    def test_scan_leases_runs_split_between_processes(self):
+        run_ids = [SIMULATED_RUN_ID] + [self._copy_run(run_num) for run_num in range(1, 8)]
+        num_workers = 3
+        context = multiprocessing.get_context('spawn')
+        barrier = context.Barrier(num_workers)
+        results = context.Queue()
+        processes = []
+        for worker_num in range(num_workers):
+            worker_config = dict(self.config, scan_leases=True, scan_worker_id="worker_" + str(worker_num))
+            process = context.Process(target=_scan_with_scan_leases, args=(worker_config, barrier, results))
+            process.start()
+            processes.append(process)
+        run_ids_by_worker_id = dict([results.get(timeout=60) for _ in processes])
+        for process in processes:
+            process.join()
+        scanned_run_ids = [run_id for worker_run_ids in run_ids_by_worker_id.values() for run_id in worker_run_ids]
+
+        self.assertEqual(sorted(run_ids), sorted(scanned_run_ids))
+        self.assertGreater(len([worker_run_ids for worker_run_ids in run_ids_by_worker_id.values() if worker_run_ids]), 1)
+
+    def test_reconcile_symlinks_only_changed_dirs_rewalked(self):
+        self._make_symlinks(SIMULATED_RUN_ID, ["lib-01", "lib-02"])
+        first_counts = core.reconcile_symlinks(self.config)
+        second_counts = core.reconcile_symlinks(self.config)
+
+        self.assertEqual(4, first_counts['num_symlinks_stored'])
+        self.assertEqual(1, first_counts['num_symlink_dirs_changed'])
+        self.assertEqual(0, second_counts['num_symlink_dirs_changed'])
+        self.assertEqual(4, len(db.get_symlinks(self.config)))
+
+    def test_reconcile_symlinks_removed_symlinks_and_dirs_deleted(self):
+        symlinks_dir = self._make_symlinks(SIMULATED_RUN_ID, ["lib-01", "lib-02"])
+        core.reconcile_symlinks(self.config)
+        os.remove(os.path.join(symlinks_dir, "lib-01_R1.fastq.gz"))
+        symlinks_dir_stat = os.stat(symlinks_dir)
+        os.utime(symlinks_dir, (symlinks_dir_stat.st_atime, symlinks_dir_stat.st_mtime + 2))
+        removed_symlink_counts = core.reconcile_symlinks(self.config)
+        self.assertEqual(1, removed_symlink_counts['num_symlinks_deleted'])
+        self.assertEqual(3, len(db.get_symlinks(self.config)))
+        shutil.rmtree(symlinks_dir)
+        removed_dir_counts = core.reconcile_symlinks(self.config)
+
+        self.assertEqual(1, removed_dir_counts['num_symlink_dirs_removed'])
+        self.assertEqual([], db.get_symlinks(self.config))
+        self.assertEqual({}, db.get_symlink_directories(self.config))
+
+    def _convert_to_alignment_layout(self, analysis_timestamp):
+        alignment_fastq_dir = os.path.join(self.run_dir, "Alignment_1", analysis_timestamp, "Fastq")
+        os.makedirs(os.path.dirname(alignment_fastq_dir))
+        shutil.move(os.path.join(self.run_dir, "Data", "Intensities", "BaseCalls"), alignment_fastq_dir)
+        shutil.rmtree(os.path.join(self.run_dir, "Data"))
+        return alignment_fastq_dir
+
+    def _bump_mtime(self, path, seconds=60):
+        path_stat = os.stat(path)
+        os.utime(path, (path_stat.st_atime, path_stat.st_mtime + seconds))
+
+    def test_incremental_scan_layout_reused_when_only_samplesheet_changed(self):
+        alignment_fastq_dir = self._convert_to_alignment_layout("20220602_120000")
+        self._scan_runs()
+        self._bump_mtime(os.path.join(self.run_dir, "SampleSheet.csv"))
+        metrics.reset()
+        runs = self._scan_runs()
+
+        self.assertEqual(1, metrics.get_summary()['counters'].get('run_layouts_reused', 0))
+        self.assertEqual(alignment_fastq_dir, runs[0]['fastq_directory'])
+        self.assertEqual(21, len(runs[0]['libraries']))
+
+    def test_incremental_scan_new_alignment_detected(self):
+        self._convert_to_alignment_layout("20220602_120000")
+        self._scan_runs()
+        new_alignment_fastq_dir = os.path.join(self.run_dir, "Alignment_1", "20220603_090000", "Fastq")
+        shutil.copytree(os.path.join(self.run_dir, "Alignment_1", "20220602_120000", "Fastq"), new_alignment_fastq_dir)
+        self._bump_mtime(os.path.join(self.run_dir, "Alignment_1"))
+        metrics.reset()
+        runs = self._scan_runs()
+
+        self.assertNotIn('run_layouts_reused', metrics.get_summary()['counters'])
+        self.assertEqual(new_alignment_fastq_dir, runs[0]['fastq_directory'])
+        self.assertEqual(21, len(runs[0]['libraries']))
+
+    def test_create_symlinks_with_workers(self):
+        self.config['symlink_num_workers'] = 3
+        self.config['projects']['routine_testing']['simplify_symlink_filenames'] = False
+        fastq_dir = os.path.join(self.run_dir, "Data", "Intensities", "BaseCalls")
+        targets = sorted([os.path.join(fastq_dir, f) for f in os.listdir(fastq_dir)])[:6]
+        symlinks_dir = os.path.join(self.config['projects']['routine_testing']['fastq_symlinks_dir'], SIMULATED_RUN_ID)
+        os.makedirs(symlinks_dir)
+        os.symlink(targets[0], os.path.join(symlinks_dir, os.path.basename(targets[0])))
+        symlinks_to_create = [{"project_id": "routine_testing", "sequencing_run_id": SIMULATED_RUN_ID, "target": target} for target in targets]
+        # A filename that is too long for the filesystem, so creating the symlink fails
+        symlinks_to_create.append({"project_id": "routine_testing", "sequencing_run_id": SIMULATED_RUN_ID, "target": os.path.join(fastq_dir, "x" * 300 + ".fastq.gz")})
+        symlinks_to_create.append({"project_id": "routine_testing", "sequencing_run_id": SIMULATED_RUN_ID, "target": None})
+        metrics.reset()
+        symlinks_complete = core.create_symlinks(self.config, {"routine_testing": symlinks_to_create}, SIMULATED_RUN_ID)
+        with open(os.path.join(symlinks_dir, "symlinks_complete.json"), 'r') as f:
+            symlinks_complete_marker = json.load(f)
+
+        self.assertEqual(targets[1:], [symlink['target'] for symlink in symlinks_complete["routine_testing"]])
+        self.assertEqual(5, symlinks_complete_marker['num_symlinks_created'])
+        self.assertEqual(1, metrics.get_summary()['counters']['symlinks_failed'])
+        self.assertEqual(sorted([os.path.basename(target) for target in targets] + ["symlinks_complete.json"]), sorted(os.listdir(symlinks_dir)))
+
+    def test_index_fastq_directory_all_lanes_and_chunks_in_order(self):
+        fastq_dir = os.path.join(self.tmp_dir, "fastq")
+        os.makedirs(fastq_dir)
+        fastq_filenames = [
+            "lib-01_S1_L002_R1_001.fastq.gz",
+            "lib-01_S1_L001_R1_002.fastq.gz",
+            "lib-01_S1_L001_R1_001.fastq.gz",
+            "lib-01_S1_L001_R2_001.fastq.gz",
+            "lib-011_S2_L001_R1_001.fastq.gz",
+            "lib-01_S1_L001_I1_001.fastq.gz",
+            "lib-01_S1_L001_R1_001.txt",
+        ]
+        for fastq_filename in fastq_filenames:
+            open(os.path.join(fastq_dir, fastq_filename), 'w').close()
+        fastq_index = core._index_fastq_directory(fastq_dir, [".fastq.gz"])
+
+        expected_r1_fastq_filenames = [
+            "lib-01_S1_L001_R1_001.fastq.gz",
+            "lib-01_S1_L001_R1_002.fastq.gz",
+            "lib-01_S1_L002_R1_001.fastq.gz",
+        ]
+        self.assertEqual(expected_r1_fastq_filenames, fastq_index[("lib-01", "R1")])
+        self.assertEqual(["lib-01_S1_L001_R2_001.fastq.gz"], fastq_index[("lib-01", "R2")])
+        self.assertEqual(3, len(fastq_index))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,288 @@
+import logging
+import os
+import shutil
+import tempfile
+import unittest
+
+from sqlalchemy import text
+
+import auto_fastq_symlink.db as db
+from auto_fastq_symlink.model import *
+
+logging.disable(logging.CRITICAL)
+
+RUN_ID = "220602_M00123_300_000000000-Q5539"
+
+# Set to the URI of a throwaway PostgreSQL database (eg. `postgresql://postgres@localhost:5432/auto_fastq_symlink_test`)
+# to run the database tests against PostgreSQL as well. All tables in that database are dropped.
+POSTGRESQL_URI = os.environ.get("AUTO_FASTQ_SYMLINK_TEST_POSTGRESQL_URI")
+
+def _make_run(num_libraries, project_id="routine_testing"):
+    run = {
+        "run_id": RUN_ID,
+        "instrument_type": "miseq",
+        "parsed_samplesheet": "/runs/" + RUN_ID + "/SampleSheet.csv",
+        "run_directory": "/runs/" + RUN_ID,
+        "fastq_directory": "/runs/" + RUN_ID + "/Data/Intensities/BaseCalls",
+        "libraries": [],
+    }
+    for idx in range(num_libraries):
+        library_id = "R" + str(idx).zfill(10)
+        run['libraries'].append({
+            "library_id": library_id,
+            "project_id": project_id,
+            "fastq_path_r1": os.path.join(run['fastq_directory'], library_id + "_S" + str(idx) + "_L001_R1_001.fastq.gz"),
+            "fastq_path_r2": os.path.join(run['fastq_directory'], library_id + "_S" + str(idx) + "_L001_R2_001.fastq.gz"),
+        })
+
+    return run
+
+class Test(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.config = {
+            "database_connection_uri": "sqlite:///" + os.path.join(self.tmp_dir, "symlinks.db"),
+        }
+        Base.metadata.create_all(db.init_db(self.config))
+
+    def tearDown(self):
+        db.dispose_db()
+        shutil.rmtree(self.tmp_dir)
+
+    def test_store_run_stores_all_libraries(self):
+        db.store_run(self.config, _make_run(96))
+        libraries = db.get_libraries(self.config)
+
+        self.assertEqual(96, len(libraries))
+
+    def test_store_run_twice_only_changed_libraries_written(self):
+        run = _make_run(10)
+        db.store_run(self.config, run)
+        run['libraries'][3]['project_id'] = "assay_development"
+        with db.session_scope(self.config) as session:
+            num_libraries_written = db.store_libraries(session, run)
+            session.commit()
+
+        self.assertEqual(1, num_libraries_written)
+
+    def test_store_run_updates_changed_library(self):
+        run = _make_run(10)
+        db.store_run(self.config, run)
+        run['libraries'][3]['project_id'] = "assay_development"
+        db.store_run(self.config, run)
+        libraries = db.get_libraries_by_project_id(self.config, "assay_development")
+
+        self.assertEqual([run['libraries'][3]['library_id']], [library['library_id'] for library in libraries])
+
+    def test_store_run_updates_samplesheet(self):
+        run = _make_run(1)
+        db.store_run(self.config, run)
+        run['parsed_samplesheet'] = "/runs/" + RUN_ID + "/SampleSheet_updated.csv"
+        db.store_run(self.config, run)
+        with db.session_scope(self.config) as session:
+            stored_runs = session.query(SequencingRun).all()
+            stored_samplesheets = [stored_run.samplesheet for stored_run in stored_runs]
+
+        self.assertEqual([run['parsed_samplesheet']], stored_samplesheets)
+
+    def _make_symlinks(self, num_symlinks):
+        symlinks = []
+        for idx in range(num_symlinks):
+            library_id = "R" + str(idx).zfill(10)
+            symlinks.append({
+                "sequencing_run_id": RUN_ID,
+                "path": os.path.join("/symlinks", RUN_ID, library_id + "_R1.fastq.gz"),
+                "target": os.path.join("/runs", RUN_ID, library_id + "_S1_L001_R1_001.fastq.gz"),
+            })
+
+        return symlinks
+
+    def test_store_symlinks_in_chunks_only_new_symlinks_stored(self):
+        self.config['symlink_chunk_size'] = 3
+        symlinks = self._make_symlinks(10)
+        db.store_symlinks(self.config, {"routine_testing": symlinks[:4]})
+        counts = db.store_symlinks_in_chunks(self.config, (("routine_testing", symlink) for symlink in symlinks + symlinks[8:]))
+        stored_symlinks = db.get_symlinks(self.config)
+
+        self.assertEqual({"num_symlinks_found": 12, "num_symlinks_stored": 6}, counts)
+        self.assertEqual(sorted([symlink['path'] for symlink in symlinks]), sorted([symlink['path'] for symlink in stored_symlinks]))
+        self.assertEqual("R0000000003", [symlink for symlink in stored_symlinks if symlink['path'] == symlinks[3]['path']][0]['library_id'])
+
+    def test_register_symlinks_only_up_to_date_dirs_recorded(self):
+        symlinks = [dict(symlink, library_id="lib-" + str(idx)) for idx, symlink in enumerate(self._make_symlinks(4))]
+        symlink_dirs = []
+        for idx, previous_directory_mtime in enumerate([None, 100.0, 200.0]):
+            symlink_dirs.append({
+                "path": os.path.join("/symlinks", "run_" + str(idx)),
+                "project_id": "routine_testing",
+                "sequencing_run_id": "run_" + str(idx),
+                "directory_mtime": 300.0,
+                "previous_directory_mtime": previous_directory_mtime,
+            })
+        with db.session_scope(self.config) as session:
+            for symlink_dir in symlink_dirs[1:]:
+                session.add(SymlinkDirectory(path=symlink_dir['path'], project_id="routine_testing", sequencing_run_id=symlink_dir['sequencing_run_id'], directory_mtime=100.0))
+            session.commit()
+        db.register_symlinks(self.config, {"routine_testing": symlinks[:2]})
+        num_symlinks_stored = db.register_symlinks(self.config, {"routine_testing": symlinks}, symlink_dirs)
+        symlink_dir_mtimes = {path: symlink_dir['directory_mtime'] for path, symlink_dir in db.get_symlink_directories(self.config).items()}
+
+        self.assertEqual(2, num_symlinks_stored)
+        self.assertEqual(["lib-0", "lib-1", "lib-2", "lib-3"], sorted([symlink['library_id'] for symlink in db.get_symlinks(self.config)]))
+        self.assertEqual({"/symlinks/run_0": 300.0, "/symlinks/run_1": 300.0, "/symlinks/run_2": 100.0}, symlink_dir_mtimes)
+
+    def test_claim_scan_leases_preferred_or_offered(self):
+        claimed_by_a = db.claim_scan_leases(self.config, ["run_1", "run_2"], "worker_a", 60, {"run_1"})
+        claimed_by_b = db.claim_scan_leases(self.config, ["run_1", "run_2", "run_3"], "worker_b", 60, {"run_2"})
+        renewed_by_a = db.claim_scan_leases(self.config, ["run_1", "run_2", "run_3"], "worker_a", 60, set())
+
+        self.assertEqual({"run_1"}, claimed_by_a)
+        self.assertEqual({"run_2"}, claimed_by_b)
+        self.assertEqual({"run_1"}, renewed_by_a)
+
+    def test_expired_scan_leases_stolen_unless_heartbeat_sent(self):
+        db.claim_scan_leases(self.config, ["run_1", "run_2"], "worker_a", -1, {"run_1", "run_2"})
+        stolen_by_b = db.claim_scan_leases(self.config, ["run_1"], "worker_b", 60, set())
+        db.heartbeat_scan_worker(self.config, "worker_a", "host_a", 60)
+        not_stolen_by_c = db.claim_scan_leases(self.config, ["run_2"], "worker_c", 60, set())
+
+        self.assertEqual({"run_1"}, stolen_by_b)
+        self.assertEqual(set(), not_stolen_by_c)
+        self.assertEqual(["worker_a"], db.get_live_scan_worker_ids(self.config, 60))
+
+    def test_released_scan_leases_claimed_by_any_worker(self):
+        db.heartbeat_scan_worker(self.config, "worker_a", "host_a", 60)
+        db.claim_scan_leases(self.config, ["run_1"], "worker_a", 60, {"run_1"})
+        db.release_scan_leases(self.config, "worker_a")
+
+        self.assertEqual({"run_1"}, db.claim_scan_leases(self.config, ["run_1"], "worker_b", 60, set()))
+        self.assertEqual([], db.get_live_scan_worker_ids(self.config, 60))
+
+    def test_delete_nonexistent_symlinks_in_chunks(self):
+        self.config['symlink_chunk_size'] = 4
+        db.store_symlinks(self.config, {"routine_testing": self._make_symlinks(10)})
+        counts = db.delete_nonexistent_symlinks(self.config)
+
+        self.assertEqual(10, counts['num_symlinks_checked'])
+        self.assertEqual(10, counts['num_symlinks_deleted'])
+        self.assertEqual([], db.get_symlinks(self.config))
+
+    def test_delete_symlinks_counts_only_deleted_rows(self):
+        self.config['symlink_chunk_size'] = 4
+        symlinks = self._make_symlinks(10)
+        db.store_symlinks(self.config, {"routine_testing": symlinks})
+        path_target_tuples = [(symlink['path'], symlink['target']) for symlink in symlinks]
+        # eg. another process deleted some of the symlinks between finding and deleting them
+        db._delete_symlinks(self.config, path_target_tuples[:3])
+
+        self.assertEqual(7, db._delete_symlinks(self.config, path_target_tuples))
+        self.assertEqual(0, db._delete_symlinks(self.config, path_target_tuples))
+
+    def test_delete_nonexistent_symlinks(self):
+        targets_dir = os.path.join(self.tmp_dir, "fastq")
+        symlinks_dir = os.path.join(self.tmp_dir, "symlinks", RUN_ID)
+        os.makedirs(targets_dir)
+        os.makedirs(symlinks_dir)
+        symlinks = []
+        for library_id in ["lib-01", "lib-02", "lib-03"]:
+            target = os.path.join(targets_dir, library_id + "_S1_L001_R1_001.fastq.gz")
+            open(target, 'w').close()
+            path = os.path.join(symlinks_dir, library_id + "_R1.fastq.gz")
+            os.symlink(target, path)
+            symlinks.append({"sequencing_run_id": RUN_ID, "path": path, "target": target})
+        db.store_symlinks(self.config, {"routine_testing": symlinks})
+        os.remove(symlinks[1]['path'])
+        os.remove(symlinks[2]['target'])
+        self.config['scan_num_workers'] = 2
+        counts = db.delete_nonexistent_symlinks(self.config)
+
+        self.assertEqual(3, counts['num_symlinks_checked'])
+        self.assertEqual(2, counts['num_symlinks_deleted'])
+        self.assertEqual([symlinks[0]['path']], [symlink['path'] for symlink in db.get_symlinks(self.config)])
+
+    def test_delete_nonexistent_symlinks_keeps_other_targets_for_same_path(self):
+        targets_dir = os.path.join(self.tmp_dir, "fastq")
+        symlinks_dir = os.path.join(self.tmp_dir, "symlinks", RUN_ID)
+        os.makedirs(targets_dir)
+        os.makedirs(symlinks_dir)
+        path = os.path.join(symlinks_dir, "lib-01_R1.fastq.gz")
+        symlinks = []
+        for target_filename in ["lib-01_S1_L001_R1_001.fastq.gz", "lib-01_S2_L001_R1_001.fastq.gz"]:
+            target = os.path.join(targets_dir, target_filename)
+            open(target, 'w').close()
+            symlinks.append({"sequencing_run_id": RUN_ID, "path": path, "target": target})
+        os.symlink(symlinks[0]['target'], path)
+        db.store_symlinks(self.config, {"routine_testing": symlinks})
+        os.remove(symlinks[1]['target'])
+        counts = db.delete_nonexistent_symlinks(self.config)
+
+        self.assertEqual(1, counts['num_symlinks_deleted'])
+        self.assertEqual([(path, symlinks[0]['target'])], [(symlink['path'], symlink['target']) for symlink in db.get_symlinks(self.config)])
+
+class TestSQLitePerformanceMode(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.config = {
+            "database_connection_uri": "sqlite:///" + os.path.join(self.tmp_dir, "symlinks.db"),
+            "sqlite_performance_mode": True,
+            "sqlite_pragmas": {"cache_size": -1024},
+        }
+        Base.metadata.create_all(db.init_db(self.config))
+
+    def tearDown(self):
+        db.dispose_db()
+        shutil.rmtree(self.tmp_dir)
+
+    def test_pragmas_applied_to_connections(self):
+        with db.session_scope(self.config) as session:
+            journal_mode = session.execute(text("PRAGMA journal_mode")).scalar()
+            synchronous = session.execute(text("PRAGMA synchronous")).scalar()
+            cache_size = session.execute(text("PRAGMA cache_size")).scalar()
+
+        self.assertEqual("wal", journal_mode)
+        self.assertEqual(1, synchronous)
+        self.assertEqual(-1024, cache_size)
+
+    def test_sessions_share_one_connection(self):
+        connection_ids = []
+        for _ in range(3):
+            with db.session_scope(self.config) as session:
+                connection_ids.append(id(session.connection().connection.dbapi_connection))
+            db.store_run(self.config, _make_run(2))
+
+        self.assertEqual(1, len(set(connection_ids)))
+
+    def test_invalid_pragma_rejected(self):
+        self.config['sqlite_pragmas'] = {"journal_mode": "WAL; DROP TABLE symlink"}
+
+        with self.assertRaises(ValueError):
+            db.init_db(self.config)
+
+@unittest.skipUnless(POSTGRESQL_URI, "AUTO_FASTQ_SYMLINK_TEST_POSTGRESQL_URI is not set")
+class TestPostgreSQL(Test):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.config = {
+            "database_connection_uri": POSTGRESQL_URI,
+        }
+        engine = db.init_db(self.config)
+        Base.metadata.drop_all(engine)
+        Base.metadata.create_all(engine)
+        # PostgreSQL enforces the symlink table's foreign key to the project table.
+        db.store_projects(self.config, {"routine_testing": {"fastq_symlinks_dir": "/symlinks"}})
+
+    def tearDown(self):
+        Base.metadata.drop_all(db.init_db(self.config))
+        db.dispose_db()
+        shutil.rmtree(self.tmp_dir)
+
+    def test_symlinks_stored_with_copy(self):
+        with db.session_scope(self.config) as session:
+            num_symlinks_stored = db._copy_symlinks(session, [db._make_symlink_row("routine_testing", RUN_ID, symlink['path'], symlink['target']) for symlink in self._make_symlinks(5) * 2])
+            session.commit()
+
+        self.assertEqual(5, num_symlinks_stored)
+        self.assertEqual(5, len(db.get_symlinks(self.config)))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,196 @@
+import json
+import logging
+import multiprocessing
+import os
+import shutil
+import tempfile
+import unittest
+import unittest.mock
+
+from sqlalchemy import create_engine
+
+import auto_fastq_symlink.core as core
+import auto_fastq_symlink.db as db
+import auto_fastq_symlink.manifest as manifest
+from auto_fastq_symlink.model import Base
+
+logging.disable(logging.CRITICAL)
+
+THIS_DIR = os.path.dirname(os.path.abspath(__file__))
+SIMULATED_RUN_ID = "220602_M00123_300_000000000-Q5539"
+
+def _compact_manifest(config, project_id, compaction_started):
+    """
+    Compact a manifest in a separate process, as the worker that holds the symlink audit lease would.
+    """
+    logging.disable(logging.CRITICAL)
+    compaction_started.set()
+    manifest.compact_manifest(config, project_id)
+
+class Test(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.run_parent_dir = os.path.join(self.tmp_dir, "runs")
+        self.run_dir = os.path.join(self.run_parent_dir, SIMULATED_RUN_ID)
+        shutil.copytree(os.path.join(THIS_DIR, "data", "simulated_runs", SIMULATED_RUN_ID), self.run_dir)
+        with open(os.path.join(self.run_dir, "qc_check_complete.json"), 'w') as f:
+            f.write(json.dumps({"overall_pass_fail": "PASS"}) + '\n')
+
+        connection_uri = "sqlite:///" + os.path.join(self.tmp_dir, "symlinks.db")
+        Base.metadata.create_all(create_engine(connection_uri))
+        self.config = {
+            "run_parent_dirs": [self.run_parent_dir],
+            "database_connection_uri": connection_uri,
+            "fastq_extensions": [".fastq.gz"],
+            "incremental_scan": True,
+            "write_manifests": True,
+            "project_id_translation": {},
+            "projects": {
+                "routine_testing": {
+                    "project_id": "routine_testing",
+                    "fastq_symlinks_dir": os.path.join(self.tmp_dir, "symlinks", "routine_testing"),
+                    "simplify_symlink_filenames": True,
+                    "excluded_runs": set(),
+                    "excluded_libraries": set(),
+                },
+            },
+        }
+        self.manifest_path = manifest.get_manifest_path(self.config, "routine_testing")
+        self.symlinks_dir = os.path.join(self.config['projects']['routine_testing']['fastq_symlinks_dir'], SIMULATED_RUN_ID)
+
+        core._runs_with_failed_symlinks.clear()
+        core._last_symlink_audit_time = None
+
+    def tearDown(self):
+        db.dispose_db()
+        shutil.rmtree(self.tmp_dir)
+
+    def _scan_and_symlink_runs(self):
+        for run in core.scan(self.config):
+            if run is not None:
+                core.symlink_run(self.config, run)
+
+    def test_created_symlinks_appended_to_manifest(self):
+        self._scan_and_symlink_runs()
+        rows = manifest.read_manifest(self.manifest_path)
+
+        self.assertEqual(4, len(rows))
+        self.assertEqual({SIMULATED_RUN_ID}, {row['sequencing_run_id'] for row in rows})
+        for row in rows:
+            self.assertEqual(os.path.realpath(row['symlink_path_r1']), os.path.realpath(row['target_r1']))
+            self.assertIn("_R1_", os.path.basename(row['target_r1']))
+            self.assertIn("_R2_", os.path.basename(row['target_r2']))
+            self.assertTrue(row['library_id'] in os.path.basename(row['symlink_path_r2']))
+
+    def test_compaction_drops_removed_symlinks_and_keeps_timestamps(self):
+        self._scan_and_symlink_runs()
+        rows = manifest.read_manifest(self.manifest_path)
+        removed_row = rows[0]
+        os.remove(removed_row['symlink_path_r1'])
+        os.remove(removed_row['symlink_path_r2'])
+        symlinks_dir_stat = os.stat(self.symlinks_dir)
+        os.utime(self.symlinks_dir, (symlinks_dir_stat.st_atime, symlinks_dir_stat.st_mtime + 1))
+        # A duplicate row, and a partially-written last line
+        with open(self.manifest_path, 'a') as f:
+            f.write(json.dumps(dict(rows[1], timestamp_added="2000-01-01T00:00:00")) + '\n' + '{"sequencing_run_id": ')
+        self.config['projects']['routine_testing']['excluded_libraries'] = {removed_row['library_id']}
+        for run in core.scan(self.config):
+            pass
+        compacted_rows = manifest.read_manifest(self.manifest_path)
+
+        self.assertEqual(rows[1:], compacted_rows)
+        self.assertFalse(os.path.exists(os.path.join(os.path.dirname(self.manifest_path), ".manifest.jsonl.tmp")))
+
+    def test_appended_rows_unchanged_by_compaction(self):
+        # Runs found through a symlinked run parent dir, so the symlinks' targets are resolved when they're stored
+        run_parent_dir_link = os.path.join(self.tmp_dir, "runs_link")
+        os.symlink(self.run_parent_dir, run_parent_dir_link)
+        self.config['run_parent_dirs'] = [run_parent_dir_link]
+        self._scan_and_symlink_runs()
+        appended_rows = manifest.read_manifest(self.manifest_path)
+        compaction_counts = manifest.compact_manifest(self.config, "routine_testing")
+
+        self.assertFalse(compaction_counts['manifest_rewritten'])
+        self.assertEqual(appended_rows, manifest.read_manifest(self.manifest_path))
+        self.assertTrue(all([row['target_r1'].startswith(os.path.realpath(self.run_parent_dir)) for row in appended_rows]))
+
+    def test_append_waits_for_manifest_lock(self):
+        self._scan_and_symlink_runs()
+        rows = manifest.read_manifest(self.manifest_path)
+        symlinks = db.get_symlinks_by_project_id(self.config, "routine_testing")
+        # POSIX locks are held by the process, so the append has to come from another process.
+        append_process = multiprocessing.get_context('fork').Process(target=manifest.append_to_manifest, args=(self.config, "routine_testing", symlinks))
+        with manifest._lock_manifest(self.manifest_path):
+            append_process.start()
+            append_process.join(timeout=0.5)
+            self.assertTrue(append_process.is_alive())
+            self.assertEqual(rows, manifest.read_manifest(self.manifest_path))
+        append_process.join(timeout=10)
+
+        self.assertEqual(0, append_process.exitcode)
+        self.assertEqual(8, len(manifest.read_manifest(self.manifest_path)))
+
+    def test_compaction_between_register_and_append_no_duplicate_rows(self):
+        context = multiprocessing.get_context('spawn')
+        compaction_started = context.Event()
+        compaction_processes = []
+        register_created_symlinks = core.register_created_symlinks
+
+        def register_then_compact(*args):
+            symlinks_registered = register_created_symlinks(*args)
+            compaction_process = context.Process(target=_compact_manifest, args=(self.config, "routine_testing", compaction_started))
+            compaction_process.start()
+            compaction_processes.append(compaction_process)
+            compaction_started.wait(timeout=30)
+            # Give the compaction a chance to run before the rows are appended
+            compaction_process.join(timeout=1)
+            return symlinks_registered
+
+        with unittest.mock.patch.object(core, 'register_created_symlinks', side_effect=register_then_compact):
+            self._scan_and_symlink_runs()
+        for compaction_process in compaction_processes:
+            compaction_process.join(timeout=30)
+        rows = manifest.read_manifest(self.manifest_path)
+
+        self.assertEqual([0], [compaction_process.exitcode for compaction_process in compaction_processes])
+        self.assertEqual(4, len(rows))
+        self.assertEqual(4, len({(row['sequencing_run_id'], row['library_id']) for row in rows}))
+
+    def test_compaction_unchanged_manifest_not_rewritten(self):
+        self._scan_and_symlink_runs()
+        manifest.compact_manifest(self.config, "routine_testing")
+        compaction_counts = manifest.compact_manifest(self.config, "routine_testing")
+
+        self.assertEqual({"num_rows_before": 4, "num_rows": 4, "manifest_rewritten": False, "snapshot_written": False}, compaction_counts)
+
+    def test_compaction_rows_split_across_symlink_chunks(self):
+        self._scan_and_symlink_runs()
+        rows = manifest.read_manifest(self.manifest_path)
+        with open(self.manifest_path, 'a') as f:
+            f.write(json.dumps(rows[0]) + '\n')
+        # Each row has two symlinks, so some rows are split between chunks
+        self.config['symlink_chunk_size'] = 3
+        compaction_counts = manifest.compact_manifest(self.config, "routine_testing")
+
+        self.assertEqual({"num_rows_before": 5, "num_rows": 4, "manifest_rewritten": True, "snapshot_written": False}, compaction_counts)
+        self.assertEqual(rows, manifest.read_manifest(self.manifest_path))
+
+    @unittest.skipIf(manifest.pyarrow is None, "pyarrow is not installed")
+    def test_parquet_snapshot_matches_manifest(self):
+        self.config['symlink_chunk_size'] = 3
+        self.config['manifest_snapshot_format'] = "parquet"
+        self._scan_and_symlink_runs()
+        manifest.compact_manifest(self.config, "routine_testing")
+        snapshot_path = os.path.join(os.path.dirname(self.manifest_path), "manifest.parquet")
+        snapshot_rows = manifest.pyarrow.parquet.read_table(snapshot_path).to_pylist()
+
+        self.assertEqual(manifest.read_manifest(self.manifest_path), snapshot_rows)
+
+    def test_unsupported_snapshot_format_rejected(self):
+        self.config['manifest_snapshot_format'] = "csv"
+
+        with self.assertRaises(ValueError):
+            manifest.compact_manifest(self.config, "routine_testing")
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,56 @@
+import logging
+import os
+import shutil
+import tempfile
+import unittest
+
+import auto_fastq_symlink.metrics as metrics
+
+logging.disable(logging.CRITICAL)
+
+class Test(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        metrics.reset()
+
+    def tearDown(self):
+        metrics.reset()
+        shutil.rmtree(self.tmp_dir)
+
+    def test_counters_and_histograms_summarized(self):
+        metrics.increment("runs_found")
+        metrics.increment("runs_found", 2)
+        metrics.observe("store_run_seconds", 0.5)
+        metrics.observe("store_run_seconds", 1.5)
+        with metrics.timer("parse_samplesheet"):
+            pass
+        summary = metrics.get_summary()
+
+        self.assertEqual({"runs_found": 3}, summary['counters'])
+        self.assertEqual({"count": 2, "sum": 2.0, "min": 0.5, "max": 1.5, "mean": 1.0}, summary['histograms']['store_run_seconds'])
+        self.assertEqual(1, summary['histograms']['parse_samplesheet_seconds']['count'])
+
+    def test_reset_clears_metrics(self):
+        metrics.increment("runs_found")
+        metrics.reset()
+
+        self.assertEqual({"counters": {}, "histograms": {}}, metrics.get_summary())
+
+    def test_write_prometheus_textfile(self):
+        metrics.increment("symlinks_created", 4)
+        metrics.observe("store_run_seconds", 0.02)
+        metrics.observe("store_run_seconds", 2.0)
+        textfile_path = os.path.join(self.tmp_dir, "auto_fastq_symlink.prom")
+        metrics.write_prometheus_textfile(textfile_path, {"scan_duration_seconds": 12.5})
+        with open(textfile_path, 'r') as f:
+            lines = f.read().splitlines()
+
+        self.assertIn("auto_fastq_symlink_scan_duration_seconds 12.5", lines)
+        self.assertIn("auto_fastq_symlink_symlinks_created 4", lines)
+        self.assertIn('auto_fastq_symlink_store_run_seconds_bucket{le="0.05"} 1', lines)
+        self.assertIn('auto_fastq_symlink_store_run_seconds_bucket{le="+Inf"} 2', lines)
+        self.assertIn("auto_fastq_symlink_store_run_seconds_count 2", lines)
+        self.assertFalse(os.path.exists(textfile_path + ".tmp"))
+
+if __name__ == '__main__':
+    unittest.main()
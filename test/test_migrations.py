@@ -0,0 +1,99 @@
+import logging
+import os
+import shutil
+import tempfile
+import unittest
+
+import alembic.command
+import alembic.config
+import alembic.util.exc
+from alembic.autogenerate import compare_metadata
+from alembic.migration import MigrationContext
+from sqlalchemy import create_engine, text
+
+from auto_fastq_symlink.model import Base
+
+THIS_DIR = os.path.dirname(os.path.abspath(__file__))
+ALEMBIC_INI = os.path.join(THIS_DIR, "..", "alembic.ini")
+
+# See test_db.py. All tables in this database are dropped.
+POSTGRESQL_URI = os.environ.get("AUTO_FASTQ_SYMLINK_TEST_POSTGRESQL_URI")
+
+class Test(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.connection_uri = self.get_connection_uri()
+        self.alembic_config = alembic.config.Config(ALEMBIC_INI)
+        self.alembic_config.set_main_option("script_location", os.path.join(THIS_DIR, "..", "alembic"))
+        self.alembic_config.set_main_option("sqlalchemy.url", self.connection_uri)
+        # Don't let alembic.ini's logging config override the test logging setup
+        self.alembic_config.config_file_name = None
+
+    def get_connection_uri(self):
+        return "sqlite:///" + os.path.join(self.tmp_dir, "symlinks.db")
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def _get_diffs_from_model(self):
+        engine = create_engine(self.connection_uri)
+        with engine.connect() as connection:
+            diffs = compare_metadata(MigrationContext.configure(connection), Base.metadata)
+        engine.dispose()
+
+        return diffs
+
+    def _make_autogenerated_database(self, revision):
+        # As if the tables had been created by a deployment's own autogenerated revision, which these migrations don't know about
+        alembic.command.upgrade(self.alembic_config, revision)
+        engine = create_engine(self.connection_uri)
+        with engine.begin() as connection:
+            connection.execute(text("UPDATE alembic_version SET version_num = 'a0b1c2d3e4f5'"))
+        engine.dispose()
+
+    def test_migrations_match_model(self):
+        alembic.command.upgrade(self.alembic_config, "head")
+
+        self.assertEqual([], self._get_diffs_from_model())
+
+    def test_upgrade_from_autogenerated_init_revision(self):
+        self._make_autogenerated_database("3f1c2a9b7d10")
+        with self.assertRaises(alembic.util.exc.CommandError):
+            alembic.command.upgrade(self.alembic_config, "head")
+        alembic.command.stamp(self.alembic_config, "3f1c2a9b7d10", purge=True)
+        alembic.command.upgrade(self.alembic_config, "head")
+
+        self.assertEqual([], self._get_diffs_from_model())
+
+    def test_upgrade_from_autogenerated_revision_with_fingerprint_tables(self):
+        self._make_autogenerated_database("8b4e6d2c5a31")
+        alembic.command.stamp(self.alembic_config, "8b4e6d2c5a31", purge=True)
+        alembic.command.upgrade(self.alembic_config, "head")
+
+        self.assertEqual([], self._get_diffs_from_model())
+
+    def test_migrations_downgrade_to_base(self):
+        alembic.command.upgrade(self.alembic_config, "head")
+        alembic.command.downgrade(self.alembic_config, "base")
+        engine = create_engine(self.connection_uri)
+        with engine.connect() as connection:
+            table_names = engine.dialect.get_table_names(connection)
+        engine.dispose()
+
+        self.assertEqual(["alembic_version"], table_names)
+
+@unittest.skipUnless(POSTGRESQL_URI, "AUTO_FASTQ_SYMLINK_TEST_POSTGRESQL_URI is not set")
+class TestPostgreSQL(Test):
+    def get_connection_uri(self):
+        return POSTGRESQL_URI
+
+    def tearDown(self):
+        alembic.command.downgrade(self.alembic_config, "base")
+        engine = create_engine(self.connection_uri)
+        with engine.begin() as connection:
+            connection.execute(text("DROP TABLE IF EXISTS alembic_version"))
+        engine.dispose()
+        shutil.rmtree(self.tmp_dir)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -62,10 +62,36 @@ class Test(unittest.TestCase):
 
         self.assertTrue(all(has_project_id))
 
+    def test_parse_samplesheet_nextseq_valid_01_all_bclconvert_settings_parsed(self):
+        samplesheet_path = os.path.join(THIS_DIR, "data", "samplesheets", "SampleSheet_nextseq_v1_valid_01.csv")
+        samplesheet = ss.parse_samplesheet_nextseq(samplesheet_path)
+        bclconvert_settings = samplesheet['bclconvert_settings']
+
+        self.assertEqual(['software_version', 'adapter_read1', 'adapter_read2', 'fastq_compression_format'], list(bclconvert_settings.keys()))
+
+    def test_parse_samplesheet_nextseq_valid_01_cloud_settings_end_at_cloud_data(self):
+        samplesheet_path = os.path.join(THIS_DIR, "data", "samplesheets", "SampleSheet_nextseq_v1_valid_01.csv")
+        samplesheet = ss.parse_samplesheet_nextseq(samplesheet_path)
+
+        self.assertEqual({'generated_version': '0.10.1.202102231441'}, samplesheet['cloud_settings'])
+
     def test_parse_samplesheet_nextseq_invalid_01_throws(self):
         samplesheet_path = os.path.join(THIS_DIR, "data", "samplesheets", "SampleSheet_nextseq_v1_invalid_01.csv")
 
         self.assertRaises(jsonschema.ValidationError, ss.parse_samplesheet_nextseq, samplesheet_path)
 
+    def test_samplesheet_validator_reused(self):
+        validator_1 = ss._get_samplesheet_validator("samplesheet_miseq_v1")
+        validator_2 = ss._get_samplesheet_validator("samplesheet_miseq_v1")
+
+        self.assertIs(validator_1, validator_2)
+
+    def test_reload_samplesheet_schemas_rebuilds_validator(self):
+        validator_1 = ss._get_samplesheet_validator("samplesheet_miseq_v1")
+        ss.reload_samplesheet_schemas()
+        validator_2 = ss._get_samplesheet_validator("samplesheet_miseq_v1")
+
+        self.assertIsNot(validator_1, validator_2)
+
 if __name__ == '__main__':
     unittest.main()
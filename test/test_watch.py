@@ -0,0 +1,148 @@
+import json
+import logging
+import os
+import shutil
+import tempfile
+import unittest
+
+import auto_fastq_symlink.watch as watch
+
+logging.disable(logging.CRITICAL)
+
+SIMULATED_RUN_ID = "220602_M00123_300_000000000-Q5539"
+
+class Test(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.run_parent_dir = os.path.join(self.tmp_dir, "runs")
+        os.makedirs(self.run_parent_dir)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def _make_run_dir(self, run_id):
+        run_dir = os.path.join(self.run_parent_dir, run_id)
+        os.makedirs(run_dir)
+        return run_dir
+
+    def _touch(self, path, mtime_offset_seconds=0):
+        with open(path, 'w') as f:
+            f.write(json.dumps({"overall_pass_fail": "PASS"}) + '\n')
+        # Make sure the directory's mtime changes, even on filesystems with coarse timestamps
+        parent_dir = os.path.dirname(path)
+        parent_dir_stat = os.stat(parent_dir)
+        os.utime(parent_dir, (parent_dir_stat.st_atime, parent_dir_stat.st_mtime + 1 + mtime_offset_seconds))
+
+    def test_polling_watcher_existing_runs_ignored(self):
+        run_dir = self._make_run_dir(SIMULATED_RUN_ID)
+        self._touch(os.path.join(run_dir, "upload_complete.json"))
+        watcher = watch.PollingRunWatcher([self.run_parent_dir])
+
+        self.assertEqual([], watcher.poll())
+
+    def test_polling_watcher_marker_file_in_existing_run_dir(self):
+        run_dir = self._make_run_dir(SIMULATED_RUN_ID)
+        watcher = watch.PollingRunWatcher([self.run_parent_dir])
+        self._touch(os.path.join(run_dir, "qc_check_complete.json"))
+
+        self.assertEqual([run_dir], watcher.poll())
+        self.assertEqual([], watcher.poll())
+
+    def test_polling_watcher_marker_file_in_new_run_dir(self):
+        watcher = watch.PollingRunWatcher([self.run_parent_dir])
+        self.assertEqual([], watcher.poll())
+        run_dir = self._make_run_dir(SIMULATED_RUN_ID)
+        parent_dir_stat = os.stat(self.run_parent_dir)
+        os.utime(self.run_parent_dir, (parent_dir_stat.st_atime, parent_dir_stat.st_mtime + 1))
+        self.assertEqual([], watcher.poll())
+        self._touch(os.path.join(run_dir, "upload_complete.json"))
+
+        self.assertEqual([run_dir], watcher.wait_for_runs(0))
+
+    def test_polling_watcher_run_dir_not_watched_after_all_marker_files(self):
+        run_dir = self._make_run_dir(SIMULATED_RUN_ID)
+        watcher = watch.PollingRunWatcher([self.run_parent_dir])
+        self._touch(os.path.join(run_dir, "upload_complete.json"))
+        self._touch(os.path.join(run_dir, "qc_check_complete.json"), mtime_offset_seconds=1)
+        self.assertEqual([run_dir], watcher.poll())
+        self._touch(os.path.join(run_dir, "other_file.json"), mtime_offset_seconds=2)
+
+        self.assertEqual([], watcher.poll())
+
+    def test_polling_watcher_new_run_dir_with_all_marker_files(self):
+        watcher = watch.PollingRunWatcher([self.run_parent_dir])
+        # eg. a finished run that is moved into place
+        run_dir = self._make_run_dir(SIMULATED_RUN_ID)
+        self._touch(os.path.join(run_dir, "upload_complete.json"))
+        self._touch(os.path.join(run_dir, "qc_check_complete.json"))
+        parent_dir_stat = os.stat(self.run_parent_dir)
+        os.utime(self.run_parent_dir, (parent_dir_stat.st_atime, parent_dir_stat.st_mtime + 1))
+
+        self.assertEqual([run_dir], watcher.poll())
+        self.assertEqual([], watcher.poll())
+
+    def test_polling_watcher_marker_file_written_in_two_steps(self):
+        run_dir = self._make_run_dir(SIMULATED_RUN_ID)
+        watcher = watch.PollingRunWatcher([self.run_parent_dir])
+        qc_check_complete_path = os.path.join(run_dir, "qc_check_complete.json")
+        with open(qc_check_complete_path, 'w') as f:
+            f.write('{"overall_pass_fail": ')
+            f.flush()
+            run_dir_stat = os.stat(run_dir)
+            os.utime(run_dir, (run_dir_stat.st_atime, run_dir_stat.st_mtime + 1))
+            ready_run_dirs_while_writing = watcher.poll()
+            f.write('"PASS"}\n')
+        # Finishing the write doesn't change the run directory's mtime
+        qc_check_complete_stat = os.stat(qc_check_complete_path)
+        os.utime(qc_check_complete_path, (qc_check_complete_stat.st_atime, qc_check_complete_stat.st_mtime + 1))
+
+        self.assertEqual([run_dir], ready_run_dirs_while_writing)
+        self.assertEqual([run_dir], watcher.poll())
+        self.assertEqual([], watcher.poll())
+
+    def test_make_run_watcher_poll(self):
+        config = {"run_parent_dirs": [self.run_parent_dir], "watch_method": "poll"}
+        watcher = watch.make_run_watcher(config)
+
+        self.assertIsInstance(watcher, watch.PollingRunWatcher)
+
+    @unittest.skipIf(watch.inotify_simple is None, "inotify_simple is not installed")
+    def test_inotify_watcher_marker_file_in_new_run_dir(self):
+        watcher = watch.InotifyRunWatcher([self.run_parent_dir])
+        run_dir = self._make_run_dir(SIMULATED_RUN_ID)
+        self.assertEqual([], watcher.wait_for_runs(0.1))
+        self._touch(os.path.join(run_dir, "upload_complete.json"))
+        ready_run_dirs = watcher.wait_for_runs(1)
+        watcher.close()
+
+        self.assertEqual([run_dir], ready_run_dirs)
+
+    @unittest.skipIf(watch.inotify_simple is None, "inotify_simple is not installed")
+    def test_inotify_watcher_file_in_run_parent_dir_ignored(self):
+        watcher = watch.InotifyRunWatcher([self.run_parent_dir])
+        with open(os.path.join(self.run_parent_dir, "upload_complete.json"), 'w') as f:
+            f.write(json.dumps({}) + '\n')
+        ready_run_dirs = watcher.wait_for_runs(0.1)
+        watched_run_dirs = list(watcher._run_dirs_by_wd.values())
+        watcher.close()
+
+        self.assertEqual([], ready_run_dirs)
+        self.assertEqual([], watched_run_dirs)
+
+    @unittest.skipIf(watch.inotify_simple is None, "inotify_simple is not installed")
+    def test_inotify_watcher_run_dir_watched_until_marker_files_written(self):
+        run_dir = self._make_run_dir(SIMULATED_RUN_ID)
+        self._touch(os.path.join(run_dir, "upload_complete.json"))
+        watcher = watch.InotifyRunWatcher([self.run_parent_dir])
+        qc_check_complete_path = os.path.join(run_dir, "qc_check_complete.json")
+        with open(qc_check_complete_path, 'w') as f:
+            ready_run_dirs_while_writing = watcher.wait_for_runs(0.1)
+            f.write(json.dumps({"overall_pass_fail": "PASS"}) + '\n')
+        ready_run_dirs_after_writing = watcher.wait_for_runs(1)
+        watcher.close()
+
+        self.assertEqual([], ready_run_dirs_while_writing)
+        self.assertEqual([run_dir], ready_run_dirs_after_writing)
+
+if __name__ == '__main__':
+    unittest.main()